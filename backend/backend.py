@@ -1,73 +1,388 @@
 import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File
-from supabase import create_client, Client
+from fastapi import FastAPI, Form, Request, Response, UploadFile, File
+from supabase import acreate_client, AsyncClient
 from pathlib import Path
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 import io
-import requests
-from roboflow import Roboflow
+import httpx
 import time
-import tempfile
 import base64
 import json
+import re
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
+from backend.chat_cache import TtlLruCache, canonical_query, plan_key
+from backend.detection_writer import DetectionWriter
+from backend.detectors import create_detector
+from backend.jobs import DEFAULT_DB_PATH, JobStore, QueueFull, WorkerPool, callback_allowed, wait_for
+from backend.observability import REQUEST_SECONDS, STAGE_ERRORS, configure_logging, render, timed
+from backend.ocr_engines import OcrError, create_ocr_engine
+from backend.plate_index import PlateIndex
+from backend.preprocess import prepare_image
+from backend.resilience import CircuitOpenError, Overloaded, dependency, snapshot
+from backend.sightings import DAY, InvalidQuery, SightingAggregates, scan_sightings
+from backend.single_flight import SingleFlight
+from backend.startup import Startup
+from backend.stream import StreamOptions, ingest, source_allowed, to_sse
+from backend.result_cache import ResultCache, content_hash, perceptual_hash
+from backend.vision import VisionTickets, vision_reasons
+# Cold-start timings are measured from here.
+STARTED_AT = time.monotonic()
 BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(BASE_DIR / ".env")
 
-app = FastAPI()
+# LOG_LEVEL (default INFO) and LOG_FORMAT (text or json) control all backend logs.
+configure_logging()
+logger = logging.getLogger(__name__)
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
 if not SUPABASE_URL or not SUPABASE_ANON_KEY:
-    print("WARNING: SUPABASE_URL or SUPABASE_ANON_KEY is not set in .env file")
+    logger.warning("SUPABASE_URL or SUPABASE_ANON_KEY is not set in .env file")
 
-supabase = None
-if SUPABASE_URL:
-    key = SUPABASE_SERVICE_ROLE_KEY or SUPABASE_ANON_KEY
-    if key:
-        supabase = create_client(SUPABASE_URL, key)
+supabase: Optional[AsyncClient] = None
 
 
 API_URL = os.getenv("OCR_API_URL")
 TOKEN = os.getenv("OCR_TOKEN")
 
-if not API_URL or not TOKEN:
-    print("WARNING: OCR_API_URL or OCR_TOKEN is not set in .env file")
-
-WORKSPACE = "itgateinternship"
-PROJECT = "tunisian-license-plate-xe5yl-d8jgs"
-VERSION = 2
-api_key = os.getenv("RF_API_KEY")
+# Remote PaddleOCR by default; OCR_ENGINE=easyocr reads plates in-process.
+OCR_ENGINE = os.getenv("OCR_ENGINE", "paddle").lower()
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", "8"))
 
-rf = Roboflow(api_key=api_key)
-project = rf.workspace(WORKSPACE).project(PROJECT)
-model = project.version(VERSION).model
+if OCR_ENGINE == "paddle" and (not API_URL or not TOKEN):
+    logger.warning("OCR_API_URL or OCR_TOKEN is not set in .env file")
 
 CONFIDENCE_THRESHOLD = 0.3
 OVERLAP = 0.3
-RETRY_DELAY = 5
+
+# Hosted Roboflow by default; DETECTOR_ENGINE=onnx runs a local model instead.
+# Created in the background on startup, like the OCR engine and Supabase.
+detector = None
+OCR_TIMEOUT = 60
+DETECTOR_SIZE = (640, 640)
+# Decode large JPEGs at reduced scale (PIL draft mode) before letterboxing.
+DRAFT_DECODE = os.getenv("DRAFT_DECODE", "1") == "1"
+
+# /detect/batch limits: images per request and images per detector batch.
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "32"))
+BATCH_DETECT_SIZE = int(os.getenv("BATCH_DETECT_SIZE", "8"))
+
+# Every box above CONFIDENCE_THRESHOLD is OCR'd; cap concurrent OCR calls per
+# image and (optionally, 0 = unlimited) the number of plates read per image.
+PLATE_OCR_CONCURRENCY = int(os.getenv("PLATE_OCR_CONCURRENCY", "4"))
+MAX_PLATES_PER_IMAGE = int(os.getenv("MAX_PLATES_PER_IMAGE", "0"))
+
+# Per-stage timeouts (seconds) for the post-OCR fan-out in /detect.
+DB_STAGE_TIMEOUT = float(os.getenv("DB_STAGE_TIMEOUT", "5"))
+LOG_STAGE_TIMEOUT = float(os.getenv("LOG_STAGE_TIMEOUT", "15"))
+VISION_STAGE_TIMEOUT = float(os.getenv("VISION_STAGE_TIMEOUT", "30"))
+
+# Cache of /detect responses for repeated frames. Set RESULT_CACHE_TTL=0 to
+# disable. Frames match on identical bytes; RESULT_CACHE_PERCEPTUAL=1 also
+# matches a perceptual hash within RESULT_CACHE_MAX_DISTANCE bits. That hash is
+# of the whole scene, so even at 0 bits a different car stopped in the same
+# spot in front of a fixed camera can be handed the previous car's plate and
+# driver record. Only enable it where that is acceptable.
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "30"))
+RESULT_CACHE_PERCEPTUAL = os.getenv("RESULT_CACHE_PERCEPTUAL", "0") == "1"
+result_cache = ResultCache(
+    max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "512")),
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+    ttl=RESULT_CACHE_TTL,
+    max_distance=int(os.getenv("RESULT_CACHE_MAX_DISTANCE", "0")) if RESULT_CACHE_PERCEPTUAL else None,
+) if RESULT_CACHE_TTL > 0 else None
 
 OLLAMA_API = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/generate")
 MODEL_NAME = "llama3.2:3b"
 VISION_MODEL = "glm-ocr:latest"
 
+# When the vision model double-checks a read: "gated" (default) only for
+# malformed digits, detector confidence below VISION_MIN_CONFIDENCE or a
+# database miss; "always"; or "off". VISION_MODE=deferred returns a ticket
+# from /detect and the verdict is fetched later from /vision/{ticket}.
+VISION_POLICY = os.getenv("VISION_POLICY", "gated").lower()
+VISION_MODE = os.getenv("VISION_MODE", "inline").lower()
+VISION_MIN_CONFIDENCE = float(os.getenv("VISION_MIN_CONFIDENCE", "0.6"))
+vision_tickets: Optional[VisionTickets] = None
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+
+# Shared pooled client for the OCR and Ollama calls, created on startup.
+http_client: Optional[httpx.AsyncClient] = None
+ocr_engine = None
+
+# The detector, OCR engine and Supabase initialize in the background (with
+# retries) while the app already serves; /readyz reports when they are up.
+# WARMUP=1 also runs a blank frame through the detector (and local OCR) and
+# waits for the plate index before reporting ready. STARTUP_BLOCKING=1
+# holds the server back until ready, for deployments without a readiness
+# probe.
+WARMUP = os.getenv("WARMUP", "0") == "1"
+STARTUP_BLOCKING = os.getenv("STARTUP_BLOCKING", "0") == "1"
+STARTUP_TIMEOUT = float(os.getenv("STARTUP_TIMEOUT", "120"))
+startup: Optional[Startup] = None
+
+# In-process copy of license_plates used by the /detect driver lookups.
+PLATE_INDEX_ENABLED = os.getenv("PLATE_INDEX_ENABLED", "1") == "1"
+PLATE_INDEX_REFRESH_INTERVAL = float(os.getenv("PLATE_INDEX_REFRESH_INTERVAL", "60"))
+PLATE_INDEX_STALENESS = float(os.getenv("PLATE_INDEX_STALENESS", "300"))
+PLATE_INDEX_UPDATED_COLUMN = os.getenv("PLATE_INDEX_UPDATED_COLUMN", "registration_date")
+# The incremental refresh only sees rows whose PLATE_INDEX_UPDATED_COLUMN
+# moved; edits to other columns and deletions arrive with the full reload.
+PLATE_INDEX_FULL_RELOAD = float(os.getenv("PLATE_INDEX_FULL_RELOAD", str(PLATE_INDEX_STALENESS)))
+# Exact misses are matched to the registered plate within this many digit
+# edits (0 disables); ties are reported but not resolved.
+PLATE_FUZZY_DISTANCE = int(os.getenv("PLATE_FUZZY_DISTANCE", "1"))
+plate_index: Optional[PlateIndex] = None
+plate_index_task: Optional[asyncio.Task] = None
+
+# Identical in-flight work is done once: /detect calls for the same image
+# bytes and driver lookups for the same plate share one pipeline run.
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "1") == "1"
+detect_flights = SingleFlight("detect") if COALESCE_ENABLED else None
+lookup_flights = SingleFlight("plate_lookup") if COALESCE_ENABLED else None
+
+# Background writer for crop uploads and detection_logs inserts.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "1000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "50"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+LOG_UPLOAD_CONCURRENCY = int(os.getenv("LOG_UPLOAD_CONCURRENCY", "4"))
+detection_writer: Optional[DetectionWriter] = None
+
+# Sightings per plate per hour and day, kept in memory from detection_logs
+# so chat analytics are answered without fetching raw rows. Hourly buckets
+# cover the last SIGHTINGS_HOURLY_DAYS, daily ones SIGHTINGS_DAILY_DAYS.
+SIGHTINGS_ENABLED = os.getenv("SIGHTINGS_ENABLED", "1") == "1"
+SIGHTINGS_REFRESH_INTERVAL = float(os.getenv("SIGHTINGS_REFRESH_INTERVAL", "30"))
+SIGHTINGS_HOURLY_DAYS = float(os.getenv("SIGHTINGS_HOURLY_DAYS", "7"))
+SIGHTINGS_DAILY_DAYS = float(os.getenv("SIGHTINGS_DAILY_DAYS", "400"))
+# Until the first load finishes, an aggregate question waits up to
+# SIGHTINGS_LOAD_WAIT seconds for it, then scans only the last
+# SIGHTINGS_SCAN_DAYS of detection_logs. Answers cut short that way say so
+# and are not cached.
+SIGHTINGS_LOAD_WAIT = float(os.getenv("SIGHTINGS_LOAD_WAIT", "2"))
+SIGHTINGS_SCAN_DAYS = float(os.getenv("SIGHTINGS_SCAN_DAYS", "7"))
+sightings: Optional[SightingAggregates] = None
+sightings_task: Optional[asyncio.Task] = None
+
+# Asynchronous /jobs API: a SQLite-backed queue served by JOB_WORKERS worker
+# processes, each running JOB_WORKER_CONCURRENCY jobs at once. Each worker is
+# a full pipeline replica, so none are started by default (JOB_WORKERS=0):
+# run `python -m backend.jobs` against the same database, or set JOB_WORKERS.
+# The API is off unless JOB_WORKERS is set or JOBS_ENABLED=1 (for external
+# workers), so jobs are never accepted with nothing to run them.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "0"))
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "1" if JOB_WORKERS > 0 else "0") == "1"
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", str(DEFAULT_DB_PATH))
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "60"))
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "30"))
+# URL prefixes (comma-separated, e.g. "https://hooks.example.com/jobs/") a
+# job's callback_url must start with. Empty turns callbacks off.
+JOB_CALLBACK_ALLOWED_PREFIXES = [
+    p.strip() for p in os.getenv("JOB_CALLBACK_ALLOWED_PREFIXES", "").split(",") if p.strip()
+]
+JOB_MONITOR_INTERVAL = 5.0
+job_store: Optional[JobStore] = None
+job_workers: Optional[WorkerPool] = None
+
+
+async def monitor_jobs():
+    """Restart dead workers, requeue jobs whose worker went quiet, purge old results."""
+    while True:
+        try:
+            if job_workers:
+                job_workers.check()
+            await asyncio.to_thread(job_store.recover, JOB_STALE_AFTER)
+            await asyncio.to_thread(job_store.purge)
+        except Exception:
+            # e.g. a locked database or a failed restart; try again next round.
+            logger.exception("Job monitor pass failed")
+        await asyncio.sleep(JOB_MONITOR_INTERVAL)
+
+
+async def init_detector():
+    global detector
+    # The hosted engine resolves the Roboflow project over the network.
+    detector = await asyncio.to_thread(create_detector, confidence=CONFIDENCE_THRESHOLD, overlap=OVERLAP)
+
+async def init_ocr():
+    global ocr_engine
+    if OCR_ENGINE == "paddle":
+        ocr_engine = create_ocr_engine(
+            OCR_ENGINE, http_client=http_client, url=API_URL, token=TOKEN,
+            timeout=OCR_TIMEOUT, concurrency=OCR_CONCURRENCY,
+        )
+    else:
+        # Local engines load their models here, off the event loop.
+        ocr_engine = await asyncio.to_thread(create_ocr_engine, OCR_ENGINE)
+
+async def init_supabase():
+    global supabase, plate_index, plate_index_task, detection_writer, sightings, sightings_task
+    key = SUPABASE_SERVICE_ROLE_KEY or SUPABASE_ANON_KEY
+    if not SUPABASE_URL or not key:
+        return
+    supabase = await acreate_client(SUPABASE_URL, key)
+    if PLATE_INDEX_ENABLED:
+        plate_index = PlateIndex(
+            supabase,
+            updated_column=PLATE_INDEX_UPDATED_COLUMN,
+            page_size=int(os.getenv("PLATE_INDEX_PAGE_SIZE", "1000")),
+            staleness=PLATE_INDEX_STALENESS,
+            miss_ttl=float(os.getenv("PLATE_INDEX_MISS_TTL", "60")),
+            miss_max_entries=int(os.getenv("PLATE_INDEX_MISS_MAX_ENTRIES", "10000")),
+            fuzzy_distance=PLATE_FUZZY_DISTANCE,
+            full_reload=PLATE_INDEX_FULL_RELOAD,
+        )
+        plate_index_task = asyncio.create_task(plate_index.run(PLATE_INDEX_REFRESH_INTERVAL))
+    if SIGHTINGS_ENABLED:
+        sightings = SightingAggregates(
+            supabase,
+            hourly_retention=SIGHTINGS_HOURLY_DAYS * DAY,
+            daily_retention=SIGHTINGS_DAILY_DAYS * DAY,
+            page_size=int(os.getenv("SIGHTINGS_PAGE_SIZE", "1000")),
+        )
+        sightings_task = asyncio.create_task(sightings.run(SIGHTINGS_REFRESH_INTERVAL))
+    detection_writer = DetectionWriter(
+        supabase,
+        SUPABASE_URL,
+        max_queue=LOG_QUEUE_SIZE,
+        batch_size=LOG_BATCH_SIZE,
+        flush_interval=LOG_FLUSH_INTERVAL,
+        upload_concurrency=LOG_UPLOAD_CONCURRENCY,
+        sightings=sightings,
+    )
+    detection_writer.start()
+
+def _blank_jpeg(size):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (128, 128, 128)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+async def warm_detector():
+    prepared = await asyncio.to_thread(decode_image, _blank_jpeg((1280, 960)))
+    await run_detector(prepared.frame)
+
+async def warm_ocr():
+    await ocr_engine.read(base64.b64encode(_blank_jpeg((200, 60))).decode("utf-8"))
+
+async def warm_plate_index():
+    if plate_index:
+        await plate_index.wait_loaded()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client, vision_tickets, startup, job_store, job_workers
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        )
+    )
+    startup = Startup(STARTED_AT, warmup_timeout=float(os.getenv("WARMUP_TIMEOUT", "60")))
+    startup.add("detector", init_detector)
+    startup.add("ocr", init_ocr)
+    startup.add("supabase", init_supabase)
+    if WARMUP:
+        startup.add_warmup("detector", warm_detector)
+        if OCR_ENGINE != "paddle":
+            startup.add_warmup("ocr", warm_ocr)
+        if PLATE_INDEX_ENABLED:
+            startup.add_warmup("plate_index", warm_plate_index)
+    startup.start()
+
+    if VISION_MODE == "deferred" and VISION_POLICY != "off":
+        vision_tickets = VisionTickets(
+            concurrency=int(os.getenv("VISION_CONCURRENCY", "2")),
+            max_pending=int(os.getenv("VISION_MAX_PENDING", "200")),
+            ttl=float(os.getenv("VISION_TICKET_TTL", "600")),
+        )
+    job_monitor_task = None
+    if JOBS_ENABLED:
+        job_store = await asyncio.to_thread(
+            JobStore, JOB_DB_PATH,
+            max_queued=JOB_MAX_QUEUED,
+            max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")),
+            retention=float(os.getenv("JOB_RETENTION", "86400")),
+        )
+        if JOB_WORKERS > 0:
+            job_workers = WorkerPool(JOB_DB_PATH, processes=JOB_WORKERS, concurrency=JOB_WORKER_CONCURRENCY)
+            job_workers.start()
+        job_monitor_task = asyncio.create_task(monitor_jobs())
+    if STARTUP_BLOCKING and not await startup.wait_ready(STARTUP_TIMEOUT):
+        logger.warning("Not ready after %.0fs; serving anyway", STARTUP_TIMEOUT)
+    try:
+        yield
+    finally:
+        await startup.close()
+        if job_monitor_task:
+            job_monitor_task.cancel()
+        if job_workers:
+            await asyncio.to_thread(job_workers.stop, float(os.getenv("JOB_SHUTDOWN_GRACE", "30")))
+        if plate_index_task:
+            plate_index_task.cancel()
+        if sightings_task:
+            sightings_task.cancel()
+        if vision_tickets:
+            await vision_tickets.close()
+        if detection_writer:
+            await detection_writer.close()
+        if ocr_engine:
+            await ocr_engine.close()
+        await http_client.aclose()
+        http_client = None
+
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template so per-request paths don't explode cardinality.
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        REQUEST_SECONDS.labels(endpoint, str(status)).observe(time.perf_counter() - started)
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving, whatever its dependencies are doing."""
+    return {"status": "ok", "uptime_s": round(time.monotonic() - STARTED_AT, 3)}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once every dependency (and warmup) is up, 503 with per-dependency state until then."""
+    report = startup.report() if startup else {"ready": False}
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
+
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render()
+    return Response(content=body, media_type=content_type)
+
 class ChatRequest(BaseModel):
     message: str
     context_plate: Optional[str] = None
     history: Optional[List[dict]] = None
 
-@app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
-    print(f"\n--- New Chat Request ---")
-    print(f"User Message: {request.message}")
-    
-    schema_context = """
+CHAT_SCHEMA_CONTEXT = """
     Database Tables:
     1. license_plates:
        - plate_number (text, primary key, e.g., '125تونس8365')
@@ -89,11 +404,33 @@ async def chat_endpoint(request: ChatRequest):
        - plate_number (text, references license_plates)
        - image_url (text)
        - created_at (timestamp)
+    Sighting aggregates (counts over detection_logs, answered without fetching rows):
+       - "aggregate": "count" (sightings) or "last_seen" (latest sighting per plate)
+       - "group_by" (optional): "plate_number", "day" or "hour"
+       - filters on plate_number, and on created_at with gte/gt/lte/lt/eq and an
+         ISO date, "today", "now-24h", "now-7d" or "now-4w"
     """
-    
-    prompt = f"""
+
+# Query results with at most this many rows are answered from a template
+# instead of a second LLM call (0 always asks the LLM).
+CHAT_TEMPLATE_MAX_ROWS = int(os.getenv("CHAT_TEMPLATE_MAX_ROWS", "10"))
+
+# Parsed query plans keyed by (normalized question, context plate), so a
+# repeated question skips the planning LLM call, and query results keyed by
+# the canonical query. Set either TTL to 0 to disable that cache.
+CHAT_PLAN_CACHE_TTL = float(os.getenv("CHAT_PLAN_CACHE_TTL", "3600"))
+CHAT_RESULT_CACHE_TTL = float(os.getenv("CHAT_RESULT_CACHE_TTL", "30"))
+chat_plan_cache = TtlLruCache(
+    max_entries=int(os.getenv("CHAT_PLAN_CACHE_MAX_ENTRIES", "512")), ttl=CHAT_PLAN_CACHE_TTL,
+) if CHAT_PLAN_CACHE_TTL > 0 else None
+chat_result_cache = TtlLruCache(
+    max_entries=int(os.getenv("CHAT_RESULT_CACHE_MAX_ENTRIES", "256")), ttl=CHAT_RESULT_CACHE_TTL,
+) if CHAT_RESULT_CACHE_TTL > 0 else None
+
+def build_chat_prompt(request):
+    return f"""
     You are an AI assistant for the Tunisian License Plate Reader system.
-    {schema_context}
+    {CHAT_SCHEMA_CONTEXT}
     
     Current plate in focus (if any): {request.context_plate or "None"}
     
@@ -104,6 +441,7 @@ async def chat_endpoint(request: ChatRequest):
     - DO NOT explain your reasoning or SQL logic to the user.
     - DO NOT use joins. We only support single-table queries on 'license_plates' or 'detection_logs'.
     - If the user asks for "all" or multiple records, use the 'limit' parameter (default 10, max 100).
+    - For how many times, how often, busiest plates/days or when a plate was last seen, query 'detection_logs' with an "aggregate" instead of fetching rows. Prefer relative times ("now-7d", "today") to calendar dates.
     - For partial matches (e.g., car makes, names), use the 'ilike' operator.
     - IMPORTANT: When searching for names, use 'ilike' with 'driver_name'.
     - IMPORTANT: If the user says "don't focus on current plate" or asks a general question about other people, ignore the 'Current plate in focus'.
@@ -125,66 +463,15 @@ async def chat_endpoint(request: ChatRequest):
     - Example for "Is there a driver named Hamed?":
       ACTION: QUERY
       DATA: {{"table": "license_plates", "select": "*", "filters": [{{"col": "driver_name", "op": "ilike", "val": "Hamed"}}]}}
+    - Example for "How many times was 125تونس8365 seen this week?":
+      ACTION: QUERY
+      DATA: {{"table": "detection_logs", "aggregate": "count", "filters": [{{"col": "plate_number", "op": "eq", "val": "125تونس8365"}}, {{"col": "created_at", "op": "gte", "val": "now-7d"}}]}}
     """
-    
-    try:
-        try:
-            ollama_res = requests.post(OLLAMA_API, json={
-                "model": MODEL_NAME,
-                "prompt": prompt,
-                "stream": False
-            }, timeout=10)
-        except requests.exceptions.ConnectionError:
-            return JSONResponse(status_code=503, content={"error": "Ollama service is not running. Please start Ollama."})
 
-        if ollama_res.status_code != 200:
-             return JSONResponse(status_code=500, content={"error": f"Ollama error: {ollama_res.text}"})
-        
-        ai_response = ollama_res.json().get("response", "")
-        print(f"AI Response Raw: {ai_response}")
-        
-        if "ACTION: QUERY" in ai_response or (ai_response.strip().startswith("{") and "table" in ai_response):
-            import re
-            json_match = re.search(r"(\{.*\})", ai_response, re.DOTALL)
-            if json_match:
-                try:
-                    query_info = json.loads(json_match.group(1))
-                    table = query_info.get("table", "license_plates")
-                    select = query_info.get("select", "*")
-                    filters = query_info.get("filters", [])
-                    
-                    print(f"AI decided to query {table} (select {select}) with filters {filters}")
-                    
-                    if supabase:
-                        query = supabase.table(table).select(select)
-                        for f in filters:
-                            col = f.get("col")
-                            op = f.get("op", "eq")
-                            val = f.get("val")
-                            
-                            if not col or val is None: continue
-                            
-                            if op == "eq": query = query.eq(col, val)
-                            elif op == "neq": query = query.neq(col, val)
-                            elif op == "gt": query = query.gt(col, val)
-                            elif op == "lt": query = query.lt(col, val)
-                            elif op == "gte": query = query.gte(col, val)
-                            elif op == "lte": query = query.lte(col, val)
-                            elif op == "like": query = query.like(col, val)
-                            elif op == "ilike": query = query.ilike(col, f"%{val}%")
-                        
-                        limit = query_info.get("limit")
-                        if limit:
-                            query = query.limit(int(limit))
-                        
-                        print(f"Executing query on Supabase...")
-                        db_res = query.execute()
-                        results = db_res.data
-                        print(f"Database results found: {len(results)}")
-                        
-                        final_prompt = f"""
+def build_answer_prompt(message, results, truncated=False):
+    prompt = f"""
                         You are an AI assistant for the Tunisian License Plate Reader system.
-                        User asked: {request.message}
+                        User asked: {message}
                         Database results: {json.dumps(results)}
                         
                         Instructions:
@@ -194,252 +481,948 @@ async def chat_endpoint(request: ChatRequest):
                         4. Do NOT mention "JSON", "query", "database", or "ACTION". 
                         5. Do NOT show the raw data. Just the answer.
                         """
-                        
-                        final_res = requests.post(OLLAMA_API, json={
-                            "model": MODEL_NAME,
-                            "prompt": final_prompt,
-                            "stream": False
-                        }, timeout=30)
-                        
-                        answer = final_res.json().get("response", "Error processing final answer.")
-                        return {"answer": answer, "data": results}
-                    else:
-                        return {"answer": "Database connection not available.", "data": []}
-                except Exception as parse_err:
-                    print(f"Error parsing AI query JSON: {parse_err}")
+    if truncated:
+        prompt += f"""6. Say that the results only cover the last {SIGHTINGS_SCAN_DAYS:g} day(s).
+                        """
+    return prompt
+
+def truncation_note():
+    return f"Only sightings from the last {SIGHTINGS_SCAN_DAYS:g} day(s) were counted."
+
+def parse_chat_plan(ai_response):
+    """Split the planner's reply into ``("query", spec)`` or ``("answer", text)``."""
+    if "ACTION: QUERY" in ai_response or (ai_response.strip().startswith("{") and "table" in ai_response):
+        json_match = re.search(r"(\{.*\})", ai_response, re.DOTALL)
+        if json_match:
+            try:
+                return "query", json.loads(json_match.group(1))
+            except json.JSONDecodeError as parse_err:
+                logger.warning("Error parsing AI query JSON: %s", parse_err)
+    return "answer", ai_response.replace("ACTION: ANSWER", "").replace("DATA:", "").strip()
+
+def cached_chat_plan(request):
+    """A previously parsed query plan for this question, or None."""
+    if not chat_plan_cache:
+        return None
+    plan = chat_plan_cache.get(plan_key(request.message, request.context_plate))
+    if plan is not None:
+        logger.info("Chat plan cache hit")
+    return plan
+
+def remember_chat_plan(request, kind, plan):
+    # Only query plans are cached; direct answers are cheap to regenerate and may be conversational.
+    if chat_plan_cache and kind == "query":
+        chat_plan_cache.put(plan_key(request.message, request.context_plate), plan)
+
+async def run_planned_query(request, plan, planned):
+    """Run a query plan; a fresh plan is cached once it has worked, a cached one dropped if it fails.
+
+    Returns ``(results, truncated)`` as :func:`run_chat_query` does.
+    """
+    try:
+        results, truncated = await run_chat_query(plan)
+    except Exception:
+        if not planned and chat_plan_cache:
+            chat_plan_cache.discard(plan_key(request.message, request.context_plate))
+        raise
+    if planned:
+        remember_chat_plan(request, "query", plan)
+    return results, truncated
+
+async def run_chat_query(query_info):
+    """Return ``(results, truncated)``; ``truncated`` means only the last SIGHTINGS_SCAN_DAYS were counted."""
+    if query_info.get("aggregate") and sightings and await sightings.wait_loaded(SIGHTINGS_LOAD_WAIT):
+        results = sightings.query(query_info)
+        logger.info("Chat aggregate answered from sighting aggregates (%d row(s))", len(results))
+        return results, False
+
+    cache_key = canonical_query(query_info) if chat_result_cache else None
+    if chat_result_cache:
+        results = chat_result_cache.get(cache_key)
+        if results is not None:
+            logger.info("Chat result cache hit (%d row(s))", len(results))
+            return results, False
+
+    truncated = False
+    if query_info.get("aggregate"):
+        # Aggregates not loaded (yet): compute them from the matching rows.
+        with timed("db_lookup"):
+            results, truncated = await scan_sightings(supabase, query_info, max_window=SIGHTINGS_SCAN_DAYS * DAY)
+    else:
+        results = await run_table_query(query_info)
+    logger.info("Chat query returned %d row(s)", len(results))
+    # A truncated answer would be served for the full range once the store has loaded.
+    if chat_result_cache and not truncated:
+        chat_result_cache.put(cache_key, results)
+    return results, truncated
+
+async def run_table_query(query_info):
+    table = query_info.get("table", "license_plates")
+    select = query_info.get("select", "*")
+    filters = query_info.get("filters", [])
+
+    logger.info("AI decided to query %s (select %s) with filters %s", table, select, filters)
+
+    query = supabase.table(table).select(select)
+    for f in filters:
+        col = f.get("col")
+        op = f.get("op", "eq")
+        val = f.get("val")
+        
+        if not col or val is None: continue
+        
+        if op == "eq": query = query.eq(col, val)
+        elif op == "neq": query = query.neq(col, val)
+        elif op == "gt": query = query.gt(col, val)
+        elif op == "lt": query = query.lt(col, val)
+        elif op == "gte": query = query.gte(col, val)
+        elif op == "lte": query = query.lte(col, val)
+        elif op == "like": query = query.like(col, val)
+        elif op == "ilike": query = query.ilike(col, f"%{val}%")
+    
+    limit = query_info.get("limit")
+    if limit:
+        query = query.limit(int(limit))
+    
+    with timed("db_lookup"):
+        db_res = await query.execute()
+    return db_res.data
+
+# Field order and labels used by the template formatter.
+PLATE_FIELDS = [
+    ("driver_name", "driver"),
+    ("vehicle_make", "make"),
+    ("vehicle_model", "model"),
+    ("vehicle_year", "year"),
+    ("status", "status"),
+    ("expiry_date", "expires"),
+    ("violations", "violations"),
+    ("created_at", "seen at"),
+    ("day", "day"),
+    ("hour", "hour"),
+    ("sightings", "sightings"),
+    ("plates", "plates"),
+    ("last_seen", "last seen"),
+    ("image_url", "image"),
+]
+
+def _describe_row(row):
+    known = [(label, row[col]) for col, label in PLATE_FIELDS if row.get(col) not in (None, "")]
+    if not known:
+        known = [(col.replace("_", " "), value) for col, value in row.items()
+                 if col != "plate_number" and value not in (None, "")]
+    details = ", ".join(f"{label}: {value}" for label, value in known)
+    if "plate_number" in row:
+        return f"{row['plate_number']} ({details})" if details else str(row["plate_number"])
+    return details
+
+def format_results(results):
+    """Answer small result sets from a template; None means ask the LLM."""
+    if not results:
+        return "No matching records were found."
+    if len(results) > CHAT_TEMPLATE_MAX_ROWS:
+        return None
+    # A single selected column (e.g. driver_name) reads best as a plain list.
+    if all(len(row) == 1 for row in results):
+        values = [str(next(iter(row.values()))) for row in results]
+        return values[0] if len(values) == 1 else "\n".join(f"- {v}" for v in values)
+    if len(results) == 1:
+        return _describe_row(results[0])
+    return f"Found {len(results)} matching records:\n" + "\n".join(f"- {_describe_row(row)}" for row in results)
+
+async def ollama_stream(payload, timeout):
+    """Stream response tokens from Ollama (``stream: true``).
+
+    Only opening the stream is retried through the ``ollama`` dependency;
+    once tokens have been relayed a failure is surfaced instead. The
+    dependency's concurrency slot is held until the stream ends, since the
+    model is busy for all of it.
+    """
+    async def attempt():
+        request = http_client.build_request("POST", OLLAMA_API, json={**payload, "stream": True}, timeout=timeout)
+        response = await http_client.send(request, stream=True)
+        if response.status_code >= 500:
+            await response.aclose()
+            response.raise_for_status()
+        return response
+
+    ollama = dependency("ollama")
+    async with ollama.admitted():
+        response = await ollama.call(attempt, admit=False)
+        try:
+            if response.status_code != 200:
+                await response.aread()
+                raise RuntimeError(f"Ollama error: {response.text}")
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    break
+        finally:
+            await response.aclose()
 
-        answer = ai_response.replace("ACTION: ANSWER", "").replace("DATA:", "").strip()
-        return {"answer": answer}
+@app.post("/chat")
+async def chat_endpoint(request: ChatRequest):
+    logger.info("Chat request", extra={"chat_message": request.message})
+    
+    try:
+        kind, plan = "query", cached_chat_plan(request)
+        planned = plan is None
+        if planned:
+            try:
+                ollama_res = await ollama_generate({
+                    "model": MODEL_NAME,
+                    "prompt": build_chat_prompt(request),
+                    "stream": False
+                }, timeout=10)
+            except (httpx.ConnectError, CircuitOpenError):
+                return JSONResponse(status_code=503, content={"error": "Ollama service is not running. Please start Ollama."})
 
+            if ollama_res.status_code != 200:
+                 return JSONResponse(status_code=500, content={"error": f"Ollama error: {ollama_res.text}"})
+
+            ai_response = ollama_res.json().get("response", "")
+            logger.debug("AI response raw: %s", ai_response)
+
+            kind, plan = parse_chat_plan(ai_response)
+        if kind == "answer":
+            return {"answer": plan}
+        if not supabase:
+            return {"answer": "Database connection not available.", "data": []}
+
+        results, truncated = await run_planned_query(request, plan, planned)
+        answer = format_results(results)
+        if answer is None:
+            final_res = await ollama_generate({
+                "model": MODEL_NAME,
+                "prompt": build_answer_prompt(request.message, results, truncated),
+                "stream": False
+            }, timeout=30)
+            answer = final_res.json().get("response", "Error processing final answer.")
+        elif truncated:
+            answer = f"{answer}\n{truncation_note()}"
+        return {"answer": answer, "data": results, "truncated": truncated}
+
+    except Overloaded as e:
+        return JSONResponse(status_code=429, content={"error": str(e), "retry_after": e.retry_after},
+                            headers={"Retry-After": str(e.retry_after)})
+    except InvalidQuery as e:
+        logger.warning("Chat query rejected: %s", e)
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
-        print(f"Chat error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Chat error")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+async def chat_events(request):
+    """Events for /chat/stream: ``token`` deltas, ``data`` rows, then ``done``."""
+    kind, plan = "query", cached_chat_plan(request)
+    planned = plan is None
+    if planned:
+        plan_tokens = []
+        answer = []
+        relaying = False
+        async for token in ollama_stream({"model": MODEL_NAME, "prompt": build_chat_prompt(request)}, timeout=10):
+            plan_tokens.append(token)
+            if relaying:
+                answer.append(token)
+                yield {"event": "token", "text": token}
+                continue
+            # Direct answers are relayed as soon as the planner commits to one.
+            so_far = "".join(plan_tokens)
+            marker = re.search(r"ACTION:\s*ANSWER\s*(DATA:)?", so_far)
+            if marker and (marker.group(1) or len(so_far) > marker.end() + 5):
+                relaying = True
+                rest = so_far[marker.end():].lstrip()
+                if rest:
+                    answer.append(rest)
+                    yield {"event": "token", "text": rest}
+
+        if relaying:
+            yield {"event": "done", "answer": "".join(answer).strip(), "formatter": "direct"}
+            return
+
+        kind, plan = parse_chat_plan("".join(plan_tokens))
+
+    if kind == "answer":
+        yield {"event": "token", "text": plan}
+        yield {"event": "done", "answer": plan, "formatter": "direct"}
+        return
+    if not supabase:
+        text = "Database connection not available."
+        yield {"event": "token", "text": text}
+        yield {"event": "done", "answer": text, "data": [], "formatter": "direct"}
+        return
+
+    results, truncated = await run_planned_query(request, plan, planned)
+    yield {"event": "data", "rows": results, "truncated": truncated}
+    text = format_results(results)
+    if text is not None:
+        if truncated:
+            text = f"{text}\n{truncation_note()}"
+        yield {"event": "token", "text": text}
+        yield {"event": "done", "answer": text, "formatter": "template"}
+        return
+
+    answer = []
+    async for token in ollama_stream(
+        {"model": MODEL_NAME, "prompt": build_answer_prompt(request.message, results, truncated)}, timeout=30
+    ):
+        answer.append(token)
+        yield {"event": "token", "text": token}
+    yield {"event": "done", "answer": "".join(answer).strip(), "formatter": "llm"}
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """Server-Sent Events version of /chat that relays tokens as they arrive."""
+    logger.info("Streaming chat request", extra={"chat_message": request.message})
+
+    async def events():
+        try:
+            async for event in chat_events(request):
+                yield to_sse(event)
+        except Overloaded as e:
+            yield to_sse({"event": "error", "status_code": 429, "error": str(e), "retry_after": e.retry_after})
+        except InvalidQuery as e:
+            logger.warning("Chat query rejected: %s", e)
+            yield to_sse({"event": "error", "status_code": 400, "error": str(e)})
+        except (httpx.ConnectError, CircuitOpenError):
+            yield to_sse({"event": "error", "status_code": 503,
+                          "error": "Ollama service is not running. Please start Ollama."})
+        except Exception as e:
+            logger.exception("Streaming chat error")
+            yield to_sse({"event": "error", "status_code": 500, "error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.post("/detect")
 async def detect_plates(image: UploadFile = File(...)):
-    print(f"\n--- New Detection Request: {image.filename} ---")
+    logger.info("Detection request", extra={"upload": image.filename})
     image_data = await image.read()
-    
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-        temp_file.write(image_data)
-        temp_path = temp_file.name
-    
+    status_code, content = await run_detection(image_data)
+    if status_code != 200:
+        headers = {"Retry-After": str(content["retry_after"])} if "retry_after" in content else None
+        return JSONResponse(status_code=status_code, content=content, headers=headers)
+    return content
+
+async def run_detection(image_data):
+    """The single-image detect pipeline; returns ``(status_code, body)``.
+
+    Shared by ``/detect`` and the job workers. Concurrent calls for the
+    same image bytes run the pipeline once.
+    """
+    if not detect_flights:
+        return await _run_detection(image_data)
+    return await detect_flights.do(content_hash(image_data), lambda: _run_detection(image_data))
+
+async def _run_detection(image_data):
     try:
-        print(f"Opening image: {temp_path}")
-        img = Image.open(temp_path)
-        img = img.resize((640, 640))
-        img.save(temp_path)
-        
-        print("Running Roboflow prediction...")
-        success = False
-        retries = 0
-        while not success and retries < 3:
-            try:
-                prediction = model.predict(temp_path, confidence=CONFIDENCE_THRESHOLD, overlap=OVERLAP)
-                success = True
-                print("Roboflow prediction successful")
-            except Exception as e:
-                retries += 1
-                print(f"Roboflow retry {retries}/3 after error: {e}")
-                time.sleep(RETRY_DELAY)
-        
-        if not success:
-            return JSONResponse(status_code=500, content={"error": "Prediction failed after retries"})
+        cache_key = content_hash(image_data) if result_cache else None
+        if result_cache:
+            cached, tier = result_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Result cache hit (%s)", tier)
+                return 200, {**cached, "cache": tier}
+
+        prepared = await asyncio.to_thread(decode_image, image_data)
+
+        phash = None
+        if result_cache and result_cache.perceptual:
+            phash = perceptual_hash(prepared.letterboxed())
+            cached, tier = result_cache.get(cache_key, phash)
+            if cached is not None:
+                logger.info("Result cache hit (%s)", tier)
+                return 200, {**cached, "cache": tier}
         
-        predictions = prediction.json().get("predictions", [])
+        predictions = prepared.transform.to_source(await run_detector(prepared.frame))
         
         if not predictions:
-            print("No plates detected in image")
-            return JSONResponse(status_code=404, content={"error": "No plates detected"})
-        
-        print(f"Detected {len(predictions)} potential plate(s)")
-        p = predictions[0]
-        x, y, w, h = p["x"], p["y"], p["width"], p["height"]
-        left = int(x - w / 2)
-        top = int(y - h / 2)
-        right = int(x + w / 2)
-        bottom = int(y + h / 2)
-        
-        cropped = img.crop((left, top, right, bottom))
-        
-        print("Preparing for PaddleOCR...")
-        cropped_buffer = io.BytesIO()
-        cropped.save(cropped_buffer, format="JPEG")
-        cropped_data = cropped_buffer.getvalue()
-        file_data = base64.b64encode(cropped_data).decode("ascii")
-        
-        headers = {
-            "Authorization": f"token {TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "file": file_data,
-            "fileType": 1,
-            "useDocOrientationClassify": False,
-            "useDocUnwarping": False,
-            "useChartRecognition": False,
-        }
-        
-        print(f"Calling PaddleOCR API: {API_URL}")
-        
-        success_ocr = False
-        retries_ocr = 0
-        OCR_TIMEOUT = 60
-        
-        while not success_ocr and retries_ocr < 3:
-            try:
-                ocr_response = requests.post(API_URL, json=payload, headers=headers, timeout=OCR_TIMEOUT)
-                if ocr_response.status_code == 200:
-                    success_ocr = True
-                else:
-                    retries_ocr += 1
-                    print(f"PaddleOCR API failed with status {ocr_response.status_code}. Retry {retries_ocr}/3...")
-                    time.sleep(RETRY_DELAY)
-            except requests.exceptions.Timeout:
-                retries_ocr += 1
-                print(f"PaddleOCR API timed out. Retry {retries_ocr}/3...")
-                time.sleep(RETRY_DELAY)
-            except Exception as e:
-                retries_ocr += 1
-                print(f"PaddleOCR error: {e}. Retry {retries_ocr}/3...")
-                time.sleep(RETRY_DELAY)
-
-        if not success_ocr:
-            print("PaddleOCR failed after multiple attempts")
-            return JSONResponse(status_code=502, content={"error": "OCR processing failed after retries"})
-        
-        ocr_json = ocr_response.json()
-        result = ocr_json.get("result", {})
-        if not result.get("layoutParsingResults"):
-            print("No layout parsing results from OCR")
-            return JSONResponse(status_code=422, content={"error": "No OCR text found"})
+            logger.info("No plates detected in image")
+            return 404, {"error": "No plates detected"}
         
-        raw_text = result["layoutParsingResults"][0].get("markdown", {}).get("text", "")
-        if not raw_text:
-             print("Raw OCR text is empty")
-             return JSONResponse(status_code=422, content={"error": "No text found in OCR result"})
-        
-        print(f"OCR Raw Text: {raw_text}")
-        digits = "".join(c for c in raw_text if c.isdigit())
-        plate_number = f"{digits[:3].zfill(3)}تونس{digits[-4:].zfill(4)}"
-        print(f"Processed Plate Number: {plate_number}")
-        
-        print("Querying database for driver info...")
-        db_result = query_database(plate_number)
-        
-        print("Logging detection and uploading cropped image...")
-        try:
-            image_url = log_detection(plate_number, cropped_data)
-        except Exception as e:
-            print(f"Logging failed: {e}")
-            image_url = None
+        plate_predictions = select_plate_predictions(predictions)
+        if not plate_predictions:
+            logger.info("No plates above the confidence threshold")
+            return 404, {"error": "No plates detected"}
+
+        logger.debug("Detected %d potential plate(s), reading %d", len(predictions), len(plate_predictions))
+        img = await asyncio.to_thread(prepared.original)
+        ocr_slots = asyncio.Semaphore(PLATE_OCR_CONCURRENCY)
+        outcomes = await asyncio.gather(
+            *(read_plate(img, p, ocr_slots) for p in plate_predictions), return_exceptions=True
+        )
 
-        print("Starting AI Vision validation...")
-        vision_result = validate_with_vision(file_data, plate_number)
+        plates = []
+        for p, outcome in zip(plate_predictions, outcomes):
+            if isinstance(outcome, DetectionError):
+                plates.append({"prediction": p, "status_code": outcome.status_code, **outcome.body()})
+            elif isinstance(outcome, BaseException):
+                logger.error("Reading plate failed", exc_info=outcome)
+                plates.append({"prediction": p, "status_code": 500, "error": str(outcome)})
+            else:
+                plates.append(outcome)
 
-        if image_url is not None:
-            image_url = str(image_url)
+        read = [plate for plate in plates if "error" not in plate]
+        if not read:
+            first = plates[0]
+            error = {k: first[k] for k in ("error", "retry_after") if k in first}
+            return first["status_code"], {**error, "plates": plates}
 
+        # The first successfully read plate stays at the top level for existing clients.
+        primary = read[0]
         response_data = {
-            "plate_number": plate_number,
-            "driver_info": db_result[0] if (db_result and len(db_result) > 0) else None,
-            "image_url": image_url,
-            "vision_validation": vision_result,
+            "plate_number": primary["plate_number"],
+            "driver_info": primary["driver_info"],
+            "image_url": primary["image_url"],
+            "vision_validation": primary["vision_validation"],
+            "plates": plates,
             "predictions": predictions
         }
+        if "stage_errors" in primary:
+            response_data["stage_errors"] = primary["stage_errors"]
+        elif result_cache and len(read) == len(plates):
+            result_cache.put(cache_key, phash, response_data)
         
-        print(f"Success! Returning response: {response_data}")
-        return response_data
+        logger.info(
+            "Detection complete",
+            extra={"plate_number": primary["plate_number"], "plates": len(plates), "read": len(read)},
+        )
+        return 200, response_data
+    except DetectionError as e:
+        return e.status_code, e.body()
     except Exception as e:
-        print(f"CRITICAL ERROR in /detect: {e}")
-        import traceback
-        traceback.print_exc()
-        return JSONResponse(status_code=500, content={"error": str(e)})
-    finally:
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            try:
-                os.unlink(temp_path)
-                print(f"Cleaned up temp file: {temp_path}")
-            except:
-                pass
+        logger.exception("Unhandled error in detection")
+        return 500, {"error": str(e)}
+
+# Directories and URL prefixes (comma-separated) that POST /stream may read
+# from, e.g. "data/test_videos,rtsp://cameras.local/". Empty disables the
+# endpoint; `python -m backend.stream` is not restricted.
+STREAM_ALLOWED_SOURCES = [s.strip() for s in os.getenv("STREAM_ALLOWED_SOURCES", "").split(",") if s.strip()]
+
+class StreamRequest(BaseModel):
+    source: str
+    max_frames: int = 0
+    active_interval: Optional[float] = None
+    idle_interval: Optional[float] = None
+    max_reads_per_track: Optional[int] = None
+
+def ingest_events(source, options=None):
+    """Wire the /detect building blocks into the video ingestion loop."""
+    async def detect(frame):
+        return select_plate_predictions(await run_detector(frame))
+
+    async def lookup(plate_number):
+        rows = await query_database(plate_number)
+        return rows[0] if rows else fuzzy_lookup(plate_number)[0]
+
+    return ingest(source, detect, run_ocr, lookup, detector_size=DETECTOR_SIZE, options=options)
+
+@app.post("/stream")
+async def stream_plates(request: StreamRequest):
+    if not source_allowed(request.source, STREAM_ALLOWED_SOURCES):
+        logger.warning("Stream source rejected", extra={"source": request.source})
+        return JSONResponse(status_code=403, content={"error": "Video source is not in STREAM_ALLOWED_SOURCES"})
+    logger.info("Stream ingestion started", extra={"source": request.source})
+    options = StreamOptions(max_frames=request.max_frames)
+    for name in ("active_interval", "idle_interval", "max_reads_per_track"):
+        if getattr(request, name) is not None:
+            setattr(options, name, getattr(request, name))
+
+    async def events():
+        try:
+            async for event in ingest_events(request.source, options):
+                yield to_sse(event)
+        except Exception as e:
+            logger.exception("Stream ingestion error")
+            yield to_sse({"event": "error", "error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/resilience")
+async def resilience_state():
+    return snapshot()
+
+@app.get("/coalescing")
+async def coalescing_stats():
+    if not COALESCE_ENABLED:
+        return {"enabled": False}
+    return {"enabled": True, "detect": detect_flights.stats(), "plate_lookup": lookup_flights.stats()}
+
+@app.get("/chat/cache")
+async def chat_cache_stats():
+    return {
+        "plans": chat_plan_cache.stats() if chat_plan_cache else {"enabled": False},
+        "results": chat_result_cache.stats() if chat_result_cache else {"enabled": False},
+    }
+
+@app.get("/vision/{ticket}")
+async def vision_verdict(ticket: str):
+    verdict = vision_tickets.get(ticket) if vision_tickets else None
+    if verdict is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown or expired vision ticket"})
+    return verdict
+
+@app.get("/vision")
+async def vision_stats():
+    return {
+        "policy": VISION_POLICY,
+        "mode": VISION_MODE,
+        **(vision_tickets.stats() if vision_tickets else {}),
+    }
+
+@app.post("/jobs")
+async def create_job(
+    images: List[UploadFile] = File(...),
+    priority: int = Form(0),
+    callback_url: Optional[str] = Form(None),
+):
+    """Queue images for the detect pipeline; poll ``/jobs/{id}`` for the results."""
+    if not job_store:
+        return JSONResponse(status_code=503, content={"error": "Jobs are disabled"})
+    if len(images) > MAX_BATCH_SIZE:
+        return JSONResponse(status_code=413, content={"error": f"At most {MAX_BATCH_SIZE} images per job"})
+    if callback_url and not callback_allowed(callback_url, JOB_CALLBACK_ALLOWED_PREFIXES):
+        logger.warning("Job callback rejected", extra={"callback_url": callback_url})
+        return JSONResponse(status_code=400, content={"error": "callback_url is not in JOB_CALLBACK_ALLOWED_PREFIXES"})
+    payload = [(image.filename, await image.read()) for image in images]
+    try:
+        job_id = await asyncio.to_thread(job_store.enqueue, payload, priority, callback_url)
+    except QueueFull as e:
+        logger.warning("Job queue full", extra={"reason": str(e)})
+        return JSONResponse(
+            status_code=429,
+            content={"error": "Job queue is full"},
+            headers={"Retry-After": str(int(JOB_MONITOR_INTERVAL))},
+        )
+    logger.info("Job queued", extra={"job": job_id, "images": len(payload), "priority": priority})
+    return JSONResponse(status_code=202, content={"id": job_id, "status": "queued"})
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """The job's state and, once finished, per-image results; ``wait`` long-polls up to JOB_MAX_WAIT seconds."""
+    if not job_store:
+        return JSONResponse(status_code=503, content={"error": "Jobs are disabled"})
+    job = await wait_for(job_store, job_id, min(max(wait, 0.0), JOB_MAX_WAIT))
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown job"})
+    return job
+
+@app.get("/jobs")
+async def job_stats():
+    if not job_store:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        **await asyncio.to_thread(job_store.stats),
+        "workers": job_workers.stats() if job_workers else {"processes": 0},
+    }
+
+@app.get("/detect/cache")
+async def detect_cache_stats():
+    if not result_cache:
+        return {"enabled": False}
+    return {"enabled": True, **result_cache.stats()}
+
+@app.get("/plates/index")
+async def plate_index_stats():
+    if not plate_index:
+        return {"enabled": False}
+    return {"enabled": True, **plate_index.stats()}
+
+@app.get("/sightings")
+async def sightings_stats():
+    if not sightings:
+        return {"enabled": False}
+    return {"enabled": True, **sightings.stats()}
+
+@app.get("/detect/logs")
+async def detection_writer_stats():
+    if not detection_writer:
+        return {"enabled": False}
+    return {"enabled": True, **detection_writer.stats()}
+
+@app.post("/detect/batch")
+async def detect_plates_batch(images: List[UploadFile] = File(...)):
+    logger.info("Batch detection request", extra={"images": len(images)})
+    if len(images) > MAX_BATCH_SIZE:
+        return JSONResponse(status_code=413, content={"error": f"At most {MAX_BATCH_SIZE} images per batch"})
+
+    uploads = [(image.filename, await image.read()) for image in images]
+    decoded = await asyncio.gather(
+        *(asyncio.to_thread(decode_image, data) for _, data in uploads), return_exceptions=True
+    )
+
+    # Detector calls are grouped into batches of BATCH_DETECT_SIZE frames.
+    frames = [(i, d.frame) for i, d in enumerate(decoded) if not isinstance(d, BaseException)]
+    detections = {}
+    for start in range(0, len(frames), BATCH_DETECT_SIZE):
+        chunk = frames[start:start + BATCH_DETECT_SIZE]
+        try:
+            results = await run_detector_batch([frame for _, frame in chunk])
+            results = [decoded[i].transform.to_source(r) for (i, _), r in zip(chunk, results)]
+        except DetectionError as e:
+            results = [e] * len(chunk)
+        detections.update(zip((i for i, _ in chunk), results))
+
+    def selected(i):
+        if isinstance(decoded[i], BaseException):
+            raise decoded[i]
+        if isinstance(detections[i], BaseException):
+            raise detections[i]
+        plate_predictions = select_plate_predictions(detections[i])
+        if not plate_predictions:
+            raise DetectionError(404, "No plates detected")
+        return plate_predictions
+
+    async def crop_all(i):
+        plate_predictions = selected(i)
+        img = await asyncio.to_thread(decoded[i].original)
+        return await asyncio.gather(*(
+            asyncio.to_thread(crop_plate, img, p) for p in plate_predictions
+        ))
+
+    crops = await asyncio.gather(*(crop_all(i) for i in range(len(uploads))), return_exceptions=True)
+
+    # Every crop across the batch goes to the OCR engine as one batch.
+    flat = [file_data for c in crops if not isinstance(c, BaseException) for _, file_data in c]
+    readings = iter(await run_ocr_batch(flat))
+
+    outcomes = []
+    for i, c in enumerate(crops):
+        if isinstance(c, BaseException):
+            outcomes.append(c)
+            continue
+        reads = [next(readings) for _ in c]
+        # An image succeeds if at least one of its plates was read.
+        plates = [
+            (plate_number, cropped_data, prediction)
+            for plate_number, (cropped_data, _), prediction in zip(reads, c, selected(i))
+            if not isinstance(plate_number, BaseException)
+        ]
+        outcomes.append((plates, detections[i]) if plates else reads[0])
+
+    detected = [plate for o in outcomes if not isinstance(o, BaseException) for plate in o[0]]
+    drivers = await query_database_many({plate_number for plate_number, _, _ in detected})
+    image_urls = await asyncio.gather(*(
+        run_stage("logging", log_detection(plate_number, cropped_data), LOG_STAGE_TIMEOUT)
+        for plate_number, cropped_data, _ in detected
+    ))
+    image_urls = iter(image_urls)
+
+    results = []
+    for (filename, _), outcome in zip(uploads, outcomes):
+        if isinstance(outcome, DetectionError):
+            results.append({"filename": filename, "status_code": outcome.status_code, **outcome.body()})
+            continue
+        if isinstance(outcome, BaseException):
+            logger.error("Batch item %s failed", filename, exc_info=outcome)
+            results.append({"filename": filename, "status_code": 500, "error": str(outcome)})
+            continue
+
+        read, predictions = outcome
+        plates = []
+        for plate_number, _, prediction in read:
+            image_url, log_error = next(image_urls)
+            driver_info, plate_match = drivers.get(plate_number), None
+            if driver_info is None:
+                driver_info, plate_match = fuzzy_lookup(plate_number)
+            plate = {
+                "plate_number": plate_number,
+                "driver_info": driver_info,
+                "image_url": str(image_url) if image_url is not None else None,
+                "prediction": prediction,
+            }
+            if plate_match:
+                plate["plate_match"] = plate_match
+            if log_error:
+                plate["stage_errors"] = {"logging": log_error}
+            plates.append(plate)
+
+        results.append({
+            "filename": filename,
+            "plate_number": plates[0]["plate_number"],
+            "driver_info": plates[0]["driver_info"],
+            "image_url": plates[0]["image_url"],
+            "plates": plates,
+            "predictions": predictions,
+        })
 
-def query_database(plate_number):
+    failed = sum(1 for r in results if "error" in r)
+    logger.info("Batch complete: %d succeeded, %d failed", len(results) - failed, failed)
+    return {"results": results, "succeeded": len(results) - failed, "failed": failed}
+
+class DetectionError(Exception):
+    """A pipeline failure that maps onto an HTTP status for the client."""
+
+    def __init__(self, status_code, message, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+    def body(self):
+        if self.retry_after is None:
+            return {"error": self.message}
+        return {"error": self.message, "retry_after": self.retry_after}
+
+async def run_detector(frame):
+    return (await run_detector_batch([frame]))[0]
+
+async def run_detector_batch(frames):
+    if detector is None:
+        raise DetectionError(503, "Detector is not ready yet")
+    try:
+        with timed("detect"):
+            predictions = await dependency("detector").call(asyncio.to_thread, detector.predict_batch, frames)
+    except Overloaded as e:
+        raise DetectionError(429, str(e), e.retry_after)
+    except CircuitOpenError as e:
+        raise DetectionError(503, str(e))
+    except Exception as e:
+        logger.error("%s prediction failed after retries: %s", detector.name, e)
+        raise DetectionError(500, "Prediction failed after retries")
+
+    logger.debug("%s prediction successful (%d frame(s))", detector.name, len(frames))
+    return predictions
+
+def parse_plate_number(raw_text):
+    if not raw_text:
+        logger.info("Raw OCR text is empty")
+        raise DetectionError(422, "No text found in OCR result")
+
+    digits = "".join(c for c in raw_text if c.isdigit())
+    plate_number = f"{digits[:3].zfill(3)}تونس{digits[-4:].zfill(4)}"
+    logger.debug("OCR raw text %r parsed as %s", raw_text, plate_number)
+    return plate_number
+
+async def run_ocr_text(file_data):
+    """Raw OCR text for one crop."""
+    if ocr_engine is None:
+        raise DetectionError(503, "OCR engine is not ready yet")
+    try:
+        with timed("ocr"):
+            return await ocr_engine.read(file_data)
+    except OcrError as e:
+        raise DetectionError(e.status_code, e.message, e.retry_after)
+
+async def run_ocr(file_data):
+    return parse_plate_number(await run_ocr_text(file_data))
+
+async def run_ocr_batch(crops):
+    """OCR several crops at once; failed items come back as DetectionError."""
+    if ocr_engine is None:
+        return [DetectionError(503, "OCR engine is not ready yet")] * len(crops)
+    results = []
+    with timed("ocr"):
+        raw_texts = await ocr_engine.read_batch(crops)
+    for raw_text in raw_texts:
+        if isinstance(raw_text, OcrError):
+            results.append(DetectionError(raw_text.status_code, raw_text.message, raw_text.retry_after))
+            continue
+        try:
+            results.append(parse_plate_number(raw_text))
+        except DetectionError as e:
+            results.append(e)
+    return results
+
+def select_plate_predictions(predictions):
+    """Every box above the confidence threshold, most confident first."""
+    selected = [p for p in predictions if p.get("confidence", 1.0) >= CONFIDENCE_THRESHOLD]
+    selected.sort(key=lambda p: p.get("confidence", 1.0), reverse=True)
+    if MAX_PLATES_PER_IMAGE:
+        selected = selected[:MAX_PLATES_PER_IMAGE]
+    return selected
+
+async def read_plate(img, prediction, ocr_slots):
+    """Crop and OCR one box, then run its post-OCR stages.
+
+    The database lookup and logging run concurrently; the vision check
+    follows when the policy calls for it, since a database miss is one of
+    its triggers.
+    """
+    cropped_data, file_data = await asyncio.to_thread(crop_plate, img, prediction)
+    async with ocr_slots:
+        raw_text = await run_ocr_text(file_data)
+    plate_number = parse_plate_number(raw_text)
+
+    (db_result, db_error), (image_url, log_error) = await asyncio.gather(
+        run_stage("database", query_database(plate_number), DB_STAGE_TIMEOUT),
+        run_stage("logging", log_detection(plate_number, cropped_data), LOG_STAGE_TIMEOUT),
+    )
+    plate_match = None
+    if not db_result and db_error is None:
+        row, plate_match = fuzzy_lookup(plate_number)
+        db_result = [row] if row else db_result
+    vision_result, vision_error = await check_with_vision(
+        file_data, plate_number, raw_text, prediction, driver_found=bool(db_result),
+    )
+
+    stage_errors = {
+        name: error
+        for name, error in (("database", db_error), ("logging", log_error), ("vision", vision_error))
+        if error
+    }
+
+    plate = {
+        "plate_number": plate_number,
+        "driver_info": db_result[0] if (db_result and len(db_result) > 0) else None,
+        "image_url": str(image_url) if image_url is not None else None,
+        "vision_validation": vision_result if vision_error is None else {"error": vision_error},
+        "prediction": prediction
+    }
+    if plate_match:
+        plate["plate_match"] = plate_match
+    if stage_errors:
+        plate["stage_errors"] = stage_errors
+    return plate
+
+async def check_with_vision(file_data, plate_number, raw_text, prediction, driver_found):
+    """Apply VISION_POLICY/VISION_MODE; returns (validation, error) like run_stage."""
+    if VISION_POLICY == "off":
+        return {"status": "skipped", "reasons": []}, None
+    if VISION_POLICY == "always":
+        reasons = ["always"]
+    else:
+        reasons = vision_reasons(raw_text, prediction, driver_found, VISION_MIN_CONFIDENCE)
+        if not reasons:
+            return {"status": "skipped", "reasons": []}, None
+
+    if vision_tickets:
+        ticket = vision_tickets.submit(
+            lambda: validate_with_vision(file_data, plate_number), VISION_STAGE_TIMEOUT, reasons,
+        )
+        if ticket is None:
+            return {"status": "shed", "reasons": reasons}, None
+        return {"status": "pending", "ticket": ticket, "reasons": reasons}, None
+
+    result, error = await run_stage("vision", validate_with_vision(file_data, plate_number), VISION_STAGE_TIMEOUT)
+    if error:
+        return None, error
+    return {"status": "failed" if "error" in result else "completed", **result, "reasons": reasons}, None
+
+async def run_stage(name, coro, timeout):
+    """Await one post-OCR stage, returning (result, error) instead of raising."""
+    try:
+        return await asyncio.wait_for(coro, timeout), None
+    except asyncio.TimeoutError:
+        STAGE_ERRORS.labels(name, "timeout").inc()
+        logger.warning("Stage '%s' timed out after %ss", name, timeout)
+        return None, f"{name} timed out after {timeout}s"
+    except Exception as e:
+        STAGE_ERRORS.labels(name, "error").inc()
+        logger.warning("Stage '%s' failed: %s", name, e)
+        return None, str(e)
+
+def decode_image(image_data):
+    """Decode an upload in memory and letterbox it for the detector.
+
+    The returned PreparedImage holds the BGR detector frame, the transform
+    back to source coordinates and a lazily decoded full-resolution image
+    that plates are cropped from.
+    """
+    try:
+        return prepare_image(image_data, DETECTOR_SIZE, draft=DRAFT_DECODE)
+    except UnidentifiedImageError:
+        raise DetectionError(400, "Uploaded file is not a readable image")
+
+def crop_plate(img, prediction):
+    """Crop one predicted box and encode it once.
+
+    The JPEG bytes go to storage and the base64 string is shared by the OCR
+    and vision calls, so the crop is never re-encoded downstream.
+    """
+    x, y, w, h = prediction["x"], prediction["y"], prediction["width"], prediction["height"]
+    left = int(x - w / 2)
+    top = int(y - h / 2)
+    right = int(x + w / 2)
+    bottom = int(y + h / 2)
+
+    with timed("crop"):
+        cropped = img.crop((left, top, right, bottom))
+        cropped_buffer = io.BytesIO()
+        cropped.save(cropped_buffer, format="JPEG")
+        cropped_data = cropped_buffer.getvalue()
+    return cropped_data, base64.b64encode(cropped_data).decode("ascii")
+
+async def query_database(plate_number):
     if not supabase:
         return []
+    if lookup_flights:
+        return await lookup_flights.do(plate_number, lambda: _query_database(plate_number))
+    return await _query_database(plate_number)
+
+async def _query_database(plate_number):
     try:
-        response = supabase.table("license_plates").select("*").eq("plate_number", plate_number).execute()
-        return response.data
+        with timed("db_lookup"):
+            if plate_index:
+                row = (await plate_index.lookup_many([plate_number])).get(plate_number)
+                return [row] if row else []
+            response = await supabase.table("license_plates").select("*").eq("plate_number", plate_number).execute()
+            return response.data
     except Exception as e:
-        print(f"Database query error: {e}")
+        logger.error("Database query error: %s", e)
         return []
 
-def log_detection(plate_number, image_bytes):
-    if not supabase:
-        return None
-    
-    try:
-        safe_plate = "".join(c for c in plate_number if c.isalnum() and ord(c) < 128)
-        file_name = f"detection_{int(time.time())}_{safe_plate}.jpg"
-        bucket_name = "plates"
-        
-        supabase.storage.from_(bucket_name).upload(
-            path=file_name,
-            file=image_bytes,
-            file_options={"content-type": "image/jpeg"}
-        )
-        
-        res = supabase.storage.from_(bucket_name).get_public_url(file_name)
-        
-        if isinstance(res, str):
-            image_url = res
-        elif hasattr(res, "public_url"):
-            image_url = res.public_url
-        elif isinstance(res, dict):
-            image_url = res.get("publicURL") or res.get("public_url") or str(res)
-        else:
-            image_url = str(res)
+def fuzzy_lookup(plate_number):
+    """Exact-miss fallback: ``(row, match)`` for the registered plate an OCR misread most likely is."""
+    if not plate_index:
+        return None, None
+    return plate_index.fuzzy_match(plate_number)
 
-        log_data = {
-            "plate_number": plate_number,
-            "image_url": image_url,
-        }
-        
-        try:
-            serializable_log_data = {
-                "plate_number": str(plate_number),
-                "image_url": str(image_url) if image_url else None
-            }
-            print(f"Attempting to insert log: {serializable_log_data}")
-            supabase.table("detection_logs").insert(serializable_log_data).execute()
-            print("Insert successful")
-        except Exception as e:
-            print(f"Error inserting into detection_logs: {e}")
-            
-        return image_url
-        
+async def query_database_many(plate_numbers):
+    """Resolve several plates with one `in` query, keyed by plate number."""
+    if not supabase or not plate_numbers:
+        return {}
+    try:
+        with timed("db_lookup"):
+            if plate_index:
+                return await plate_index.lookup_many(plate_numbers)
+            response = await supabase.table("license_plates").select("*").in_("plate_number", list(plate_numbers)).execute()
+            return {row["plate_number"]: row for row in response.data}
     except Exception as e:
-        print(f"Error in log_detection: {e}")
+        logger.error("Database batch query error: %s", e)
+        return {}
+
+async def log_detection(plate_number, image_bytes):
+    """Queue the crop upload and log insert on the background writer."""
+    if not detection_writer:
         return None
+    with timed("logging"):
+        return detection_writer.submit(plate_number, image_bytes)
+
+async def ollama_generate(payload, timeout):
+    """POST to Ollama through the ``ollama`` (or, with images, ``vision``) dependency.
 
-def validate_with_vision(image_base64, ocr_result):
-    print(f"--- AI Vision Validation with {VISION_MODEL} ---")
+    5xx responses count as failures and are retried; other statuses are
+    returned for the caller to handle.
+    """
+    async def attempt():
+        response = await http_client.post(OLLAMA_API, json=payload, timeout=timeout)
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    name = "vision" if payload.get("images") else "ollama"
+    return await dependency(name).call(attempt)
+
+async def validate_with_vision(image_base64, ocr_result):
     prompt = f"Extract the license plate number from this image of a Tunisian license plate. The previous OCR extraction gave '{ocr_result}'. Check if this is correct and provide the final plate number (only digits). Just the digits, please."
     
     try:
-        response = requests.post(OLLAMA_API, json={
-            "model": VISION_MODEL,
-            "prompt": prompt,
-            "images": [image_base64],
-            "stream": False,
-            "options": {"temperature": 0}
-        }, timeout=30)
+        with timed("vision"):
+            response = await ollama_generate({
+                "model": VISION_MODEL,
+                "prompt": prompt,
+                "images": [image_base64],
+                "stream": False,
+                "options": {"temperature": 0}
+            }, timeout=30)
         
         if response.status_code == 200:
             ai_text = response.json().get("response", "").strip()
-            print(f"AI Vision response: {ai_text}")
+            logger.debug("AI vision response: %s", ai_text)
             
             ai_digits = "".join(c for c in ai_text if c.isdigit())
             
@@ -453,8 +1436,8 @@ def validate_with_vision(image_base64, ocr_result):
                 "message": "AI confirms OCR result." if match else f"AI suggests different result: {ai_digits} vs OCR {ocr_digits}"
             }
         else:
-            print(f"Ollama Vision API error: {response.status_code} - {response.text}")
+            logger.warning("Ollama vision API error: %s - %s", response.status_code, response.text)
             return {"error": f"Vision API error: {response.status_code}"}
     except Exception as e:
-        print(f"Error in validate_with_vision: {e}")
+        logger.warning("Error in validate_with_vision: %s", e)
         return {"error": str(e)}
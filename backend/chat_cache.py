@@ -0,0 +1,81 @@
+import json
+import re
+import time
+from collections import OrderedDict
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(question):
+    """Case-, punctuation- and whitespace-insensitive form of a chat question."""
+    return _SPACES.sub(" ", _PUNCTUATION.sub(" ", question.lower())).strip()
+
+
+def plan_key(question, context_plate):
+    return normalize_question(question), (context_plate or "").strip()
+
+
+def canonical_query(query_info):
+    """Stable key for a query spec: defaults filled in, filters sorted, JSON-encoded."""
+    filters = sorted(
+        (
+            {"col": f.get("col"), "op": f.get("op", "eq"), "val": f.get("val")}
+            for f in query_info.get("filters", [])
+            if f.get("col") and f.get("val") is not None
+        ),
+        key=lambda f: (f["col"], f["op"], str(f["val"])),
+    )
+    return json.dumps({
+        "table": query_info.get("table", "license_plates"),
+        "select": query_info.get("select", "*"),
+        "filters": filters,
+        "limit": query_info.get("limit"),
+        "aggregate": query_info.get("aggregate"),
+        "group_by": query_info.get("group_by"),
+    }, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class TtlLruCache:
+    """Bounded LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, max_entries=256, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """The cached value, or None on a miss."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import time
+import uuid
+from urllib.parse import quote
+
+from backend.observability import timed
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class DetectionWriter:
+    """Background writer for crop uploads and ``detection_logs`` rows.
+
+    ``submit`` only enqueues and returns the public URL, which is computed
+    locally from the object key, so logging adds no latency to /detect. A
+    worker task drains the bounded queue in batches: uploads run with
+    limited concurrency and the log rows of each batch go in as one bulk
+    insert. When the queue is full new detections are shed (counted, not
+    logged). ``close`` flushes everything still queued. Inserted rows are
+    also counted in ``sightings`` (a :class:`SightingAggregates`), if given.
+    """
+
+    def __init__(self, client, supabase_url, bucket="plates", table="detection_logs",
+                 max_queue=1000, batch_size=50, flush_interval=1.0, upload_concurrency=4, sightings=None):
+        self.client = client
+        self.sightings = sightings
+        self.bucket = bucket
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._public_base = f"{supabase_url.rstrip('/')}/storage/v1/object/public/{bucket}/"
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._upload_slots = asyncio.Semaphore(upload_concurrency)
+        self._task = None
+        self.submitted = 0
+        self.shed = 0
+        self.uploaded = 0
+        self.upload_failures = 0
+        self.inserted = 0
+        self.insert_failures = 0
+
+    def public_url(self, file_name):
+        return self._public_base + quote(file_name)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def submit(self, plate_number, image_bytes):
+        """Queue one detection; returns its image URL, or None if it was shed."""
+        safe_plate = "".join(c for c in plate_number if c.isalnum() and ord(c) < 128)
+        file_name = f"detection_{int(time.time())}_{safe_plate}_{uuid.uuid4().hex[:8]}.jpg"
+        image_url = self.public_url(file_name)
+        try:
+            self._queue.put_nowait((file_name, image_bytes, {"plate_number": str(plate_number), "image_url": image_url}))
+        except asyncio.QueueFull:
+            self.shed += 1
+            logger.warning("Detection log queue full, shedding log", extra={"plate_number": plate_number})
+            return None
+        self.submitted += 1
+        return image_url
+
+    async def close(self):
+        """Flush queued detections and stop the worker."""
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def _next_batch(self):
+        item = await self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._next_batch()
+            if batch:
+                try:
+                    with timed("log_flush"):
+                        await self._write(batch)
+                except Exception:
+                    logger.exception("Detection writer batch failed")
+
+    async def _upload(self, file_name, image_bytes):
+        async with self._upload_slots:
+            try:
+                await self.client.storage.from_(self.bucket).upload(
+                    path=file_name,
+                    file=image_bytes,
+                    file_options={"content-type": "image/jpeg"}
+                )
+                self.uploaded += 1
+                return True
+            except Exception as e:
+                self.upload_failures += 1
+                logger.warning("Error uploading %s: %s", file_name, e)
+                return False
+
+    async def _write(self, batch):
+        uploaded = await asyncio.gather(*(self._upload(file_name, data) for file_name, data, _ in batch))
+        rows = [row for (_, _, row), ok in zip(batch, uploaded) if ok]
+        if not rows:
+            return
+        try:
+            response = await self.client.table(self.table).insert(rows).execute()
+            self.inserted += len(rows)
+        except Exception as e:
+            self.insert_failures += len(rows)
+            logger.error("Error inserting %d row(s) into %s: %s", len(rows), self.table, e)
+            return
+        if self.sightings is not None:
+            # The inserted rows carry their id and created_at when the insert returns them.
+            self.sightings.record(response.data or rows)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "submitted": self.submitted,
+            "shed": self.shed,
+            "uploaded": self.uploaded,
+            "upload_failures": self.upload_failures,
+            "inserted": self.inserted,
+            "insert_failures": self.insert_failures,
+        }
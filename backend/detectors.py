@@ -0,0 +1,254 @@
+"""Plate detector engines.
+
+Every engine takes a BGR ``numpy`` array (or an image path) and returns
+Roboflow-style predictions, i.e. dicts with ``x``/``y`` (box centre),
+``width``, ``height``, ``confidence`` and ``class`` in the input image's pixel
+coordinates. Pick an engine with ``DETECTOR_ENGINE`` (``roboflow``,
+``roboflow-http`` or ``onnx``) or pass ``engine=`` to :func:`create_detector`.
+"""
+import base64
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+WORKSPACE = "itgateinternship"
+PROJECT = "tunisian-license-plate-xe5yl-d8jgs"
+VERSION = 2
+
+
+def _load(image):
+    if isinstance(image, (str, os.PathLike)):
+        frame = cv2.imread(str(image))
+        if frame is None:
+            raise ValueError(f"Could not read image: {image}")
+        return frame
+    return image
+
+
+class Detector:
+    """Base interface; engines override :meth:`predict` and may batch."""
+
+    name = "base"
+
+    def predict(self, image):
+        raise NotImplementedError
+
+    def predict_batch(self, images):
+        return [self.predict(image) for image in images]
+
+
+class RoboflowDetector(Detector):
+    """The hosted Roboflow model, one HTTPS call per image."""
+
+    name = "roboflow"
+
+    def __init__(self, api_key=None, workspace=WORKSPACE, project=PROJECT, version=VERSION,
+                 confidence=0.3, overlap=0.3, batch_workers=4):
+        from roboflow import Roboflow
+
+        rf = Roboflow(api_key=api_key or os.getenv("RF_API_KEY"))
+        self.model = rf.workspace(workspace).project(project).version(version).model
+        # The SDK takes percentages; accept fractions like the rest of the app.
+        self.confidence = confidence * 100 if confidence <= 1 else confidence
+        self.overlap = overlap * 100 if overlap <= 1 else overlap
+        self._pool = ThreadPoolExecutor(max_workers=batch_workers, thread_name_prefix="roboflow")
+
+    def predict(self, image):
+        if isinstance(image, os.PathLike):
+            image = str(image)
+        prediction = self.model.predict(image, confidence=self.confidence, overlap=self.overlap)
+        return prediction.json().get("predictions", [])
+
+    def predict_batch(self, images):
+        # The hosted API has no multi-image call, so overlap the round trips.
+        if len(images) < 2:
+            return [self.predict(image) for image in images]
+        return list(self._pool.map(self.predict, images))
+
+
+class RoboflowHttpDetector(Detector):
+    """The hosted Roboflow model called over its inference HTTP API directly.
+
+    Same model and predictions as :class:`RoboflowDetector`, without the SDK:
+    no workspace lookup at startup, one pooled keep-alive client, and a
+    configurable endpoint (``ROBOFLOW_API_URL``) so it can point at a
+    self-hosted inference server or a local stand-in.
+    """
+
+    name = "roboflow-http"
+
+    def __init__(self, api_key=None, project=PROJECT, version=VERSION, confidence=0.3, overlap=0.3,
+                 api_url=None, timeout=30, batch_workers=4):
+        import httpx
+
+        api_url = (api_url or os.getenv("ROBOFLOW_API_URL", "https://detect.roboflow.com")).rstrip("/")
+        self.url = f"{api_url}/{project}/{version}"
+        self.params = {
+            "api_key": api_key or os.getenv("RF_API_KEY"),
+            "confidence": confidence * 100 if confidence <= 1 else confidence,
+            "overlap": overlap * 100 if overlap <= 1 else overlap,
+        }
+        self.client = httpx.Client(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=batch_workers, max_keepalive_connections=batch_workers),
+        )
+        self._pool = ThreadPoolExecutor(max_workers=batch_workers, thread_name_prefix="roboflow-http")
+
+    def predict(self, image):
+        ok, buffer = cv2.imencode(".jpg", _load(image))
+        if not ok:
+            raise ValueError("Could not encode image for Roboflow")
+        response = self.client.post(
+            self.url,
+            params=self.params,
+            content=base64.b64encode(buffer),
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+        response.raise_for_status()
+        return response.json().get("predictions", [])
+
+    def predict_batch(self, images):
+        if len(images) < 2:
+            return [self.predict(image) for image in images]
+        return list(self._pool.map(self.predict, images))
+
+
+def _nms(boxes, scores, iou_threshold):
+    """Greedy non-maximum suppression over ``[x1, y1, x2, y2]`` boxes."""
+    order = scores.argsort()[::-1]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(boxes[i, 0], boxes[order[1:], 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[order[1:], 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[order[1:], 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[order[1:], 3])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][iou <= iou_threshold]
+    return keep
+
+
+class OnnxDetector(Detector):
+    """A YOLO export run locally with ONNX Runtime on the CPU.
+
+    Keeps ``sessions`` warm inference sessions in a pool so concurrent
+    callers don't serialize on one session, splitting the cores between
+    them. Models exported with a dynamic batch axis get true batched
+    inference in :meth:`predict_batch`.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path, confidence=0.3, overlap=0.3, sessions=2, threads=None,
+                 class_names=("license-plate",)):
+        import onnxruntime as ort
+
+        self.confidence = confidence / 100 if confidence > 1 else confidence
+        self.overlap = overlap / 100 if overlap > 1 else overlap
+        self.class_names = class_names
+        threads = threads or max(1, (os.cpu_count() or 1) // sessions)
+
+        self._sessions = queue.Queue()
+        for _ in range(sessions):
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+            session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+            self._sessions.put(session)
+
+        session = self._sessions.queue[0]
+        model_input = session.get_inputs()[0]
+        self.input_name = model_input.name
+        _, _, height, width = model_input.shape
+        self.input_size = (int(width), int(height))
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+
+        # Warm every session so the first request doesn't pay for allocation.
+        blank = np.zeros((self.input_size[1], self.input_size[0], 3), np.uint8)
+        for _ in range(sessions):
+            self.predict(blank)
+
+    def _preprocess(self, frame):
+        resized = cv2.resize(frame, self.input_size)
+        blob = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0
+        return blob.transpose(2, 0, 1)
+
+    def _run(self, batch):
+        session = self._sessions.get()
+        try:
+            return session.run(None, {self.input_name: batch})[0]
+        finally:
+            self._sessions.put(session)
+
+    def _decode(self, output, frame_shape):
+        # YOLOv8/11 layout: (4 + classes, anchors) with centre-format boxes.
+        output = output.T
+        class_scores = output[:, 4:]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_ids)), class_ids]
+        mask = scores >= self.confidence
+        if not mask.any():
+            return []
+        centres, scores, class_ids = output[mask, :4], scores[mask], class_ids[mask]
+
+        scale_x = frame_shape[1] / self.input_size[0]
+        scale_y = frame_shape[0] / self.input_size[1]
+        cx, cy = centres[:, 0] * scale_x, centres[:, 1] * scale_y
+        w, h = centres[:, 2] * scale_x, centres[:, 3] * scale_y
+        corners = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+        predictions = []
+        for i in _nms(corners, scores, self.overlap):
+            class_id = int(class_ids[i])
+            predictions.append({
+                "x": float(cx[i]),
+                "y": float(cy[i]),
+                "width": float(w[i]),
+                "height": float(h[i]),
+                "confidence": float(scores[i]),
+                "class": self.class_names[class_id] if class_id < len(self.class_names) else str(class_id),
+                "class_id": class_id,
+            })
+        return predictions
+
+    def predict(self, image):
+        frame = _load(image)
+        output = self._run(self._preprocess(frame)[None])
+        return self._decode(output[0], frame.shape)
+
+    def predict_batch(self, images):
+        frames = [_load(image) for image in images]
+        if not self.dynamic_batch or len(frames) < 2:
+            return [self.predict(frame) for frame in frames]
+        outputs = self._run(np.stack([self._preprocess(frame) for frame in frames]))
+        return [self._decode(output, frame.shape) for output, frame in zip(outputs, frames)]
+
+
+def create_detector(engine=None, confidence=0.3, overlap=0.3,
+                    workspace=WORKSPACE, project=PROJECT, version=VERSION, **kwargs):
+    """Build the configured detector engine (``DETECTOR_ENGINE``, default roboflow).
+
+    ``workspace``/``project``/``version`` only apply to the hosted engine.
+    """
+    engine = (engine or os.getenv("DETECTOR_ENGINE", "roboflow")).lower()
+    if engine == "roboflow":
+        return RoboflowDetector(workspace=workspace, project=project, version=version,
+                                confidence=confidence, overlap=overlap, **kwargs)
+    if engine == "roboflow-http":
+        return RoboflowHttpDetector(project=project, version=version,
+                                    confidence=confidence, overlap=overlap, **kwargs)
+    if engine == "onnx":
+        model_path = kwargs.pop("model_path", None) or os.getenv("ONNX_MODEL_PATH")
+        if not model_path:
+            raise ValueError("DETECTOR_ENGINE=onnx requires ONNX_MODEL_PATH")
+        kwargs.setdefault("sessions", int(os.getenv("ONNX_SESSIONS", "2")))
+        if os.getenv("ONNX_THREADS"):
+            kwargs.setdefault("threads", int(os.getenv("ONNX_THREADS")))
+        return OnnxDetector(model_path, confidence=confidence, overlap=overlap, **kwargs)
+    raise ValueError(f"Unknown DETECTOR_ENGINE: {engine}")
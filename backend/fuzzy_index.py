@@ -0,0 +1,104 @@
+from collections import defaultdict
+
+
+def plate_key(plate_number):
+    """The series and number digits of a plate, e.g. ``125تونس8365`` -> ``1258365``."""
+    return "".join(c for c in plate_number if c.isdigit())
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance between ``a`` and ``b``, or ``limit + 1`` once it exceeds ``limit``."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) == len(b):
+        # One edit between equal lengths can only be a substitution.
+        mismatches = sum(ca != cb for ca, cb in zip(a, b))
+        if mismatches <= 1 or limit <= 1:
+            return min(mismatches, limit + 1)
+    elif limit <= 1:
+        # Lengths differ by one: a single edit must be one insertion.
+        shorter, longer = sorted((a, b), key=len)
+        i = next((i for i, (cs, cl) in enumerate(zip(shorter, longer)) if cs != cl), len(shorter))
+        return 1 if shorter[i:] == longer[i + 1:] else limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+def _deletions(key, depth):
+    """``key`` and every string reachable from it by up to ``depth`` single-character deletions."""
+    variants = {key}
+    frontier = {key}
+    for _ in range(depth):
+        frontier = {v[:i] + v[i + 1:] for v in frontier for i in range(len(v))}
+        variants |= frontier
+    return variants
+
+
+class FuzzyPlateIndex:
+    """Nearest registered plates within a small edit distance of an OCR read.
+
+    A deletion-neighbourhood index: every plate key is stored under each
+    string obtainable by deleting up to ``max_distance`` of its digits. Two
+    keys within edit distance d always share such a variant, so a lookup
+    only probes the query's own variants and verifies the few candidates
+    found, without scanning the registered plates. At distance 1 that is
+    tens of microseconds even for 100k plates; distance 2 stores up to 29
+    variants per 7-digit key and, in a dense registry, reads with no close
+    match can take a few milliseconds.
+    """
+
+    def __init__(self, max_distance=1):
+        self.max_distance = max_distance
+        self._variants = defaultdict(set)  # deletion variant -> plate keys
+        self._plates = defaultdict(set)  # plate key -> plate numbers
+
+    def add(self, plate_number):
+        key = plate_key(plate_number)
+        if not key:
+            return
+        if key not in self._plates:
+            for variant in _deletions(key, self.max_distance):
+                self._variants[variant].add(key)
+        self._plates[key].add(plate_number)
+
+    def nearest(self, plate_number):
+        """``(distance, plate_numbers)`` for the closest registered plates, or None.
+
+        Searches outwards one edit at a time and stops at the first distance
+        with a match, so the common single-digit misread only probes the
+        handful of one-deletion variants.
+        """
+        key = plate_key(plate_number)
+        if not key:
+            return None
+        probed = set()
+        seen = set()
+        farther = []  # candidates not yet within the depth searched
+        for depth in range(self.max_distance + 1):
+            variants = _deletions(key, depth) - probed
+            probed |= variants
+            for variant in variants:
+                for candidate in self._variants.get(variant, ()):
+                    if candidate not in seen:
+                        seen.add(candidate)
+                        farther.append(candidate)
+            distances = [(edit_distance(key, c, depth), c) for c in farther]
+            closest = [(distance, c) for distance, c in distances if distance <= depth]
+            if closest:
+                best = min(distance for distance, _ in closest)
+                return best, sorted(p for distance, c in closest if distance == best for p in self._plates[c])
+            farther = [c for _, c in distances]
+        return None
+
+    def __len__(self):
+        return len(self._plates)
+
+    def stats(self):
+        return {"max_distance": self.max_distance, "keys": len(self._plates), "variants": len(self._variants)}
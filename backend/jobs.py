@@ -0,0 +1,440 @@
+"""Persistent job queue and worker processes for asynchronous detection.
+
+Jobs and their images live in a SQLite database, so anything queued
+survives a restart of the API. Workers are separate processes, each
+running the backend's own lifespan (HTTP pool, OCR engine, Supabase,
+detection writer) and up to ``concurrency`` jobs at a time through the
+same pipeline as ``/detect``.
+
+Workers claim the highest-priority, oldest queued job and heartbeat while
+it runs. A job whose heartbeat goes stale (its worker died or the API was
+restarted mid-job) is put back in the queue, up to ``max_attempts`` runs.
+
+Workers can also run on their own against the same database::
+
+    python -m backend.jobs --processes 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import closing, contextmanager
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from fastapi.encoders import jsonable_encoder
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = Path(__file__).resolve().parent.parent / "jobs.db"
+TERMINAL = ("completed", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    callback_url TEXT,
+    image_count INTEGER NOT NULL,
+    results TEXT,
+    timings TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at);
+CREATE TABLE IF NOT EXISTS job_images (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    filename TEXT,
+    data BLOB NOT NULL,
+    PRIMARY KEY (job_id, position)
+);
+"""
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobStore:
+    """SQLite job table shared by the API process and the workers.
+
+    Every call opens its own short-lived connection, so a store can be used
+    from any thread or process; async code calls it via ``asyncio.to_thread``.
+    """
+
+    def __init__(self, path, max_queued=1000, max_attempts=3, retention=86400.0):
+        self.path = str(path)
+        self.max_queued = max_queued
+        self.max_attempts = max_attempts
+        self.retention = retention
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def enqueue(self, images, priority=0, callback_url=None):
+        """Queue ``images`` (``(filename, bytes)`` pairs); returns the job id.
+
+        Raises :class:`QueueFull` when ``max_queued`` jobs are already waiting.
+        """
+        job_id = uuid.uuid4().hex
+        with self._transaction() as conn:
+            (queued,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+            if queued >= self.max_queued:
+                raise QueueFull(f"{queued} jobs already queued")
+            conn.execute(
+                "INSERT INTO jobs (id, status, priority, created_at, callback_url, image_count)"
+                " VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, priority, time.time(), callback_url, len(images)),
+            )
+            conn.executemany(
+                "INSERT INTO job_images (job_id, position, filename, data) VALUES (?, ?, ?, ?)",
+                [(job_id, i, filename, data) for i, (filename, data) in enumerate(images)],
+            )
+        return job_id
+
+    def claim(self, worker):
+        """Mark the next queued job running for ``worker``; returns it with its images, or None."""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority DESC, created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ?,"
+                " attempts = attempts + 1, worker = ? WHERE id = ?",
+                (now, now, worker, row["id"]),
+            )
+            images = conn.execute(
+                "SELECT filename, data FROM job_images WHERE job_id = ? ORDER BY position", (row["id"],)
+            ).fetchall()
+        job = self._describe(row)
+        job.update(status="running", started_at=now, attempts=row["attempts"] + 1, worker=worker)
+        job["images"] = [(image["filename"], image["data"]) for image in images]
+        return job
+
+    def heartbeat(self, job_id, worker):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time(), job_id, worker),
+            )
+
+    def finish(self, job_id, worker, status, results=None, timings=None, error=None):
+        """Record the outcome; ignored if the job was meanwhile reclaimed by another worker."""
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, results = ?, timings = ?, error = ?"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (status, time.time(), json.dumps(results) if results is not None else None,
+                 json.dumps(timings) if timings is not None else None, error, job_id, worker),
+            ).rowcount
+            if updated:
+                conn.execute("DELETE FROM job_images WHERE job_id = ?", (job_id,))
+        return bool(updated)
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._describe(row) if row else None
+
+    def recover(self, stale_after):
+        """Requeue running jobs whose heartbeat is older than ``stale_after`` seconds.
+
+        Jobs that already used up ``max_attempts`` fail instead, so an image
+        that crashes its worker cannot take the pool down forever.
+        """
+        cutoff = time.time() - stale_after
+        with self._transaction() as conn:
+            failed = conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = ?"
+                " WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?",
+                (time.time(), f"worker lost {self.max_attempts} times", cutoff, self.max_attempts),
+            ).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL"
+                " WHERE status = 'running' AND heartbeat_at < ?",
+                (cutoff,),
+            ).rowcount
+            if failed:
+                conn.execute(
+                    "DELETE FROM job_images WHERE job_id IN (SELECT id FROM jobs WHERE status = 'failed')"
+                )
+        if requeued or failed:
+            logger.warning("Recovered stale jobs", extra={"requeued": requeued, "failed": failed})
+        return requeued, failed
+
+    def purge(self):
+        """Drop finished jobs older than ``retention`` seconds."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status IN ('completed', 'failed') AND finished_at < ?",
+                (time.time() - self.retention,),
+            ).rowcount
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {
+            **{status: counts.get(status, 0) for status in ("queued", "running", *TERMINAL)},
+            "max_queued": self.max_queued,
+        }
+
+    @staticmethod
+    def _describe(row):
+        job = {
+            "id": row["id"],
+            "status": row["status"],
+            "priority": row["priority"],
+            "images": row["image_count"],
+            "attempts": row["attempts"],
+            "worker": row["worker"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "callback_url": row["callback_url"],
+        }
+        if row["results"] is not None:
+            job["results"] = json.loads(row["results"])
+        if row["timings"] is not None:
+            job["timings"] = json.loads(row["timings"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+        return job
+
+
+async def wait_for(store, job_id, timeout, poll_interval=0.25):
+    """Poll until the job finishes or ``timeout`` passes; returns the latest state (None if unknown)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = await asyncio.to_thread(store.get, job_id)
+        if job is None or job["status"] in TERMINAL or time.monotonic() >= deadline:
+            return job
+        await asyncio.sleep(min(poll_interval, max(0.0, deadline - time.monotonic())))
+
+
+async def run_job(store, job, worker, pipeline, heartbeat_interval):
+    """Run every image of ``job`` through ``pipeline.run_detection`` and record the outcome."""
+    from backend.observability import collect_stages
+
+    async def beat():
+        while True:
+            await asyncio.sleep(heartbeat_interval)
+            await asyncio.to_thread(store.heartbeat, job["id"], worker)
+
+    heartbeat = asyncio.create_task(beat())
+    started = time.perf_counter()
+    try:
+        with collect_stages() as stages:
+            outcomes = await asyncio.gather(*(pipeline.run_detection(data) for _, data in job["images"]))
+        results = [
+            {"filename": filename, "status_code": status_code, **body}
+            for (filename, _), (status_code, body) in zip(job["images"], outcomes)
+        ]
+        status, error = "completed", None
+    except Exception as e:
+        logger.exception("Job failed", extra={"job": job["id"]})
+        results, stages, status, error = None, {}, "failed", str(e)
+    finally:
+        heartbeat.cancel()
+    timings = {
+        "queue_wait_s": round(job["started_at"] - job["created_at"], 4),
+        "run_s": round(time.perf_counter() - started, 4),
+        "stages": stages,
+    }
+    results = jsonable_encoder(results)
+    if not await asyncio.to_thread(store.finish, job["id"], worker, status, results, timings, error):
+        logger.warning("Job was reclaimed before it finished", extra={"job": job["id"]})
+        return
+    logger.info("Job finished", extra={"job": job["id"], "status": status, "run_s": timings["run_s"]})
+    if job["callback_url"]:
+        await deliver_callback(pipeline.http_client, job["callback_url"], await asyncio.to_thread(store.get, job["id"]))
+
+
+def callback_allowed(url, prefixes):
+    """Whether ``url`` has the scheme and host of one of ``prefixes`` and starts with its path."""
+    target = urlsplit(url)
+    for prefix in prefixes:
+        allowed = urlsplit(prefix)
+        if (target.scheme, target.netloc) == (allowed.scheme, allowed.netloc) and \
+                target.path.startswith(allowed.path or "/"):
+            return True
+    return False
+
+
+async def deliver_callback(http_client, url, job):
+    """POST the finished job to its callback URL; failures are logged, never raised.
+
+    Each callback host gets its own retry and circuit-breaker state, so one
+    client's dead endpoint does not stop everyone else's callbacks.
+    """
+    from backend.resilience import dependency
+
+    async def attempt():
+        response = await http_client.post(url, json=job, timeout=10)
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    try:
+        response = await dependency(f"callback:{urlsplit(url).netloc}").call(attempt)
+        if response.status_code >= 400:
+            logger.warning("Job callback rejected", extra={"job": job["id"], "status": response.status_code})
+    except Exception as e:
+        logger.warning("Job callback failed: %s", e, extra={"job": job["id"]})
+
+
+async def run_worker(db_path, name, concurrency, stop_event, poll_interval=0.5, heartbeat_interval=5.0):
+    """One worker process: the backend lifespan plus ``concurrency`` claim loops."""
+    from backend import backend as pipeline
+
+    store = JobStore(db_path)
+
+    async def slot():
+        while not stop_event.is_set():
+            job = await asyncio.to_thread(store.claim, name)
+            if job is None:
+                await asyncio.sleep(poll_interval)
+                continue
+            logger.info("Job claimed", extra={"job": job["id"], "images": len(job["images"])})
+            await run_job(store, job, name, pipeline, heartbeat_interval)
+
+    async with pipeline.lifespan(pipeline.app):
+        # Claim nothing until the detector and OCR engine are up.
+        await pipeline.startup.wait_ready()
+        logger.info("Job worker started", extra={"worker": name, "concurrency": concurrency})
+        await asyncio.gather(*(slot() for _ in range(concurrency)))
+
+
+def _worker_main(db_path, name, concurrency, stop_event, poll_interval, heartbeat_interval, ocr_workers):
+    # The worker runs the backend lifespan itself; it must not start a pool of its own.
+    os.environ["JOBS_ENABLED"] = "0"
+    # A local OCR engine would otherwise start one process per core in every worker.
+    os.environ.setdefault("OCR_WORKERS", str(ocr_workers))
+    # Its detections reach the API's sighting aggregates through detection_logs.
+    os.environ["SIGHTINGS_ENABLED"] = "0"
+    # Vision tickets live in the process that issued them, which no API call
+    # can reach, so a job waits for the vision verdict instead.
+    os.environ["VISION_MODE"] = "inline"
+    asyncio.run(run_worker(db_path, f"{name}:{os.getpid()}", concurrency, stop_event,
+                           poll_interval, heartbeat_interval))
+
+
+class WorkerPool:
+    """Worker processes for one job database; dead workers are restarted by :meth:`check`.
+
+    Unless ``OCR_WORKERS`` is set, each worker's local OCR pool gets an
+    equal share of the cores.
+    """
+
+    def __init__(self, db_path, processes=2, concurrency=2, poll_interval=0.5, heartbeat_interval=5.0):
+        self.db_path = str(db_path)
+        self.processes = processes
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        # spawn, not fork: the parent holds an event loop, sockets and threads.
+        self._context = multiprocessing.get_context("spawn")
+        self._stop = self._context.Event()
+        self._workers = {}
+        self.restarts = 0
+
+    def start(self):
+        for i in range(self.processes):
+            self._spawn(f"worker-{i}")
+
+    def _spawn(self, name):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.db_path, name, self.concurrency, self._stop, self.poll_interval, self.heartbeat_interval,
+                  max(1, (os.cpu_count() or 1) // max(1, self.processes))),
+            name=name,
+            daemon=True,
+        )
+        process.start()
+        self._workers[name] = process
+
+    def check(self):
+        """Restart workers that exited; returns how many were restarted."""
+        restarted = 0
+        for name, process in list(self._workers.items()):
+            if not process.is_alive() and not self._stop.is_set():
+                logger.warning("Job worker exited, restarting", extra={"worker": name, "exitcode": process.exitcode})
+                self._spawn(name)
+                restarted += 1
+        self.restarts += restarted
+        return restarted
+
+    def stop(self, grace=30.0):
+        """Let workers finish their current jobs for up to ``grace`` seconds, then terminate them."""
+        self._stop.set()
+        deadline = time.monotonic() + grace
+        for process in self._workers.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+        for process in self._workers.values():
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def stats(self):
+        return {
+            "processes": self.processes,
+            "concurrency": self.concurrency,
+            "alive": sum(p.is_alive() for p in self._workers.values()),
+            "restarts": self.restarts,
+        }
+
+
+def main():
+    from dotenv import load_dotenv
+
+    from backend.observability import configure_logging
+
+    load_dotenv(DEFAULT_DB_PATH.parent / ".env")
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Run detection job workers against a job database.")
+    parser.add_argument("--db", default=os.getenv("JOB_DB_PATH", str(DEFAULT_DB_PATH)))
+    parser.add_argument("--processes", type=int, default=int(os.getenv("JOB_WORKERS", "2")))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("JOB_WORKER_CONCURRENCY", "2")))
+    args = parser.parse_args()
+    JobStore(args.db)  # create the schema before the workers race for it
+    pool = WorkerPool(args.db, args.processes, args.concurrency)
+    pool.start()
+    try:
+        while True:
+            time.sleep(5)
+            pool.check()
+    except KeyboardInterrupt:
+        pool.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Logging setup and Prometheus metrics for the backend.
+
+``configure_logging`` sets the level from ``LOG_LEVEL`` (default INFO) and
+the format from ``LOG_FORMAT`` (``text`` or ``json``). Fields passed with
+``extra=`` are kept as structured fields: appended as ``key=value`` in
+text mode and as top-level keys in JSON mode.
+
+Pipeline stages are timed with :func:`timed` into one histogram labelled
+by stage; inside :func:`collect_stages` the same timings are also kept
+for the caller, which is how job results report their own stage times. Dependency outcomes, retries and breaker state are recorded by
+:mod:`backend.resilience`. :func:`render` produces the ``/metrics`` payload.
+"""
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+STAGES = ("decode", "resize", "detect", "crop", "ocr", "db_lookup", "logging", "vision")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    "plate_reader_stage_seconds", "Time spent in each pipeline stage", ["stage"], buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "plate_reader_stage_errors_total", "Post-OCR stages that failed or timed out", ["stage", "reason"],
+)
+REQUEST_SECONDS = Histogram(
+    "plate_reader_request_seconds", "End-to-end request latency", ["endpoint", "status"], buckets=LATENCY_BUCKETS,
+)
+DEPENDENCY_CALLS = Counter(
+    "plate_reader_dependency_calls_total", "Calls to external dependencies by final outcome",
+    ["dependency", "outcome"],
+)
+DEPENDENCY_RETRIES = Counter(
+    "plate_reader_dependency_retries_total", "Retried attempts per dependency", ["dependency"],
+)
+DEPENDENCY_HEDGES = Counter(
+    "plate_reader_dependency_hedges_total", "Hedged attempts started per dependency", ["dependency"],
+)
+DEPENDENCY_QUEUE_SECONDS = Histogram(
+    "plate_reader_dependency_queue_seconds", "Time calls waited for a dependency concurrency slot",
+    ["dependency"], buckets=LATENCY_BUCKETS,
+)
+DEPENDENCY_ATTEMPT_SECONDS = Histogram(
+    "plate_reader_dependency_attempt_seconds", "Latency of successful attempts per dependency",
+    ["dependency"], buckets=LATENCY_BUCKETS,
+)
+COALESCED = Counter(
+    "plate_reader_coalesced_total", "Requests answered by joining identical in-flight work", ["flight"],
+)
+STARTUP_SECONDS = Gauge(
+    "plate_reader_startup_seconds", "Seconds from process start until each component, warmup and the backend were ready",
+    ["phase"],
+)
+CIRCUIT_OPEN = Gauge(
+    "plate_reader_circuit_open", "1 while a dependency's circuit breaker is open or half-open", ["dependency"],
+)
+
+# Create every stage series up front so dashboards see zeros, not gaps.
+for _stage in STAGES:
+    STAGE_SECONDS.labels(_stage)
+
+
+# Per-caller stage log; a list because stages finish on worker threads too
+# (asyncio.to_thread copies the context, so they append to the same list).
+_stage_log = contextvars.ContextVar("stage_log", default=None)
+
+
+@contextmanager
+def timed(stage):
+    """Observe the duration of the ``with`` block under ``stage``."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        log = _stage_log.get()
+        if log is not None:
+            log.append((stage, elapsed))
+
+
+@contextmanager
+def collect_stages():
+    """Collect the stages timed inside the block (including tasks it spawns).
+
+    Yields a dict that is filled in on exit with ``stage -> {"count",
+    "seconds"}``; concurrent stages (e.g. OCR of several plates) are summed.
+    """
+    summary = {}
+    log = []
+    token = _stage_log.set(log)
+    try:
+        yield summary
+    finally:
+        _stage_log.reset(token)
+        for stage, elapsed in log:
+            entry = summary.setdefault(stage, {"count": 0, "seconds": 0.0})
+            entry["count"] += 1
+            entry["seconds"] += elapsed
+        for entry in summary.values():
+            entry["seconds"] = round(entry["seconds"], 4)
+
+
+def render():
+    """The Prometheus exposition body and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _extra_fields(record):
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS}
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_extra_fields(record),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level=None, fmt=None):
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "text")).lower()
+    handler = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # Per-request client logs from httpx would drown out the pipeline's own.
+    logging.getLogger("httpx").setLevel(max(logging.WARNING, root.level))
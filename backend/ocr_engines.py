@@ -0,0 +1,211 @@
+"""Plate OCR engines.
+
+Engines take base64-encoded JPEG crops and return the raw recognised text;
+turning that text into a plate number stays in the backend. Pick one with
+``OCR_ENGINE`` (``paddle`` for the remote PaddleOCR API, ``easyocr`` for a
+local in-process model) or pass ``engine=`` to :func:`create_ocr_engine`.
+"""
+import asyncio
+import base64
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+
+from backend.resilience import CircuitOpenError, Overloaded, dependency
+
+logger = logging.getLogger(__name__)
+
+
+class OcrError(Exception):
+    """An OCR failure that maps onto an HTTP status for the client."""
+
+    def __init__(self, status_code, message, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+
+class OcrEngine:
+    """Base interface; engines override :meth:`read` and may batch."""
+
+    name = "base"
+
+    async def read(self, crop_base64):
+        raise NotImplementedError
+
+    async def read_batch(self, crops):
+        """Read several crops; failures come back as :class:`OcrError` items."""
+        results = await asyncio.gather(*(self.read(crop) for crop in crops), return_exceptions=True)
+        return [r if not isinstance(r, BaseException) or isinstance(r, OcrError) else OcrError(500, str(r))
+                for r in results]
+
+    async def close(self):
+        pass
+
+
+class RemotePaddleOCR(OcrEngine):
+    """The hosted PaddleOCR layout-parsing API behind the ``ocr`` dependency."""
+
+    name = "paddle"
+
+    def __init__(self, http_client, url, token, timeout=60, concurrency=4):
+        self.http_client = http_client
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+        self.dependency = dependency("ocr")
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def _post(self, payload, headers):
+        """One attempt; retries and circuit breaking live in the dependency."""
+        async with self._slots:
+            try:
+                response = await self.http_client.post(self.url, json=payload, headers=headers, timeout=self.timeout)
+            except httpx.TimeoutException:
+                raise OcrError(504, "PaddleOCR API timed out")
+        if response.status_code != 200:
+            raise OcrError(502, f"PaddleOCR API failed with status {response.status_code}")
+        return response
+
+    async def read(self, crop_base64):
+        headers = {
+            "Authorization": f"token {self.token}",
+            "Content-Type": "application/json"
+        }
+
+        payload = {
+            "file": crop_base64,
+            "fileType": 1,
+            "useDocOrientationClassify": False,
+            "useDocUnwarping": False,
+            "useChartRecognition": False,
+        }
+
+        logger.debug("Calling PaddleOCR API: %s", self.url)
+
+        try:
+            ocr_response = await self.dependency.call(
+                self._post, payload, headers,
+                give_up=lambda e: isinstance(e, OcrError) and e.status_code < 500,
+            )
+        except Overloaded as e:
+            raise OcrError(429, str(e), e.retry_after)
+        except CircuitOpenError as e:
+            raise OcrError(503, str(e))
+        except Exception as e:
+            logger.error("PaddleOCR failed after multiple attempts: %s", e)
+            raise OcrError(502, "OCR processing failed after retries")
+
+        result = ocr_response.json().get("result", {})
+        if not result.get("layoutParsingResults"):
+            logger.info("No layout parsing results from OCR")
+            raise OcrError(422, "No OCR text found")
+
+        return result["layoutParsingResults"][0].get("markdown", {}).get("text", "")
+
+
+# Per-process EasyOCR reader, created once by the pool initializer.
+_reader = None
+_allowlist = None
+
+
+def _init_reader(languages, allowlist):
+    global _reader, _allowlist
+    import easyocr
+    import numpy as np
+    import torch
+
+    # One thread per worker: the pool itself provides the parallelism.
+    torch.set_num_threads(1)
+    _reader = easyocr.Reader(list(languages), gpu=False, verbose=False)
+    _allowlist = allowlist
+    _reader.readtext(np.zeros((32, 128, 3), np.uint8), detail=0)
+
+
+def _read_chunk(crops):
+    import cv2
+    import numpy as np
+
+    texts = []
+    for data in crops:
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            texts.append("")
+            continue
+        texts.append(" ".join(_reader.readtext(image, detail=0, allowlist=_allowlist)))
+    return texts
+
+
+class EasyOcrEngine(OcrEngine):
+    """EasyOCR running locally in a pool of warm worker processes.
+
+    Each worker loads its model once at startup, so a read costs local CPU
+    time only. Batches are split across the workers in one round trip each.
+    """
+
+    name = "easyocr"
+
+    def __init__(self, workers=None, languages=("en",), allowlist="0123456789"):
+        self.workers = workers or os.cpu_count() or 1
+        # Spawned, not forked: the parent has live threads and an event loop.
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_reader,
+            initargs=(tuple(languages), allowlist),
+        )
+        # Start every worker now rather than on the first request.
+        for future in [self._pool.submit(_read_chunk, []) for _ in range(self.workers)]:
+            future.result()
+
+    async def _run(self, crops):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, _read_chunk, crops)
+
+    async def read(self, crop_base64):
+        text = (await self._run([base64.b64decode(crop_base64)]))[0]
+        if not text:
+            raise OcrError(422, "No text found in OCR result")
+        return text
+
+    async def read_batch(self, crops):
+        if not crops:
+            return []
+        data = [base64.b64decode(crop) for crop in crops]
+        size = -(-len(data) // self.workers)
+        chunks = [data[i:i + size] for i in range(0, len(data), size)]
+        outcomes = await asyncio.gather(*(self._run(chunk) for chunk in chunks), return_exceptions=True)
+        results = []
+        # A failed chunk (e.g. a crashed worker) fails only its own crops.
+        for chunk, outcome in zip(chunks, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.warning("EasyOCR chunk of %d crop(s) failed: %s", len(chunk), outcome)
+                error = outcome if isinstance(outcome, OcrError) else OcrError(500, str(outcome))
+                results.extend([error] * len(chunk))
+            else:
+                results.extend(text if text else OcrError(422, "No text found in OCR result") for text in outcome)
+        return results
+
+    async def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def create_ocr_engine(engine=None, http_client=None, **kwargs):
+    """Build the configured OCR engine (``OCR_ENGINE``, default paddle)."""
+    engine = (engine or os.getenv("OCR_ENGINE", "paddle")).lower()
+    if engine == "paddle":
+        return RemotePaddleOCR(
+            http_client,
+            kwargs.pop("url", None) or os.getenv("OCR_API_URL"),
+            kwargs.pop("token", None) or os.getenv("OCR_TOKEN"),
+            **kwargs,
+        )
+    if engine == "easyocr":
+        if os.getenv("OCR_WORKERS"):
+            kwargs.setdefault("workers", int(os.getenv("OCR_WORKERS")))
+        return EasyOcrEngine(**kwargs)
+    raise ValueError(f"Unknown OCR_ENGINE: {engine}")
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from backend.fuzzy_index import FuzzyPlateIndex
+
+logger = logging.getLogger(__name__)
+
+
+class PlateIndex:
+    """In-process copy of the ``license_plates`` table keyed by plate number.
+
+    The table is loaded in pages at startup and then refreshed incrementally
+    from ``updated_column`` (rows whose value is at or past the last seen
+    watermark are re-fetched). That misses edits that leave the column
+    alone and deleted rows, so every ``full_reload`` seconds the whole
+    table is loaded again into a new index that replaces the old one. Plates missing from the index are checked
+    against the database once and the miss is remembered in a bounded TTL
+    cache. If the index has not refreshed within ``staleness`` seconds,
+    lookups fall through to the database.
+
+    With ``fuzzy_distance`` > 0 the loaded plates are also indexed for
+    :meth:`fuzzy_match`, which maps a misread plate onto the registered
+    plate it most likely is.
+    """
+
+    def __init__(self, client, table="license_plates", updated_column="registration_date",
+                 page_size=1000, staleness=300.0, miss_ttl=60.0, miss_max_entries=10000,
+                 fuzzy_distance=1, full_reload=300.0):
+        self.client = client
+        self.table = table
+        self.updated_column = updated_column
+        self.page_size = page_size
+        self.staleness = staleness
+        self.miss_ttl = miss_ttl
+        self.miss_max_entries = miss_max_entries
+        self.fuzzy_distance = fuzzy_distance
+        self.full_reload = full_reload
+        self._rows = {}
+        self._fuzzy = self._new_fuzzy()
+        self._misses = OrderedDict()  # plate number -> expires_at
+        self._watermark = None
+        self._refreshed_at = None
+        self._loaded_at = None
+        self._loaded = asyncio.Event()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.fuzzy_matches = 0
+        self.fuzzy_ambiguous = 0
+
+    @property
+    def fresh(self):
+        return self._refreshed_at is not None and time.monotonic() - self._refreshed_at < self.staleness
+
+    def _new_fuzzy(self):
+        return FuzzyPlateIndex(self.fuzzy_distance) if self.fuzzy_distance > 0 else None
+
+    def _add(self, rows, target=None):
+        """Index ``rows`` into ``target`` (a ``(rows, fuzzy)`` pair being built) or the live index."""
+        plates, fuzzy = target or (self._rows, self._fuzzy)
+        for row in rows:
+            plate_number = row.get("plate_number")
+            if not plate_number:
+                continue
+            plates[plate_number] = row
+            self._misses.pop(plate_number, None)
+            if fuzzy is not None:
+                fuzzy.add(plate_number)
+            updated = row.get(self.updated_column)
+            if updated is not None and (self._watermark is None or str(updated) > self._watermark):
+                self._watermark = str(updated)
+
+    async def _fetch_pages(self, since=None, target=None):
+        start = 0
+        while True:
+            query = self.client.table(self.table).select("*")
+            if since is not None:
+                query = query.gte(self.updated_column, since)
+            response = await query.order("plate_number").range(start, start + self.page_size - 1).execute()
+            rows = response.data or []
+            self._add(rows, target)
+            if len(rows) < self.page_size:
+                return
+            start += self.page_size
+
+    async def load(self):
+        """Full paged load of the table into a new index, which then replaces the current one."""
+        started = time.perf_counter()
+        target = ({}, self._new_fuzzy())
+        await self._fetch_pages(target=target)
+        self._rows, self._fuzzy = target
+        self._refreshed_at = self._loaded_at = time.monotonic()
+        self._loaded.set()
+        logger.info("Plate index loaded %d plate(s) in %.2fs", len(self._rows), time.perf_counter() - started)
+
+    async def wait_loaded(self):
+        """Wait for the first full load to finish."""
+        await self._loaded.wait()
+
+    async def refresh(self):
+        """Incremental refresh from the watermark, or a full load when none has run for ``full_reload`` seconds."""
+        if self._watermark is None or self._loaded_at is None or time.monotonic() - self._loaded_at >= self.full_reload:
+            await self.load()
+            return
+        await self._fetch_pages(since=self._watermark)
+        self._refreshed_at = time.monotonic()
+
+    async def run(self, interval):
+        """Background task: initial load, then periodic incremental refreshes."""
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Plate index refresh failed: %s", e)
+            await asyncio.sleep(interval)
+
+    def _known_miss(self, plate_number):
+        expires_at = self._misses.get(plate_number)
+        if expires_at is None:
+            return False
+        if expires_at <= time.monotonic():
+            del self._misses[plate_number]
+            return False
+        return True
+
+    def _remember_miss(self, plate_number):
+        self._misses[plate_number] = time.monotonic() + self.miss_ttl
+        self._misses.move_to_end(plate_number)
+        while len(self._misses) > self.miss_max_entries:
+            self._misses.popitem(last=False)
+
+    async def lookup_many(self, plate_numbers):
+        """Resolve plates to rows, keyed by plate number; unknown plates are omitted."""
+        found = {}
+        pending = []
+        fresh = self.fresh
+        for plate_number in plate_numbers:
+            row = self._rows.get(plate_number) if fresh else None
+            if row is not None:
+                self.hits += 1
+                found[plate_number] = row
+            elif fresh and self._known_miss(plate_number):
+                self.misses += 1
+            else:
+                pending.append(plate_number)
+
+        if pending:
+            self.fallbacks += len(pending)
+            response = await self.client.table(self.table).select("*").in_("plate_number", pending).execute()
+            self._add(response.data or [])
+            for plate_number in pending:
+                row = self._rows.get(plate_number)
+                if row is not None:
+                    found[plate_number] = row
+                else:
+                    self._remember_miss(plate_number)
+        return found
+
+    def fuzzy_match(self, plate_number):
+        """The registered row nearest to ``plate_number``, with a description of the match.
+
+        Returns ``(row, match)``. ``row`` is None when no plate is within
+        the fuzzy distance or when several plates tie for closest (they are
+        listed in ``match["candidates"]``); ``match`` is None when nothing
+        was close enough.
+        """
+        if self._fuzzy is None or self._refreshed_at is None:
+            return None, None
+        nearest = self._fuzzy.nearest(plate_number)
+        if nearest is None:
+            return None, None
+        distance, plates = nearest
+        match = {"type": "fuzzy", "read": plate_number, "distance": distance, "candidates": plates}
+        if len(plates) > 1:
+            self.fuzzy_ambiguous += 1
+            match["ambiguous"] = True
+            return None, match
+        self.fuzzy_matches += 1
+        match["plate_number"] = plates[0]
+        return self._rows[plates[0]], match
+
+    def stats(self):
+        return {
+            "plates": len(self._rows),
+            "fresh": self.fresh,
+            "watermark": self._watermark,
+            "seconds_since_full_load": (
+                time.monotonic() - self._loaded_at if self._loaded_at is not None else None
+            ),
+            "seconds_since_refresh": (
+                time.monotonic() - self._refreshed_at if self._refreshed_at is not None else None
+            ),
+            "hits": self.hits,
+            "cached_misses": self.misses,
+            "database_fallbacks": self.fallbacks,
+            "miss_cache_entries": len(self._misses),
+            "fuzzy": {
+                **self._fuzzy.stats(),
+                "matches": self.fuzzy_matches,
+                "ambiguous": self.fuzzy_ambiguous,
+            } if self._fuzzy is not None else {"enabled": False},
+        }
@@ -0,0 +1,132 @@
+"""Image preprocessing for the detector.
+
+Uploads are decoded at reduced scale when the detector input is much
+smaller than the photo (PIL's JPEG draft mode decodes at 1/2, 1/4 or 1/8
+directly in the DCT), then letterboxed to the detector size without
+stretching. The :class:`LetterboxTransform` maps detector boxes back to
+the original image so plates can be cropped at full resolution.
+"""
+import io
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from backend.observability import timed
+
+PAD_COLOR = (114, 114, 114)
+
+
+@dataclass
+class LetterboxTransform:
+    """Maps detector-space coordinates to the source image.
+
+    ``x_source = (x_detector - pad_x) / scale``, where ``scale`` is the
+    overall factor from source pixels to detector pixels (including any
+    draft-mode reduction).
+    """
+
+    scale: float
+    pad_x: float
+    pad_y: float
+    source_size: tuple
+
+    def to_source(self, predictions):
+        """Copies of ``predictions`` with boxes in source coordinates, clamped to the image."""
+        width, height = self.source_size
+        mapped = []
+        for p in predictions:
+            left = min(max((p["x"] - p["width"] / 2 - self.pad_x) / self.scale, 0), width)
+            top = min(max((p["y"] - p["height"] / 2 - self.pad_y) / self.scale, 0), height)
+            right = min(max((p["x"] + p["width"] / 2 - self.pad_x) / self.scale, 0), width)
+            bottom = min(max((p["y"] + p["height"] / 2 - self.pad_y) / self.scale, 0), height)
+            mapped.append({
+                **p,
+                "x": (left + right) / 2,
+                "y": (top + bottom) / 2,
+                "width": right - left,
+                "height": bottom - top,
+            })
+        return mapped
+
+    def as_dict(self):
+        return {
+            "scale": self.scale,
+            "pad_x": self.pad_x,
+            "pad_y": self.pad_y,
+            "source_width": self.source_size[0],
+            "source_height": self.source_size[1],
+        }
+
+
+def _letterbox_geometry(source_size, target_size):
+    scale = min(target_size[0] / source_size[0], target_size[1] / source_size[1])
+    content = (max(1, round(source_size[0] * scale)), max(1, round(source_size[1] * scale)))
+    pad_x = (target_size[0] - content[0]) // 2
+    pad_y = (target_size[1] - content[1]) // 2
+    return scale, content, pad_x, pad_y
+
+
+class PreparedImage:
+    """A decoded upload: the letterboxed detector input plus its transform."""
+
+    def __init__(self, image_data, image, frame, transform, draft_scale):
+        self._image_data = image_data
+        self._original = image if image.size == transform.source_size else None
+        self.frame = frame
+        self.transform = transform
+        self.draft_scale = draft_scale
+
+    def letterboxed(self):
+        """The detector input as an RGB PIL image (e.g. for perceptual hashing)."""
+        return Image.fromarray(self.frame[:, :, ::-1])
+
+    def original(self):
+        """Full-resolution RGB image for cropping, decoded on first use.
+
+        When draft mode was not used this is the image already decoded;
+        otherwise the upload is decoded again at full size, which only
+        happens for frames that actually contain plates.
+        """
+        if self._original is None:
+            with timed("decode"):
+                self._original = Image.open(io.BytesIO(self._image_data)).convert("RGB")
+        return self._original
+
+
+def prepare_image(image_data, target_size=(640, 640), draft=True):
+    """Decode ``image_data`` and letterbox it to ``target_size``.
+
+    Raises PIL's ``UnidentifiedImageError`` for unreadable uploads.
+    """
+    with timed("decode"):
+        img = Image.open(io.BytesIO(image_data))
+        source_size = img.size
+        scale, content, pad_x, pad_y = _letterbox_geometry(source_size, target_size)
+
+        if draft and img.format == "JPEG":
+            # Ask for the letterbox content size; the decoder picks the largest
+            # 1/2^n reduction that still covers it.
+            img.draft("RGB", content)
+        img = img.convert("RGB")
+    draft_scale = source_size[0] / img.size[0]
+
+    with timed("resize"):
+        resized = img.resize(content, Image.BILINEAR) if img.size != content else img
+        frame = np.full((target_size[1], target_size[0], 3), PAD_COLOR, np.uint8)
+        frame[pad_y:pad_y + content[1], pad_x:pad_x + content[0]] = np.asarray(resized)[:, :, ::-1]
+
+    transform = LetterboxTransform(scale, pad_x, pad_y, source_size)
+    return PreparedImage(image_data, img, frame, transform, draft_scale)
+
+
+def letterbox(frame, target_size=(640, 640)):
+    """Letterbox a BGR array; returns the detector frame and its transform."""
+    height, width = frame.shape[:2]
+    scale, content, pad_x, pad_y = _letterbox_geometry((width, height), target_size)
+    with timed("resize"):
+        resized = cv2.resize(frame, content, interpolation=cv2.INTER_AREA)
+        boxed = np.full((target_size[1], target_size[0], 3), PAD_COLOR, np.uint8)
+        boxed[pad_y:pad_y + content[1], pad_x:pad_x + content[0]] = resized
+    return boxed, LetterboxTransform(scale, pad_x, pad_y, (width, height))
@@ -0,0 +1,369 @@
+"""Retries, circuit breakers, hedging and admission control for external dependencies.
+
+Every external call (detector, OCR, Ollama) goes through a named
+:class:`Dependency` from :func:`dependency`. Each one retries with
+exponential backoff and full jitter, fails fast while its circuit breaker is
+open, and can optionally hedge: if an attempt is slower than a latency
+percentile of recent calls, a second attempt is started and the first to
+finish wins. A dependency can also cap its concurrent calls: further calls
+wait in a bounded queue, and are shed with :class:`Overloaded` when the
+queue is full or the wait runs out. :func:`snapshot` reports state and
+counters for all of them.
+
+Defaults come from ``RESILIENCE_*`` environment variables; per dependency,
+hedging is enabled with ``<NAME>_HEDGE_PERCENTILE`` (e.g.
+``OCR_HEDGE_PERCENTILE=0.95``) and admission with ``<NAME>_MAX_CONCURRENCY``,
+``<NAME>_MAX_QUEUE`` and ``<NAME>_QUEUE_TIMEOUT``.
+"""
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from backend.observability import (
+    CIRCUIT_OPEN,
+    DEPENDENCY_ATTEMPT_SECONDS,
+    DEPENDENCY_CALLS,
+    DEPENDENCY_HEDGES,
+    DEPENDENCY_QUEUE_SECONDS,
+    DEPENDENCY_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing a call to a dependency that is at capacity."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is overloaded, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class AdmissionLimit:
+    """At most ``max_concurrency`` calls in flight and ``max_queue`` waiting.
+
+    A waiting call gives up after ``queue_timeout`` seconds; both that and
+    a full queue are reported to the caller as a shed call.
+    """
+
+    def __init__(self, max_concurrency, max_queue=32, queue_timeout=10.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+
+    async def acquire(self):
+        """Take a slot; returns False if the call should be shed instead."""
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+
+class RetryPolicy:
+    def __init__(self, attempts=3, base_delay=0.5, max_delay=8.0):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """Full-jitter backoff before retry number ``attempt`` (0-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Closed -> open after ``failure_threshold`` consecutive failures.
+
+    While open, calls are rejected for ``reset_timeout`` seconds; then one
+    trial call is let through (half-open) and its outcome closes or
+    re-opens the circuit.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def retry_after(self):
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        if self.state == self.OPEN and self.retry_after() == 0:
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release_trial(self):
+        """Forget an in-flight half-open trial that was cancelled."""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+
+class Dependency:
+    def __init__(self, name, retry=None, breaker=None, hedge_percentile=0.0,
+                 hedge_min_samples=20, window=200, admission=None):
+        self.name = name
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.admission = admission
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies = deque(maxlen=window)
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.shed = 0
+
+    def percentile(self, q):
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def _hedge_delay(self):
+        if not self.hedge_percentile or len(self._latencies) < self.hedge_min_samples:
+            return None
+        return self.percentile(self.hedge_percentile)
+
+    async def _attempt(self, fn, args, kwargs):
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None:
+            return await fn(*args, **kwargs)
+
+        primary = asyncio.ensure_future(fn(*args, **kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        self.hedges += 1
+        DEPENDENCY_HEDGES.labels(self.name).inc()
+        hedge = asyncio.ensure_future(fn(*args, **kwargs))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Both attempts failed; surface the primary's error.
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _retry_after(self):
+        """Rough time until a queued call would get through: one typical call per queue round."""
+        typical = self.percentile(0.5) or 1.0
+        rounds = self.admission.waiting / self.admission.max_concurrency + 1
+        return max(1, math.ceil(typical * rounds))
+
+    @asynccontextmanager
+    async def admitted(self):
+        """Hold one of this dependency's concurrency slots; raises :class:`Overloaded` if shed.
+
+        :meth:`call` takes a slot itself; use this (with ``admit=False``) to
+        keep the slot beyond the call, e.g. while a response streams.
+        """
+        if self.admission is None:
+            yield
+            return
+        started = time.perf_counter()
+        if not await self.admission.acquire():
+            self.shed += 1
+            DEPENDENCY_CALLS.labels(self.name, "shed").inc()
+            retry_after = self._retry_after()
+            logger.warning("%s shed a call (%d in flight, %d queued)", self.name,
+                           self.admission.in_flight, self.admission.waiting,
+                           extra={"dependency": self.name, "retry_after": retry_after})
+            raise Overloaded(self.name, retry_after)
+        DEPENDENCY_QUEUE_SECONDS.labels(self.name).observe(time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            self.admission.release()
+
+    async def call(self, fn, *args, give_up=None, admit=True, **kwargs):
+        """Await ``fn(*args, **kwargs)`` under this dependency's policies.
+
+        ``give_up(exc)`` marks exceptions that are the caller's problem
+        (e.g. an unreadable crop): they are raised immediately and do not
+        count against the breaker. One concurrency slot covers the whole
+        call, retries included.
+        """
+        if admit and self.admission is not None:
+            async with self.admitted():
+                return await self.call(fn, *args, give_up=give_up, admit=False, **kwargs)
+        self.calls += 1
+        for attempt in range(self.retry.attempts):
+            if not self.breaker.allow():
+                self.rejected += 1
+                DEPENDENCY_CALLS.labels(self.name, "rejected").inc()
+                raise CircuitOpenError(self.name, self.breaker.retry_after())
+            started = time.perf_counter()
+            try:
+                result = await self._attempt(fn, args, kwargs)
+            except asyncio.CancelledError:
+                self.breaker.release_trial()
+                raise
+            except Exception as e:
+                if give_up and give_up(e):
+                    self._record(True)
+                    DEPENDENCY_CALLS.labels(self.name, "client_error").inc()
+                    raise
+                self._record(False)
+                if attempt + 1 >= self.retry.attempts:
+                    self.failures += 1
+                    DEPENDENCY_CALLS.labels(self.name, "failure").inc()
+                    raise
+                self.retries += 1
+                DEPENDENCY_RETRIES.labels(self.name).inc()
+                delay = self.retry.delay(attempt)
+                logger.warning(
+                    "%s attempt %d/%d failed (%s); retrying in %.2fs",
+                    self.name, attempt + 1, self.retry.attempts, e, delay,
+                    extra={"dependency": self.name},
+                )
+                await asyncio.sleep(delay)
+            else:
+                elapsed = time.perf_counter() - started
+                self._latencies.append(elapsed)
+                DEPENDENCY_ATTEMPT_SECONDS.labels(self.name).observe(elapsed)
+                self._record(True)
+                self.successes += 1
+                DEPENDENCY_CALLS.labels(self.name, "success").inc()
+                return result
+
+    def _record(self, success):
+        was_closed = self.breaker.state == CircuitBreaker.CLOSED
+        if success:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        closed = self.breaker.state == CircuitBreaker.CLOSED
+        CIRCUIT_OPEN.labels(self.name).set(0 if closed else 1)
+        if was_closed and not closed:
+            logger.error("%s circuit opened after %d consecutive failures", self.name,
+                         self.breaker.consecutive_failures, extra={"dependency": self.name})
+
+    def stats(self):
+        return {
+            "state": self.breaker.state,
+            "retry_after": round(self.breaker.retry_after(), 2),
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "calls": self.calls,
+            "successes": self.successes,
+            "failures": self.failures,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "shed": self.shed,
+            "admission": {
+                "max_concurrency": self.admission.max_concurrency,
+                "in_flight": self.admission.in_flight,
+                "queued": self.admission.waiting,
+                "max_queue": self.admission.max_queue,
+            } if self.admission else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+        }
+
+
+_dependencies = {}
+
+# A local 3B model serves few generations at once; everything else is
+# unlimited unless <NAME>_MAX_CONCURRENCY says otherwise.
+DEFAULT_MAX_CONCURRENCY = {"ollama": 4, "vision": 2}
+
+
+def _admission(name):
+    prefix = name.upper()
+    limit = int(os.getenv(f"{prefix}_MAX_CONCURRENCY", str(DEFAULT_MAX_CONCURRENCY.get(name, 0))))
+    if limit <= 0:
+        return None
+    return AdmissionLimit(
+        limit,
+        max_queue=int(os.getenv(f"{prefix}_MAX_QUEUE", "32")),
+        queue_timeout=float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", "10")),
+    )
+
+
+def dependency(name):
+    """Get or create the shared :class:`Dependency` called ``name``."""
+    if name not in _dependencies:
+        _dependencies[name] = Dependency(
+            name,
+            retry=RetryPolicy(
+                attempts=int(os.getenv("RESILIENCE_ATTEMPTS", "3")),
+                base_delay=float(os.getenv("RESILIENCE_BASE_DELAY", "0.5")),
+                max_delay=float(os.getenv("RESILIENCE_MAX_DELAY", "8")),
+            ),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("RESILIENCE_FAILURE_THRESHOLD", "5")),
+                reset_timeout=float(os.getenv("RESILIENCE_RESET_TIMEOUT", "30")),
+            ),
+            hedge_percentile=float(os.getenv(f"{name.upper()}_HEDGE_PERCENTILE", "0")),
+            admission=_admission(name),
+        )
+    return _dependencies[name]
+
+
+def snapshot():
+    return {name: dep.stats() for name, dep in _dependencies.items()}
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+
+def content_hash(image_data):
+    """Exact-match key for an upload: SHA-256 of the raw bytes."""
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def perceptual_hash(img, hash_size=8):
+    """64-bit difference hash (dHash) of a PIL image.
+
+    Near-identical frames of a stationary car (sensor noise, JPEG re-encoding)
+    land within a few bits of each other. The hash covers the whole scene at
+    8x8, so a different car in the same spot in front of a fixed camera can
+    land within a few bits too.
+    """
+    small = img.convert("L").resize((hash_size + 1, hash_size))
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+class ResultCache:
+    """Two-tier LRU/TTL cache of /detect responses.
+
+    Entries are looked up first by exact content hash and, when
+    ``max_distance`` is not None, then by the closest perceptual hash within
+    ``max_distance`` bits. Eviction is least recently used, bounded by both
+    ``max_entries`` and an approximate ``max_bytes``.
+
+    The perceptual tier is off by default. The hash covers the whole scene,
+    so even a distance of 0 can match two different cars stopped in the same
+    spot in front of a fixed camera and return the first car's plate and
+    driver record for the second.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=16 * 1024 * 1024, ttl=30.0, max_distance=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._entries = OrderedDict()  # content hash -> (expires_at, phash, size, value)
+        self._bytes = 0
+        self.exact_hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, phash=None):
+        """Return ``(value, tier)`` for a hit, or ``(None, None)`` for a miss.
+
+        Pass ``phash=None`` to probe only the exact tier (before decoding).
+        With the perceptual tier off that probe is the only lookup, so it
+        counts the miss itself.
+        """
+        now = time.monotonic()
+        self._expire(now)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry[3], "exact"
+
+        if not self.perceptual:
+            self.misses += 1
+            return None, None
+        if phash is None:
+            return None, None
+
+        best_key, best_distance = None, self.max_distance + 1
+        for candidate, (_, candidate_phash, _, _) in self._entries.items():
+            distance = (candidate_phash ^ phash).bit_count()
+            if distance < best_distance:
+                best_key, best_distance = candidate, distance
+        if best_key is not None:
+            self._entries.move_to_end(best_key)
+            self.perceptual_hits += 1
+            return self._entries[best_key][3], "perceptual"
+
+        self.misses += 1
+        return None, None
+
+    @property
+    def perceptual(self):
+        return self.max_distance is not None
+
+    def put(self, key, phash, value):
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[2]
+        self._entries[key] = (time.monotonic() + self.ttl, phash, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, _, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def _expire(self, now):
+        expired = [k for k, (expires_at, _, _, _) in self._entries.items() if expires_at <= now]
+        for k in expired:
+            self._bytes -= self._entries.pop(k)[2]
+
+    def stats(self):
+        hits = self.exact_hits + self.perceptual_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "exact_hits": self.exact_hits,
+            "perceptual_hits": self.perceptual_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
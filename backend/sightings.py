@@ -0,0 +1,368 @@
+import asyncio
+import logging
+import re
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+DAY = 86400
+AGGREGATES = ("count", "last_seen")
+GROUPS = ("plate_number", "day", "hour")
+
+_DATE_ONLY = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_RELATIVE = re.compile(r"^now(?:\s*-\s*(\d+)\s*([hdw]))?$")
+_UNITS = {"h": HOUR, "d": DAY, "w": 7 * DAY}
+
+
+class InvalidQuery(ValueError):
+    """An aggregate spec that cannot be answered (bad column, operator or time)."""
+
+
+def parse_time(value, now):
+    """Epoch seconds for an ISO date or timestamp, ``today``, ``now`` or ``now-7d``/``now-24h``/``now-2w``.
+
+    Times without a zone are UTC.
+    """
+    text = str(value).strip().lower()
+    if text == "today":
+        return now // DAY * DAY
+    match = _RELATIVE.match(text)
+    if match:
+        amount, unit = match.groups()
+        return now - (int(amount) * _UNITS[unit] if amount else 0)
+    parsed = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _iso(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat(timespec="seconds")
+
+
+def time_range(filters, now):
+    """``(since, until)`` in epoch seconds from the ``created_at`` filters; either may be None.
+
+    A date (or ``today``) covers the whole day, so ``lte 2024-05-07``
+    includes the 7th and ``eq 2024-05-07`` is that day alone.
+    """
+    since, until = None, None
+    for f in filters:
+        if f.get("col") != "created_at" or f.get("val") is None:
+            continue
+        op, value = f.get("op", "eq"), f["val"]
+        try:
+            start = parse_time(value, now)
+        except ValueError:
+            raise InvalidQuery(f"created_at value {value!r} is not a date, time or relative time like now-7d")
+        whole_day = isinstance(value, str) and (_DATE_ONLY.match(value.strip()) or value.strip().lower() == "today")
+        end = start + DAY if whole_day else start
+        if op in ("eq", "gte"):
+            lower = start
+        elif op == "gt":
+            lower = end
+        else:
+            lower = None
+        if op in ("eq", "lte"):
+            upper = end
+        elif op == "lt":
+            upper = start
+        else:
+            upper = None
+        if lower is None and upper is None:
+            raise InvalidQuery(f"created_at does not support '{op}'")
+        if op == "eq" and not whole_day:
+            raise InvalidQuery("created_at 'eq' needs a date")
+        if lower is not None:
+            since = lower if since is None else max(since, lower)
+        if upper is not None:
+            until = upper if until is None else min(until, upper)
+    return since, until
+
+
+def _plate_test(f):
+    op, value = f.get("op", "eq"), f["val"]
+    if op == "eq":
+        return lambda plate: plate == str(value)
+    if op == "neq":
+        return lambda plate: plate != str(value)
+    if op == "in":
+        values = {str(v) for v in (value if isinstance(value, list) else [value])}
+        return lambda plate: plate in values
+    if op == "ilike":
+        # Matches run_chat_query, which wraps ilike values in %...%.
+        needle = str(value).strip("%").casefold()
+        return lambda plate: needle in plate.casefold()
+    if op == "like":
+        pattern = re.compile("^" + re.escape(str(value)).replace("%", ".*").replace("_", ".") + "$")
+        return lambda plate: pattern.match(plate) is not None
+    raise InvalidQuery(f"plate_number does not support '{op}'")
+
+
+def check_spec(spec):
+    """Reject aggregate specs the store cannot answer."""
+    if spec.get("table", "detection_logs") != "detection_logs":
+        raise InvalidQuery("aggregates are only kept for detection_logs")
+    if spec.get("aggregate", "count") not in AGGREGATES:
+        raise InvalidQuery(f"aggregate must be one of {', '.join(AGGREGATES)}")
+    if spec.get("group_by") not in (None, *GROUPS):
+        raise InvalidQuery(f"group_by must be one of {', '.join(GROUPS)}")
+    for f in spec.get("filters", []):
+        if f.get("col") not in (None, "plate_number", "created_at"):
+            raise InvalidQuery(f"aggregates cannot be filtered on {f.get('col')}")
+    if spec.get("limit"):
+        try:
+            limit = int(spec["limit"])
+        except (TypeError, ValueError):
+            raise InvalidQuery(f"limit must be a whole number, not {spec['limit']!r}") from None
+        if limit < 1:
+            raise InvalidQuery("limit must be positive")
+
+
+class SightingAggregates:
+    """Sightings per plate per hour and per day, plus each plate's last sighting.
+
+    Built from ``detection_logs``: the first load reads the last
+    ``daily_retention`` seconds of rows, after which :meth:`refresh` tails
+    the table by ``id``, so detections logged by other processes (job
+    workers, other replicas) are counted too. The local detection writer
+    also passes its inserted rows to :meth:`record`, which counts them
+    straight away; their ids are remembered so the tail skips them.
+
+    Hourly buckets are kept for ``hourly_retention`` seconds and daily
+    buckets for ``daily_retention``; pass None to keep everything. Buckets
+    are UTC.
+    """
+
+    def __init__(self, client=None, table="detection_logs", hourly_retention=7 * DAY,
+                 daily_retention=400 * DAY, page_size=1000):
+        self.client = client
+        self.table = table
+        self.hourly_retention = hourly_retention
+        self.daily_retention = daily_retention
+        self.page_size = page_size
+        self._hourly = defaultdict(dict)  # plate number -> {hour start: count}
+        self._daily = defaultdict(dict)  # plate number -> {day start: count}
+        self._last_seen = {}  # plate number -> epoch seconds
+        self._recorded = set()  # ids counted by record() that the tail has not reached yet
+        self._watermark = None
+        self._pruned_hour = None
+        self._loaded = asyncio.Event()
+        self.sightings = 0
+        self.recorded = 0
+        self.loaded_rows = 0
+        self.queries = 0
+
+    @property
+    def loaded(self):
+        return self._loaded.is_set()
+
+    async def wait_loaded(self, timeout=None):
+        """Wait for the first load; returns False if ``timeout`` passes first."""
+        try:
+            await asyncio.wait_for(self._loaded.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _count(self, plate_number, seen_at, now):
+        if self.hourly_retention is None or seen_at >= now - self.hourly_retention:
+            hour = int(seen_at // HOUR * HOUR)
+            buckets = self._hourly[plate_number]
+            buckets[hour] = buckets.get(hour, 0) + 1
+        if self.daily_retention is None or seen_at >= now - self.daily_retention:
+            day = int(seen_at // DAY * DAY)
+            buckets = self._daily[plate_number]
+            buckets[day] = buckets.get(day, 0) + 1
+        if seen_at > self._last_seen.get(plate_number, 0):
+            self._last_seen[plate_number] = seen_at
+        self.sightings += 1
+
+    @staticmethod
+    def _seen_at(row, now):
+        created_at = row.get("created_at")
+        if created_at:
+            try:
+                return parse_time(created_at, now)
+            except ValueError:
+                pass
+        return now
+
+    def record(self, rows):
+        """Count rows just inserted into ``detection_logs``."""
+        now = time.time()
+        for row in rows:
+            plate_number = row.get("plate_number")
+            if not plate_number:
+                continue
+            row_id = row.get("id")
+            if row_id is not None:
+                if self._watermark is not None and row_id <= self._watermark:
+                    continue
+                self._recorded.add(row_id)
+            self._count(plate_number, self._seen_at(row, now), now)
+            self.recorded += 1
+
+    async def _fetch(self, since=None):
+        now = time.time()
+        while True:
+            query = self.client.table(self.table).select("id,plate_number,created_at")
+            if self._watermark is not None:
+                query = query.gt("id", self._watermark)
+            if since is not None:
+                query = query.gte("created_at", _iso(since))
+            response = await query.order("id").limit(self.page_size).execute()
+            rows = response.data or []
+            for row in rows:
+                row_id = row.get("id")
+                if row_id is not None:
+                    self._watermark = row_id if self._watermark is None else max(self._watermark, row_id)
+                    if row_id in self._recorded:
+                        continue
+                if row.get("plate_number"):
+                    self._count(row["plate_number"], self._seen_at(row, now), now)
+                    self.loaded_rows += 1
+            if self._watermark is not None:
+                self._recorded = {row_id for row_id in self._recorded if row_id > self._watermark}
+            if len(rows) < self.page_size:
+                return
+
+    async def load(self, since=None):
+        """First load: rows since ``since`` (default: the daily retention window)."""
+        started = time.perf_counter()
+        if since is None and self.daily_retention is not None:
+            since = time.time() - self.daily_retention
+        await self._fetch(since)
+        self._loaded.set()
+        logger.info("Sighting aggregates loaded %d row(s) for %d plate(s) in %.2fs",
+                    self.loaded_rows, len(self._last_seen), time.perf_counter() - started)
+
+    async def refresh(self):
+        """Tail rows logged since the last refresh, or do the first load."""
+        if not self.loaded:
+            await self.load()
+            return
+        await self._fetch()
+        self.prune()
+
+    async def run(self, interval):
+        """Background task: first load, then periodic tails of the table."""
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Sighting aggregates refresh failed: %s", e)
+            await asyncio.sleep(interval)
+
+    def prune(self, now=None):
+        """Drop buckets past retention; does the work at most once an hour."""
+        now = time.time() if now is None else now
+        hour = int(now // HOUR)
+        if hour == self._pruned_hour:
+            return
+        self._pruned_hour = hour
+        for retention, width, table in ((self.hourly_retention, HOUR, self._hourly),
+                                        (self.daily_retention, DAY, self._daily)):
+            if retention is None:
+                continue
+            horizon = now - retention
+            for plate_number in list(table):
+                buckets = table[plate_number]
+                for start in [start for start in buckets if start + width <= horizon]:
+                    del buckets[start]
+                if not buckets:
+                    del table[plate_number]
+
+    def query(self, spec, now=None):
+        """Answer an aggregate query spec (see :func:`check_spec`) as result rows."""
+        check_spec(spec)
+        now = time.time() if now is None else now
+        self.queries += 1
+        filters = [f for f in spec.get("filters", []) if f.get("col") and f.get("val") is not None]
+        since, until = time_range(filters, now)
+        plate_filters = [f for f in filters if f["col"] == "plate_number"]
+        tests = [_plate_test(f) for f in plate_filters]
+        exact = [str(f["val"]) for f in plate_filters if f.get("op", "eq") == "eq"]
+        candidates = exact[:1] if exact else self._last_seen
+        plates = [p for p in candidates if p in self._last_seen and all(test(p) for test in tests)]
+        limit = int(spec["limit"]) if spec.get("limit") else None
+
+        if spec.get("aggregate", "count") == "last_seen":
+            rows = [
+                {"plate_number": p, "last_seen": self._last_seen[p]} for p in plates
+                if (since is None or self._last_seen[p] >= since) and (until is None or self._last_seen[p] < until)
+            ]
+            rows.sort(key=lambda row: row["last_seen"], reverse=True)
+            return [{**row, "last_seen": _iso(row["last_seen"])} for row in rows[:limit or 10]]
+
+        # Hourly buckets when the range fits inside the hourly window, daily ones otherwise.
+        group_by = spec.get("group_by")
+        hourly = group_by == "hour" or (
+            group_by != "day" and since is not None
+            and (self.hourly_retention is None or since >= now - self.hourly_retention)
+        )
+        width, table = (HOUR, self._hourly) if hourly else (DAY, self._daily)
+        per_plate = defaultdict(int)
+        per_bucket = defaultdict(int)
+        plates_per_bucket = defaultdict(int)
+        for plate_number in plates:
+            for start, count in table.get(plate_number, {}).items():
+                if (since is None or start + width > since) and (until is None or start < until):
+                    per_plate[plate_number] += count
+                    per_bucket[start] += count
+                    plates_per_bucket[start] += 1
+
+        if group_by == "plate_number":
+            ranked = sorted(per_plate.items(), key=lambda item: (-item[1], item[0]))[:limit or 10]
+            return [{"plate_number": p, "sightings": n, "last_seen": _iso(self._last_seen[p])} for p, n in ranked]
+        if group_by in ("day", "hour"):
+            label = "%Y-%m-%d" if group_by == "day" else "%Y-%m-%d %H:00"
+            starts = sorted(per_bucket)[-limit:] if limit else sorted(per_bucket)
+            return [
+                {group_by: datetime.fromtimestamp(start, timezone.utc).strftime(label),
+                 "sightings": per_bucket[start], "plates": plates_per_bucket[start]}
+                for start in starts
+            ]
+        if exact:
+            last_seen = self._last_seen.get(exact[0])
+            return [{"plate_number": exact[0], "sightings": sum(per_plate.values()),
+                     "last_seen": _iso(last_seen) if last_seen is not None else None}]
+        return [{"sightings": sum(per_plate.values()), "plates": len(per_plate)}]
+
+    def stats(self):
+        return {
+            "loaded": self.loaded,
+            "plates": len(self._last_seen),
+            "sightings": self.sightings,
+            "loaded_rows": self.loaded_rows,
+            "recorded": self.recorded,
+            "watermark": self._watermark,
+            "hourly_buckets": sum(len(b) for b in self._hourly.values()),
+            "daily_buckets": sum(len(b) for b in self._daily.values()),
+            "queries": self.queries,
+        }
+
+
+async def scan_sightings(client, spec, table="detection_logs", page_size=1000, max_window=7 * DAY):
+    """Answer an aggregate spec by reading the matching rows, for use before the store is loaded.
+
+    Only the last ``max_window`` seconds are read, whatever the spec asks
+    for, so one question cannot page through the whole table. Returns
+    ``(rows, truncated)``; ``truncated`` is True when the spec asked for
+    more than that, so the rows only count the last ``max_window`` seconds.
+    """
+    check_spec(spec)
+    now = time.time()
+    since, _ = time_range(spec.get("filters", []), now)
+    truncated = since is None or since < now - max_window
+    if truncated:
+        logger.info("Sightings scan limited to the last %.0f day(s)", max_window / DAY)
+        since = now - max_window
+    store = SightingAggregates(client, table, hourly_retention=None, daily_retention=None, page_size=page_size)
+    await store.load(since)
+    return store.query(spec, now), truncated
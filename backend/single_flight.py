@@ -0,0 +1,35 @@
+import asyncio
+
+from backend.observability import COALESCED
+
+
+class SingleFlight:
+    """Run identical concurrent work once and share the outcome.
+
+    The first caller for a key starts the work as its own task; callers
+    arriving while it runs await the same task. A caller that is cancelled
+    only stops waiting, so the others still get the result. Nothing is kept
+    once the work finishes: completed results are the result cache's job.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._in_flight = {}
+        self.leaders = 0
+        self.joined = 0
+
+    async def do(self, key, fn):
+        """The outcome of ``fn()`` (a coroutine factory), shared with concurrent calls for ``key``."""
+        task = self._in_flight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.joined += 1
+            COALESCED.labels(self.name).inc()
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"in_flight": len(self._in_flight), "leaders": self.leaders, "joined": self.joined}
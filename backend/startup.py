@@ -0,0 +1,148 @@
+"""Background initialization of the backend's dependencies.
+
+Each component (detector, OCR engine, Supabase) is built by an async
+factory that runs after the app has started serving, and is retried with
+capped exponential backoff until it succeeds, so a slow or unreachable
+service delays readiness instead of preventing startup. Once every
+component is up, optional warmup steps (model inference, cache loads) run
+before the backend reports itself ready.
+
+Timings are measured from ``started_at`` (the process's import of the
+backend), and are reported by :meth:`Startup.report` and the
+``plate_reader_startup_seconds`` gauge.
+"""
+import asyncio
+import logging
+import time
+
+from backend.observability import STARTUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class Component:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.state = "pending"
+        self.attempts = 0
+        self.error = None
+        self.ready_after = None
+
+    def report(self):
+        report = {"state": self.state, "attempts": self.attempts}
+        if self.error:
+            report["error"] = self.error
+        if self.ready_after is not None:
+            report["ready_after_s"] = round(self.ready_after, 3)
+        return report
+
+
+class Startup:
+    def __init__(self, started_at, retry_base=1.0, retry_max=30.0, warmup_timeout=60.0):
+        self.started_at = started_at
+        self.warmup_timeout = warmup_timeout
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.components = {}
+        self.warmups = []
+        self.warmup = {"state": "skipped"}
+        self.ready_after = None
+        self._ready = asyncio.Event()
+        self._task = None
+
+    def add(self, name, factory):
+        """Register ``factory`` (an async callable) to initialize ``name``."""
+        self.components[name] = Component(name, factory)
+
+    def add_warmup(self, name, step):
+        """Register an async warmup ``step``; failures and timeouts are logged, not fatal."""
+        self.warmups.append((name, step))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def _elapsed(self):
+        return time.monotonic() - self.started_at
+
+    async def _init(self, component):
+        delay = self.retry_base
+        while True:
+            component.state = "initializing"
+            component.attempts += 1
+            started = time.perf_counter()
+            try:
+                await component.factory()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                component.state = "retrying"
+                component.error = str(e)
+                logger.warning(
+                    "%s initialization failed, retrying in %.0fs: %s", component.name, delay, e,
+                    extra={"component": component.name, "attempt": component.attempts},
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.retry_max)
+                continue
+            component.state = "ready"
+            component.error = None
+            component.ready_after = self._elapsed()
+            STARTUP_SECONDS.labels(component.name).set(component.ready_after)
+            logger.info(
+                "%s ready", component.name,
+                extra={"component": component.name, "init_s": round(time.perf_counter() - started, 3),
+                       "since_start_s": round(component.ready_after, 3)},
+            )
+            return
+
+    async def _run(self):
+        await asyncio.gather(*(self._init(c) for c in self.components.values()))
+        if self.warmups:
+            self.warmup = {"state": "running", "steps": {}}
+            started = time.perf_counter()
+            for name, step in self.warmups:
+                step_started = time.perf_counter()
+                try:
+                    await asyncio.wait_for(step(), self.warmup_timeout)
+                    result = {"state": "done"}
+                except asyncio.TimeoutError:
+                    logger.warning("Warmup step %s timed out after %.0fs", name, self.warmup_timeout)
+                    result = {"state": "timed_out"}
+                except Exception as e:
+                    logger.warning("Warmup step %s failed: %s", name, e)
+                    result = {"state": "failed", "error": str(e)}
+                result["seconds"] = round(time.perf_counter() - step_started, 3)
+                self.warmup["steps"][name] = result
+            self.warmup.update(state="done", seconds=round(time.perf_counter() - started, 3))
+            STARTUP_SECONDS.labels("warmup").set(self.warmup["seconds"])
+        self.ready_after = self._elapsed()
+        STARTUP_SECONDS.labels("ready").set(self.ready_after)
+        logger.info("Backend ready", extra={"cold_start_s": round(self.ready_after, 3)})
+        self._ready.set()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    async def wait_ready(self, timeout=None):
+        """Wait until ready; returns False if ``timeout`` passes first."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def report(self):
+        return {
+            "ready": self.ready,
+            "uptime_s": round(self._elapsed(), 3),
+            "cold_start_s": round(self.ready_after, 3) if self.ready_after is not None else None,
+            "components": {name: c.report() for name, c in self.components.items()},
+            "warmup": self.warmup,
+        }
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
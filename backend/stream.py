@@ -0,0 +1,289 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+
+from backend.preprocess import letterbox
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StreamOptions:
+    """Tuning knobs for one ingestion run (all times in seconds)."""
+
+    active_interval: float = 0.2  # sampling period while there is motion or a live track
+    idle_interval: float = 1.0  # sampling period while the scene is static
+    motion_threshold: float = 0.005  # fraction of changed pixels that counts as motion
+    iou_threshold: float = 0.3  # box overlap needed to continue a track
+    track_ttl: float = 2.0  # a track unseen for this long is closed
+    max_reads_per_track: int = 3  # OCR calls per tracked vehicle
+    min_read_gap: float = 0.5  # spacing between OCR calls on the same track
+    max_frames: int = 0  # stop after this many sampled frames (0 = until the source ends)
+
+
+class MotionGate:
+    """Cheap frame differencing on a blurred, downscaled grayscale copy."""
+
+    def __init__(self, threshold, width=160):
+        self.threshold = threshold
+        self.width = width
+        self._previous = None
+
+    def __call__(self, frame):
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (self.width, max(1, int(h * self.width / w))))
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        previous, self._previous = self._previous, gray
+        if previous is None:
+            return True
+        changed = np.count_nonzero(cv2.absdiff(gray, previous) > 25)
+        return changed / gray.size >= self.threshold
+
+
+def iou(a, b):
+    left, top = max(a[0], b[0]), max(a[1], b[1])
+    right, bottom = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+@dataclass
+class Track:
+    id: int
+    box: tuple
+    first_seen: float
+    last_seen: float
+    last_read: float = float("-inf")
+    readings: list = field(default_factory=list)
+
+    def vote(self):
+        """Most common reading and the share of readings that agree with it."""
+        if not self.readings:
+            return None, 0.0
+        plate_number, count = Counter(self.readings).most_common(1)[0]
+        return plate_number, count / len(self.readings)
+
+
+class PlateTracker:
+    """Greedy IoU tracker that assigns detector boxes to vehicles."""
+
+    def __init__(self, iou_threshold, ttl):
+        self.iou_threshold = iou_threshold
+        self.ttl = ttl
+        self.tracks = {}
+        self._next_id = 1
+
+    def update(self, boxes, now):
+        """Match boxes to tracks; returns ``[(track, is_new)]`` for each box."""
+        matched = []
+        free = set(self.tracks)
+        for box in boxes:
+            best, best_iou = None, self.iou_threshold
+            for track_id in free:
+                overlap = iou(self.tracks[track_id].box, box)
+                if overlap >= best_iou:
+                    best, best_iou = track_id, overlap
+            if best is None:
+                track = Track(self._next_id, box, now, now)
+                self.tracks[track.id] = track
+                self._next_id += 1
+                matched.append((track, True))
+            else:
+                free.discard(best)
+                track = self.tracks[best]
+                track.box, track.last_seen = box, now
+                matched.append((track, False))
+        return matched
+
+    def expire(self, now, force=False):
+        """Remove and return tracks unseen for longer than the TTL."""
+        closed = [t for t in self.tracks.values() if force or now - t.last_seen > self.ttl]
+        for track in closed:
+            del self.tracks[track.id]
+        return closed
+
+
+class FrameSampler:
+    """Reads a video file or stream URL, decoding only the frames it samples.
+
+    Skipped frames are only grabbed, not decoded. Timestamps come from the
+    frame index for files and from the wall clock for live streams.
+    """
+
+    def __init__(self, source):
+        self.capture = cv2.VideoCapture(source)
+        if not self.capture.isOpened():
+            raise ValueError(f"Could not open video source: {source}")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 0.0
+        self.live = not os.path.exists(source) or self.fps <= 0
+        self._index = -1
+        self._started = time.monotonic()
+
+    def _timestamp(self):
+        if self.live:
+            return time.monotonic() - self._started
+        return self._index / self.fps
+
+    def next(self, not_before):
+        """Return ``(timestamp, frame)`` for the first frame at or after ``not_before``."""
+        while True:
+            if not self.capture.grab():
+                return None
+            self._index += 1
+            timestamp = self._timestamp()
+            if timestamp >= not_before:
+                ok, frame = self.capture.retrieve()
+                if not ok:
+                    return None
+                return timestamp, frame
+
+    def close(self):
+        self.capture.release()
+
+
+def source_allowed(source, allowed):
+    """Whether ``source`` is under one of the ``allowed`` URL prefixes or directories."""
+    if "://" in source:
+        return any(source.startswith(prefix) for prefix in allowed if "://" in prefix)
+    path = os.path.realpath(source)
+    for directory in allowed:
+        if "://" in directory:
+            continue
+        directory = os.path.realpath(directory)
+        if os.path.commonpath([path, directory]) == directory:
+            return True
+    return False
+
+
+def _to_box(prediction):
+    x, y, w, h = prediction["x"], prediction["y"], prediction["width"], prediction["height"]
+    return int(x - w / 2), int(y - h / 2), int(x + w / 2), int(y + h / 2)
+
+
+def _encode_crop(frame, box):
+    ok, buffer = cv2.imencode(".jpg", frame[box[1]:box[3], box[0]:box[2]])
+    return base64.b64encode(buffer).decode("ascii") if ok else None
+
+
+async def ingest(source, detect, read, lookup, detector_size=(640, 640), options=None):
+    """Run motion-gated, tracked plate reading over a video source.
+
+    ``detect(frame_bgr)`` returns Roboflow-style predictions for a frame
+    letterboxed to ``detector_size``; ``read(crop_base64)`` returns a plate
+    number; ``lookup(plate_number)`` returns driver info or None. Yields
+    event dicts: ``track_started``, ``reading``, ``vehicle`` (the voted
+    result when a track closes), ``detect_error`` for a frame the detector
+    failed on (the frame is skipped) and a final ``end`` summary.
+    """
+    options = options or StreamOptions()
+    sampler = await asyncio.to_thread(FrameSampler, source)
+    gate = MotionGate(options.motion_threshold)
+    tracker = PlateTracker(options.iou_threshold, options.track_ttl)
+    sampled = detected = reads = detect_errors = 0
+    next_time = 0.0
+    last_detect = float("-inf")
+
+    async def close_tracks(closed):
+        for track in closed:
+            plate_number, agreement = track.vote()
+            yield {
+                "event": "vehicle",
+                "track_id": track.id,
+                "plate_number": plate_number,
+                "agreement": agreement,
+                "readings": track.readings,
+                "first_seen": track.first_seen,
+                "last_seen": track.last_seen,
+                "driver_info": await lookup(plate_number) if plate_number else None,
+            }
+
+    try:
+        while not options.max_frames or sampled < options.max_frames:
+            sample = await asyncio.to_thread(sampler.next, next_time)
+            if sample is None:
+                break
+            timestamp, frame = sample
+            sampled += 1
+
+            moving = gate(frame)
+            busy = moving or bool(tracker.tracks)
+            next_time = timestamp + (options.active_interval if busy else options.idle_interval)
+
+            # Static scenes skip the detector, except for an occasional
+            # refresh that keeps a parked vehicle's track alive.
+            keepalive = bool(tracker.tracks) and timestamp - last_detect >= options.track_ttl / 2
+            if moving or keepalive:
+                last_detect = timestamp
+                detected += 1
+                boxed, transform = letterbox(frame, detector_size)
+                try:
+                    predictions = transform.to_source(await detect(boxed))
+                except Exception as e:
+                    detect_errors += 1
+                    logger.warning("Detection failed on a stream frame, skipping it: %s", e,
+                                   extra={"timestamp": timestamp})
+                    yield {"event": "detect_error", "timestamp": timestamp, "error": str(e)}
+                    continue
+                boxes = [_to_box(p) for p in predictions]
+                boxes = [b for b in boxes if b[2] > b[0] and b[3] > b[1]]
+
+                for track, is_new in tracker.update(boxes, timestamp):
+                    if is_new:
+                        yield {"event": "track_started", "track_id": track.id, "timestamp": timestamp, "box": track.box}
+                    if (len(track.readings) >= options.max_reads_per_track
+                            or timestamp - track.last_read < options.min_read_gap):
+                        continue
+                    crop = _encode_crop(frame, track.box)
+                    if crop is None:
+                        continue
+                    track.last_read = timestamp
+                    reads += 1
+                    try:
+                        plate_number = await read(crop)
+                    except Exception as e:
+                        yield {"event": "reading", "track_id": track.id, "timestamp": timestamp, "error": str(e)}
+                        continue
+                    track.readings.append(plate_number)
+                    yield {"event": "reading", "track_id": track.id, "timestamp": timestamp, "plate_number": plate_number}
+
+            async for event in close_tracks(tracker.expire(timestamp)):
+                yield event
+
+        async for event in close_tracks(tracker.expire(0, force=True)):
+            yield event
+    finally:
+        sampler.close()
+
+    yield {"event": "end", "sampled_frames": sampled, "detector_calls": detected, "ocr_calls": reads,
+           "detector_errors": detect_errors}
+
+
+def to_sse(event):
+    return f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+async def _main(source):
+    from backend import backend
+
+    async with backend.lifespan(backend.app):
+        # Read no frames until the detector and OCR engine are up.
+        await backend.startup.wait_ready()
+        async for event in backend.ingest_events(source):
+            print(json.dumps(event, ensure_ascii=False), flush=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python -m backend.stream <video file or stream URL>")
+        sys.exit(1)
+    asyncio.run(_main(sys.argv[1]))
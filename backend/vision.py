@@ -0,0 +1,107 @@
+import asyncio
+import re
+import time
+import uuid
+from collections import OrderedDict
+
+_DIGIT_GROUPS = re.compile(r"\d+")
+
+
+def vision_reasons(raw_text, prediction, driver_found, min_confidence):
+    """Why a plate read deserves a second opinion; empty when it looks sound.
+
+    A read is suspect when the OCR text is not one 1-3 digit series and one
+    1-4 digit number, when the detector was unsure of the box, or when the
+    plate is not in the database.
+    """
+    reasons = []
+    groups = _DIGIT_GROUPS.findall(raw_text or "")
+    if len(groups) != 2 or not (1 <= len(groups[0]) <= 3 and 1 <= len(groups[1]) <= 4):
+        reasons.append("malformed_digits")
+    if prediction.get("confidence", 1.0) < min_confidence:
+        reasons.append("low_confidence")
+    if not driver_found:
+        reasons.append("db_miss")
+    return reasons
+
+
+class VisionTickets:
+    """Deferred vision checks: run in the background, verdicts fetched by ticket.
+
+    At most ``concurrency`` checks run at once and at most ``max_pending``
+    are outstanding; beyond that new checks are shed. Verdicts are kept for
+    ``ttl`` seconds, bounded by ``max_entries`` (oldest dropped first).
+    """
+
+    def __init__(self, concurrency=2, max_pending=200, ttl=600.0, max_entries=5000):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._slots = asyncio.Semaphore(concurrency)
+        self._verdicts = OrderedDict()  # ticket -> (expires_at, verdict)
+        self._tasks = set()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.shed = 0
+
+    def submit(self, run, timeout, reasons):
+        """Schedule ``run()`` (a coroutine factory); returns a ticket, or None if shed."""
+        if len(self._tasks) >= self.max_pending:
+            self.shed += 1
+            return None
+        ticket = uuid.uuid4().hex
+        self._store(ticket, {"status": "pending", "reasons": reasons})
+        task = asyncio.create_task(self._run(ticket, run, timeout, reasons))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.submitted += 1
+        return ticket
+
+    async def _run(self, ticket, run, timeout, reasons):
+        async with self._slots:
+            try:
+                result = await asyncio.wait_for(run(), timeout)
+                verdict = {"status": "failed" if "error" in result else "completed", **result, "reasons": reasons}
+                if "error" in result:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+            except asyncio.TimeoutError:
+                verdict = {"status": "failed", "error": f"vision timed out after {timeout}s", "reasons": reasons}
+                self.failed += 1
+            except Exception as e:
+                verdict = {"status": "failed", "error": str(e), "reasons": reasons}
+                self.failed += 1
+        self._store(ticket, verdict)
+
+    def _store(self, ticket, verdict):
+        self._verdicts.pop(ticket, None)
+        self._verdicts[ticket] = (time.monotonic() + self.ttl, verdict)
+        while len(self._verdicts) > self.max_entries:
+            self._verdicts.popitem(last=False)
+
+    def get(self, ticket):
+        """The verdict for ``ticket`` (possibly still pending), or None if unknown or expired."""
+        entry = self._verdicts.get(ticket)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._verdicts[ticket]
+            return None
+        return entry[1]
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "pending": len(self._tasks),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "shed": self.shed,
+            "verdicts": len(self._verdicts),
+        }
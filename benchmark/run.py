@@ -0,0 +1,344 @@
+"""Offline load test for the backend against local stand-in services.
+
+Starts the stand-ins from :mod:`benchmark.stand_ins`, starts the backend
+with its Roboflow, PaddleOCR, Ollama and Supabase settings pointed at them,
+then drives ``/detect``, ``/detect/batch``, ``/chat`` and ``/chat/stream`` at a fixed
+concurrency. For every scenario it records latency percentiles, throughput,
+status codes, per-stage timings from the backend's ``/metrics``, its
+per-dependency view (``/resilience``) and what each stand-in served, and writes everything to a JSON file. Pass
+``--baseline`` with an earlier results file to print the change in p50/p95.
+
+    python -m benchmark.run --concurrency 16 --requests 200
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from PIL import Image
+from prometheus_client.parser import text_string_to_metric_families
+
+from benchmark.stand_ins import SERVICES, parse_profiles, urls
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+SCENARIOS = ("detect", "batch", "chat", "chat_stream")
+CHAT_QUESTIONS = [
+    "Who drives Ford cars?",
+    "List drivers with a Toyota",
+    "Which vehicles are Peugeot?",
+    "Show me Renault owners",
+]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def load_images(directory, limit):
+    """JPEG bytes from ``directory``, or synthetic frames if it has none."""
+    paths = sorted(p for p in Path(directory).glob("*") if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    images = [(p.name, p.read_bytes()) for p in paths[:limit]]
+    if images:
+        return images
+    print(f"No images in {directory}; using synthetic 1280x960 frames")
+    synthetic = []
+    for i in range(8):
+        buffer = io.BytesIO()
+        Image.effect_noise((1280, 960), 40 + i * 5).convert("RGB").save(buffer, "JPEG", quality=85)
+        synthetic.append((f"synthetic_{i}.jpg", buffer.getvalue()))
+    return synthetic
+
+
+def backend_env(args, service_urls):
+    env = dict(os.environ)
+    env.update({
+        "DETECTOR_ENGINE": "roboflow-http",
+        "ROBOFLOW_API_URL": service_urls["roboflow"],
+        "RF_API_KEY": "benchmark",
+        "OCR_ENGINE": "paddle",
+        "OCR_API_URL": f"{service_urls['ocr']}/ocr",
+        "OCR_TOKEN": "benchmark",
+        "OLLAMA_API_URL": f"{service_urls['ollama']}/api/generate",
+        "SUPABASE_URL": service_urls["supabase"],
+        "SUPABASE_ANON_KEY": "benchmark",
+        "SUPABASE_SERVICE_ROLE_KEY": "benchmark",
+        "PYTHONUNBUFFERED": "1",
+        "JOBS_ENABLED": "0",
+    })
+    if not args.cache:
+        # Repeated benchmark images and questions would otherwise be served from the caches.
+        env["RESULT_CACHE_TTL"] = "0"
+        env["CHAT_PLAN_CACHE_TTL"] = "0"
+        env["CHAT_RESULT_CACHE_TTL"] = "0"
+    return env
+
+
+async def wait_until_up(client, url, process, timeout=60):
+    """Poll ``url`` until it answers 200; returns the response body."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} while starting ({url})")
+        try:
+            response = await client.get(url, timeout=1)
+            if response.status_code == 200:
+                return response.json()
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def make_request(scenario, images, batch_size):
+    """Return an ``async (client, base_url) -> response`` for one request of ``scenario``."""
+    if scenario == "detect":
+        name, data = random.choice(images)
+        return lambda client, base: client.post(f"{base}/detect", files={"image": (name, data, "image/jpeg")})
+    if scenario == "batch":
+        chosen = [random.choice(images) for _ in range(batch_size)]
+        files = [("images", (name, data, "image/jpeg")) for name, data in chosen]
+        return lambda client, base: client.post(f"{base}/detect/batch", files=files)
+    question = random.choice(CHAT_QUESTIONS)
+    if scenario == "chat_stream":
+        return lambda client, base: stream_chat(client, f"{base}/chat/stream", question)
+    return lambda client, base: client.post(f"{base}/chat", json={"message": question})
+
+
+async def stream_chat(client, url, question):
+    """Consume one /chat/stream response; returns it with ``first_token`` latency attached."""
+    started = time.perf_counter()
+    async with client.stream("POST", url, json={"message": question}) as response:
+        response.first_token = None
+        async for line in response.aiter_lines():
+            if response.first_token is None and line.startswith("event: token"):
+                response.first_token = time.perf_counter() - started
+    return response
+
+
+async def run_scenario(client, base_url, scenario, images, args):
+    """Closed-loop load: ``concurrency`` workers share ``requests`` requests."""
+    latencies, first_tokens, statuses = [], [], {}
+    remaining = args.requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            send = make_request(scenario, images, args.batch_size)
+            started = time.perf_counter()
+            try:
+                response = await send(client, base_url)
+                status = str(response.status_code)
+                if getattr(response, "first_token", None) is not None:
+                    first_tokens.append(response.first_token * 1000)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ms = [latency * 1000 for latency in latencies]
+    ok = statuses.get("200", 0)
+    return {
+        "requests": len(latencies),
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "images_per_s": round(ok * (args.batch_size if scenario == "batch" else 1) / elapsed, 2)
+        if scenario != "chat" and elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(ms) / len(ms), 1) if ms else None,
+            "p50": round(percentile(ms, 0.5), 1) if ms else None,
+            "p95": round(percentile(ms, 0.95), 1) if ms else None,
+            "p99": round(percentile(ms, 0.99), 1) if ms else None,
+            "max": round(max(ms), 1) if ms else None,
+        },
+        "status_codes": statuses,
+        **({"first_token_ms": {
+            "p50": round(percentile(first_tokens, 0.5), 1),
+            "p95": round(percentile(first_tokens, 0.95), 1),
+            "p99": round(percentile(first_tokens, 0.99), 1),
+        }} if first_tokens else {}),
+    }
+
+
+async def stage_totals(client, base_url):
+    """Cumulative ``(count, seconds)`` per pipeline stage from ``/metrics``."""
+    totals = {}
+    text = (await client.get(f"{base_url}/metrics")).text
+    for family in text_string_to_metric_families(text):
+        if family.name != "plate_reader_stage_seconds":
+            continue
+        for sample in family.samples:
+            stage = sample.labels.get("stage")
+            count, seconds = totals.get(stage, (0.0, 0.0))
+            if sample.name.endswith("_count"):
+                totals[stage] = (sample.value, seconds)
+            elif sample.name.endswith("_sum"):
+                totals[stage] = (count, sample.value)
+    return totals
+
+
+def stage_deltas(before, after):
+    """Calls and mean milliseconds per stage between two ``stage_totals`` snapshots."""
+    stages = {}
+    for stage, (count, seconds) in after.items():
+        calls = count - before.get(stage, (0.0, 0.0))[0]
+        if calls:
+            spent = seconds - before.get(stage, (0.0, 0.0))[1]
+            stages[stage] = {"calls": int(calls), "mean_ms": round(spent / calls * 1000, 1)}
+    return stages
+
+
+async def stage_breakdown(client, base_url, service_urls):
+    """The backend's per-dependency view plus what each stand-in served."""
+    breakdown = {"backend": {}, "stand_ins": {}}
+    try:
+        breakdown["backend"]["dependencies"] = (await client.get(f"{base_url}/resilience")).json()
+        breakdown["backend"]["detection_logs"] = (await client.get(f"{base_url}/detect/logs")).json()
+    except (httpx.HTTPError, ValueError) as e:
+        breakdown["backend"]["error"] = str(e)
+    for name, url in service_urls.items():
+        breakdown["stand_ins"][name] = (await client.get(f"{url}/_stats")).json()
+    return breakdown
+
+
+async def reset_stand_ins(client, service_urls):
+    for url in service_urls.values():
+        await client.post(f"{url}/_stats/reset")
+
+
+def print_summary(results, baseline=None):
+    print(f"\n{'scenario':<10}{'reqs':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  status")
+    for scenario, result in results["scenarios"].items():
+        latency = result["latency_ms"]
+        print(f"{scenario:<10}{result['requests']:>6}{result['rps']:>9}{latency['p50']:>10}"
+              f"{latency['p95']:>10}{latency['p99']:>10}  {result['status_codes']}")
+        if "first_token_ms" in result:
+            first = result["first_token_ms"]
+            print(f"    first token p50 {first['p50']} ms  p95 {first['p95']} ms  p99 {first['p99']} ms")
+        for stage, stats in result["stages"]["pipeline"].items():
+            print(f"    stage {stage:<10} {stats['calls']:>5} calls  mean {stats['mean_ms']} ms")
+        for name, stats in result["stages"]["stand_ins"].items():
+            if stats["requests"]:
+                print(f"    {name:<10} {stats['requests']:>5} calls  service p50 {stats['service_ms']['p50']} ms"
+                      f"  p95 {stats['service_ms']['p95']} ms  errors {stats['errors']}")
+        previous = (baseline or {}).get("scenarios", {}).get(scenario)
+        if previous:
+            changes = []
+            for key in ("p50", "p95"):
+                before, after = previous["latency_ms"][key], latency[key]
+                if before and after:
+                    changes.append(f"{key} {100 * (after - before) / before:+.1f}%")
+            if previous.get("rps") and result["rps"]:
+                changes.append(f"rps {100 * (result['rps'] - previous['rps']) / previous['rps']:+.1f}%")
+            print(f"    vs baseline: {', '.join(changes)}")
+
+
+async def benchmark(args):
+    profiles = parse_profiles(args.profile)
+    service_urls = urls("127.0.0.1", args.stand_in_port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    images = load_images(args.images, args.max_images)
+
+    stand_in_cmd = [sys.executable, "-m", "benchmark.stand_ins", "--base-port", str(args.stand_in_port)]
+    for spec in args.profile or []:
+        stand_in_cmd += ["--profile", spec]
+    backend_cmd = [sys.executable, "-m", "uvicorn", "backend.backend:app",
+                   "--host", "127.0.0.1", "--port", str(args.port), "--log-level", "warning"]
+
+    log = open(args.backend_log, "w") if args.backend_log else subprocess.DEVNULL
+    stand_ins = subprocess.Popen(stand_in_cmd, cwd=BASE_DIR, stdout=subprocess.DEVNULL)
+    backend = None
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    try:
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            for url in service_urls.values():
+                await wait_until_up(client, f"{url}/_stats", stand_ins)
+            backend = subprocess.Popen(backend_cmd, cwd=BASE_DIR, env=backend_env(args, service_urls),
+                                       stdout=log, stderr=subprocess.STDOUT)
+            readiness = await wait_until_up(client, f"{base_url}/readyz", backend)
+
+            results = {
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "config": {
+                    "concurrency": args.concurrency,
+                    "requests": args.requests,
+                    "batch_size": args.batch_size,
+                    "images": len(images),
+                    "result_cache": args.cache,
+                    "profiles": {name: vars(profile) for name, profile in profiles.items()},
+                },
+                "startup": readiness,
+                "scenarios": {},
+            }
+            for scenario in args.scenarios:
+                if args.warmup:
+                    warm = argparse.Namespace(**{**vars(args), "requests": args.warmup})
+                    await run_scenario(client, base_url, scenario, images, warm)
+                await reset_stand_ins(client, service_urls)
+                before = await stage_totals(client, base_url)
+                print(f"Running {scenario}: {args.requests} requests at concurrency {args.concurrency}...")
+                result = await run_scenario(client, base_url, scenario, images, args)
+                result["stages"] = await stage_breakdown(client, base_url, service_urls)
+                result["stages"]["pipeline"] = stage_deltas(before, await stage_totals(client, base_url))
+                results["scenarios"][scenario] = result
+    finally:
+        for process in (backend, stand_ins):
+            if process and process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+        if log is not subprocess.DEVNULL:
+            log.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the backend against local stand-in services.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests before each scenario")
+    parser.add_argument("--batch-size", type=int, default=8, help="images per /detect/batch request")
+    parser.add_argument("--images", default=str(BASE_DIR / "data" / "test_images"))
+    parser.add_argument("--max-images", type=int, default=50)
+    parser.add_argument("--profile", action="append", metavar="SERVICE=MEDIAN_MS[:SIGMA[:ERROR_RATE]]",
+                        help=f"latency/error profile for one of: {', '.join(SERVICES)}")
+    parser.add_argument("--cache", action="store_true", help="leave the /detect result cache and the chat caches enabled")
+    parser.add_argument("--port", type=int, default=8100, help="port for the backend under test")
+    parser.add_argument("--stand-in-port", type=int, default=9100, help="first of four stand-in ports")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--backend-log", help="write the backend's output to this file")
+    parser.add_argument("--output", help="results file (default benchmark/results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = asyncio.run(benchmark(args))
+
+    output = Path(args.output or BASE_DIR / "benchmark" / "results" / f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8")) if args.baseline else None
+    print_summary(results, baseline)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
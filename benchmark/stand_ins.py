@@ -0,0 +1,329 @@
+"""Local stand-ins for Roboflow, PaddleOCR, Ollama and Supabase.
+
+Each service runs as its own small FastAPI app on consecutive ports
+(``base_port`` + 0..3) and answers with canned but well-formed responses
+after a simulated latency. Latency is log-normal around a median, so
+``sigma`` controls the tail; ``error_rate`` is the fraction of requests
+that fail with a 500. ``GET /_stats`` on any stand-in reports what it
+served and ``POST /_stats/reset`` clears the counters.
+
+Run on its own with::
+
+    python -m benchmark.stand_ins --profile ocr=400:0.5:0.02
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+SERVICES = ("roboflow", "ocr", "ollama", "supabase")
+
+
+@dataclass
+class Profile:
+    median_ms: float
+    sigma: float = 0.3
+    error_rate: float = 0.0
+
+    def latency(self):
+        return self.median_ms / 1000 * math.exp(random.gauss(0, self.sigma))
+
+    @classmethod
+    def parse(cls, spec):
+        """``median_ms[:sigma[:error_rate]]``, e.g. ``250:0.4:0.01``."""
+        parts = [float(p) for p in spec.split(":")]
+        return cls(*parts)
+
+
+DEFAULT_PROFILES = {
+    "roboflow": Profile(150, 0.3),
+    "ocr": Profile(250, 0.3),
+    "ollama": Profile(400, 0.4),
+    "supabase": Profile(15, 0.3),
+}
+
+
+def parse_profiles(specs):
+    """Defaults overridden by ``service=median_ms:sigma:error_rate`` strings."""
+    profiles = dict(DEFAULT_PROFILES)
+    for spec in specs or []:
+        service, _, value = spec.partition("=")
+        if service not in SERVICES:
+            raise ValueError(f"Unknown stand-in service: {service} (expected one of {', '.join(SERVICES)})")
+        profiles[service] = Profile.parse(value)
+    return profiles
+
+
+# Plates the OCR stand-in reads; the first half are registered in the
+# Supabase stand-in so lookups see both hits and misses.
+PLATES = [f"{series:03d}تونس{number:04d}" for series, number in
+          [(125, 8365), (201, 1442), (87, 9031), (143, 5120), (176, 3307), (99, 7718), (210, 4406), (64, 2285)]]
+REGISTERED = PLATES[:len(PLATES) // 2]
+MAKES = ["Ford", "Toyota", "Peugeot", "Renault"]
+
+
+def _seed_rows():
+    return [
+        {
+            "plate_number": plate,
+            "series": plate[:3],
+            "number": plate[-4:],
+            "driver_name": f"Driver {i}",
+            "driver_id": f"D{i:05d}",
+            "address": "Tunis",
+            "vehicle_make": MAKES[i % len(MAKES)],
+            "vehicle_model": "Model",
+            "vehicle_year": 2015 + i,
+            "registration_date": f"2024-01-{i + 1:02d}",
+            "expiry_date": "2027-01-01",
+            "status": "valid",
+            "violations": i % 3,
+            "notes": "",
+        }
+        for i, plate in enumerate(REGISTERED)
+    ]
+
+
+class StandIn:
+    def __init__(self, name, profile):
+        self.name = name
+        self.profile = profile
+        self.app = FastAPI()
+        self.reset()
+
+        @self.app.get("/_stats")
+        async def stats():
+            return self.stats()
+
+        @self.app.post("/_stats/reset")
+        async def reset():
+            self.reset()
+            return {"ok": True}
+
+    def reset(self):
+        self.requests = 0
+        self.errors = 0
+        self.latencies = []
+
+    async def delay(self):
+        """Simulate service time; returns an error response for injected failures."""
+        self.requests += 1
+        latency = self.profile.latency()
+        self.latencies.append(latency)
+        await asyncio.sleep(latency)
+        if random.random() < self.profile.error_rate:
+            self.errors += 1
+            return JSONResponse(status_code=500, content={"error": f"{self.name} stand-in injected failure"})
+        return None
+
+    def stats(self):
+        ordered = sorted(self.latencies)
+
+        def pct(q):
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1) if ordered else None
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "service_ms": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99)},
+            "profile": vars(self.profile),
+        }
+
+
+def roboflow_stand_in(profile):
+    """Roboflow hosted inference: ``POST /{project}/{version}`` with a base64 body."""
+    stand_in = StandIn("roboflow", profile)
+
+    @stand_in.app.post("/{project}/{version}")
+    async def infer(project: str, version: str, request: Request):
+        await request.body()
+        failure = await stand_in.delay()
+        if failure:
+            return failure
+        # One confident plate and sometimes a second, in 640x640 input coordinates.
+        predictions = [{"x": 320.0, "y": 400.0, "width": 180.0, "height": 50.0,
+                        "confidence": 0.91, "class": "license-plate", "class_id": 0}]
+        if random.random() < 0.3:
+            predictions.append({"x": 140.0, "y": 260.0, "width": 90.0, "height": 28.0,
+                                "confidence": 0.55, "class": "license-plate", "class_id": 0})
+        return {"predictions": predictions, "image": {"width": 640, "height": 640}}
+
+    return stand_in
+
+
+def ocr_stand_in(profile):
+    """PaddleOCR layout-parsing API."""
+    stand_in = StandIn("ocr", profile)
+
+    @stand_in.app.post("/ocr")
+    async def ocr(request: Request):
+        await request.body()
+        failure = await stand_in.delay()
+        if failure:
+            return failure
+        plate = random.choice(PLATES)
+        text = f"{plate[:3]} تونس {plate[-4:]}"
+        return {"result": {"layoutParsingResults": [{"markdown": {"text": text}}]}}
+
+    return stand_in
+
+
+def ollama_stand_in(profile):
+    """Ollama ``/api/generate`` for the chat planner, answers and vision checks."""
+    stand_in = StandIn("ollama", profile)
+
+    @stand_in.app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        failure = await stand_in.delay()
+        if failure:
+            return failure
+        prompt = body.get("prompt", "")
+        if body.get("images"):
+            text = random.choice(PLATES).replace("تونس", "")
+        elif "User question" in prompt:
+            make = random.choice(MAKES)
+            text = ('ACTION: QUERY\nDATA: {"table": "license_plates", "select": "*", '
+                    f'"filters": [{{"col": "vehicle_make", "op": "ilike", "val": "{make}"}}], "limit": 10}}')
+        else:
+            text = "Here are the matching drivers."
+        if body.get("stream"):
+            async def chunks():
+                for word in text.split(" "):
+                    yield json.dumps({"response": word + " ", "done": False}) + "\n"
+                yield json.dumps({"response": "", "done": True}) + "\n"
+            return StreamingResponse(chunks(), media_type="application/x-ndjson")
+        return {"model": body.get("model"), "response": text, "done": True}
+
+    return stand_in
+
+
+_FILTER = re.compile(r"^(eq|neq|gt|gte|lt|lte|like|ilike|in)\.(.*)$", re.DOTALL)
+
+
+def _matches(row, column, op, value):
+    actual = row.get(column)
+    if op == "in":
+        return str(actual) in [v.strip('"') for v in value.strip("()").split(",")]
+    if op in ("like", "ilike"):
+        pattern = "^" + re.escape(value).replace("%", ".*").replace(r"\*", ".*") + "$"
+        return re.match(pattern, str(actual or ""), re.IGNORECASE if op == "ilike" else 0) is not None
+    if actual is None:
+        return False
+    if isinstance(actual, (int, float)):
+        value = float(value)
+    return {
+        "eq": actual == value, "neq": actual != value,
+        "gt": actual > value, "gte": actual >= value,
+        "lt": actual < value, "lte": actual <= value,
+    }[op]
+
+
+def _order_key(value):
+    # Numbers sort numerically (ids), everything else as text.
+    return (0, value, "") if isinstance(value, (int, float)) else (1, 0, str(value))
+
+
+def supabase_stand_in(profile):
+    """Enough PostgREST and Storage to serve the backend's queries and log writes."""
+    stand_in = StandIn("supabase", profile)
+    tables = {"license_plates": _seed_rows(), "detection_logs": []}
+
+    @stand_in.app.get("/rest/v1/{table}")
+    async def select(table: str, request: Request):
+        failure = await stand_in.delay()
+        if failure:
+            return failure
+        rows = tables.get(table, [])
+        params = request.query_params
+        for column, raw in params.multi_items():
+            if column in ("select", "order", "limit", "offset"):
+                continue
+            match = _FILTER.match(raw)
+            if match:
+                rows = [r for r in rows if _matches(r, column, *match.groups())]
+        if "order" in params:
+            column, _, direction = params["order"].partition(".")
+            rows = sorted(rows, key=lambda r: _order_key(r.get(column)), reverse=direction.startswith("desc"))
+        offset = int(params.get("offset", 0))
+        limit = int(params["limit"]) if "limit" in params else None
+        rows = rows[offset:offset + limit if limit is not None else None]
+        columns = params.get("select", "*")
+        if columns != "*":
+            wanted = [c.strip() for c in columns.split(",")]
+            rows = [{c: r.get(c) for c in wanted} for r in rows]
+        return rows
+
+    @stand_in.app.post("/rest/v1/{table}")
+    async def insert(table: str, request: Request):
+        body = await request.json()
+        failure = await stand_in.delay()
+        if failure:
+            return failure
+        rows = body if isinstance(body, list) else [body]
+        stored = tables.setdefault(table, [])
+        # Column defaults, as the real detection_logs table fills them in.
+        now = datetime.now(timezone.utc).isoformat()
+        for row in rows:
+            row.setdefault("id", len(stored) + 1)
+            row.setdefault("created_at", now)
+            stored.append(row)
+        return JSONResponse(status_code=201, content=rows)
+
+    @stand_in.app.post("/storage/v1/object/{path:path}")
+    async def upload(path: str, request: Request):
+        await request.body()
+        failure = await stand_in.delay()
+        if failure:
+            return failure
+        return {"Key": path, "Id": path}
+
+    return stand_in
+
+
+def build(profiles):
+    factories = {
+        "roboflow": roboflow_stand_in,
+        "ocr": ocr_stand_in,
+        "ollama": ollama_stand_in,
+        "supabase": supabase_stand_in,
+    }
+    return {name: factories[name](profiles[name]) for name in SERVICES}
+
+
+def urls(host, base_port):
+    """Base URL of every stand-in, in ``SERVICES`` order on consecutive ports."""
+    return {name: f"http://{host}:{base_port + i}" for i, name in enumerate(SERVICES)}
+
+
+async def serve(profiles, host="127.0.0.1", base_port=9100):
+    stand_ins = build(profiles)
+    servers = [
+        uvicorn.Server(uvicorn.Config(stand_ins[name].app, host=host, port=base_port + i, log_level="warning"))
+        for i, name in enumerate(SERVICES)
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run local stand-ins for the backend's external services.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=9100)
+    parser.add_argument("--profile", action="append", metavar="SERVICE=MEDIAN_MS[:SIGMA[:ERROR_RATE]]",
+                        help=f"latency/error profile for one of: {', '.join(SERVICES)}")
+    args = parser.parse_args()
+    for name, url in urls(args.host, args.base_port).items():
+        print(f"{name}: {url}", flush=True)
+    asyncio.run(serve(parse_profiles(args.profile), args.host, args.base_port))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,214 @@
+import json
 import os
+import random
 import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 from PIL import Image
-from roboflow import Roboflow
-import time
+from backend.detectors import create_detector
 
-DATA_DIR = Path("data")
-PLATES_DIR = Path("cropped_plates")
-FAILED_DIR = Path("failed")
+DATA_DIR = Path(os.environ.get("DATA_DIR", "data"))
+PLATES_DIR = Path(os.environ.get("PLATES_DIR", "cropped_plates"))
+FAILED_DIR = Path(os.environ.get("FAILED_DIR", "failed"))
+# One JSON line per finished image; re-runs skip everything listed here.
+MANIFEST_PATH = Path(os.environ.get("CROP_MANIFEST", "crop_manifest.jsonl"))
 CONFIDENCE_THRESHOLD = 0.6
 OVERLAP = 0.3
 RETRY_DELAY = 5
-
-PLATES_DIR.mkdir(exist_ok=True)
-FAILED_DIR.mkdir(exist_ok=True)
+MAX_RETRIES = int(os.environ.get("CROP_MAX_RETRIES", "5"))
+WORKERS = int(os.environ.get("CROP_WORKERS", "8"))
+# Detector calls per second across all workers (0 = unlimited).
+RATE_LIMIT = float(os.environ.get("CROP_RATE_LIMIT", "10"))
+PROGRESS_INTERVAL = 5
 
 WORKSPACE = "itgateinternship"
 PROJECT = "tunisian-license-plate-xe5yl-d8jgs"
 VERSION = 2
 
-api_key = os.environ.get("RF_API_KEY")
-
-workspace = os.environ.get("WORKSPACE", WORKSPACE)
-project_name = os.environ.get("PROJECT", PROJECT)
-model_version = int(os.environ.get("MODEL_VERSION", VERSION))
-
-if not api_key or not workspace or not project_name:
-    raise ValueError("Missing RF_API_KEY, WORKSPACE, or PROJECT env variables!")
-
-rf = Roboflow(api_key=api_key)
-project = rf.workspace(workspace).project(project_name)
-model = project.version(model_version).model
-
-image_files = sorted(DATA_DIR.glob("*.*"))
-total_images = len(image_files)
-
-for idx, image_path in enumerate(image_files, 1):
-    print(f"[{idx}/{total_images}] Processing: {image_path.name}")
 
-    success = False
-    retries = 0
-    while not success:
+class RateLimiter:
+    """Spaces calls at least ``1 / rate`` seconds apart across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def fingerprint(image_path):
+    stat = image_path.stat()
+    return {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def load_manifest(path):
+    """Finished images by name; a torn last line from a crash is ignored."""
+    done = {}
+    if not path.exists():
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[entry["image"]] = entry
+    return done
+
+
+def detect_with_retries(detector, limiter, image_path):
+    for attempt in range(1, MAX_RETRIES + 1):
+        limiter.wait()
         try:
-            prediction = model.predict(str(image_path), confidence=CONFIDENCE_THRESHOLD, overlap=OVERLAP)
-            success = True
+            return detector.predict(str(image_path))
         except Exception as e:
-            retries += 1
-            print(f"  Roboflow API error: {e} | retrying in {RETRY_DELAY}s... (Attempt {retries})")
-            time.sleep(RETRY_DELAY)
+            if attempt == MAX_RETRIES:
+                raise
+            delay = random.uniform(0, RETRY_DELAY * 2 ** (attempt - 1))
+            print(f"  {image_path.name}: detector error: {e} | retrying in {delay:.1f}s (attempt {attempt}/{MAX_RETRIES})")
+            time.sleep(delay)
 
-    predictions = prediction.json().get("predictions", [])
 
-    if not predictions:
-        print("  No plates detected, moving image to failed folder.")
-        shutil.move(str(image_path), FAILED_DIR / image_path.name)
-        continue
-
-    img = Image.open(image_path)
-
-    for i, p in enumerate(predictions, 1):
-        x, y, w, h = p["x"], p["y"], p["width"], p["height"]
-
-        left = int(x - w / 2)
-        top = int(y - h / 2)
-        right = int(x + w / 2)
-        bottom = int(y + h / 2)
+def process_image(detector, limiter, image_path):
+    """Detect and crop one image; the source file is only read."""
+    entry = {"image": image_path.name, **fingerprint(image_path)}
+    try:
+        predictions = detect_with_retries(detector, limiter, image_path)
+    except Exception as e:
+        return {**entry, "status": "error", "error": str(e)}
 
-        cropped = img.crop((left, top, right, bottom))
-        cropped_filename = PLATES_DIR / f"{image_path.stem}_plate{i}{image_path.suffix}"
-        cropped.save(cropped_filename)
-
-    image_path.unlink()  
-print("Processing complete!")
+    if not predictions:
+        shutil.copy2(image_path, FAILED_DIR / image_path.name)
+        return {**entry, "status": "no_plates", "plates": 0}
+
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+            for i, p in enumerate(predictions, 1):
+                x, y, w, h = p["x"], p["y"], p["width"], p["height"]
+
+                left = max(0, int(x - w / 2))
+                top = max(0, int(y - h / 2))
+                right = min(width, int(x + w / 2))
+                bottom = min(height, int(y + h / 2))
+
+                cropped = img.crop((left, top, right, bottom))
+                cropped_filename = PLATES_DIR / f"{image_path.stem}_plate{i}{image_path.suffix}"
+                cropped.save(cropped_filename)
+    except OSError as e:
+        return {**entry, "status": "error", "error": f"Could not crop: {e}"}
+
+    return {**entry, "status": "done", "plates": len(predictions)}
+
+
+class Progress:
+    def __init__(self, total, skipped):
+        self.total = total
+        self.skipped = skipped
+        self.counts = {"done": 0, "no_plates": 0, "error": 0}
+        self.started = time.monotonic()
+        self._last_report = 0.0
+
+    @property
+    def finished(self):
+        return sum(self.counts.values())
+
+    def update(self, status):
+        self.counts[status] += 1
+        now = time.monotonic()
+        if now - self._last_report >= PROGRESS_INTERVAL or self.finished == self.total:
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.finished / elapsed if elapsed else 0.0
+        remaining = self.total - self.finished
+        eta = f"{remaining / rate / 60:.1f} min" if rate else "unknown"
+        print(
+            f"[{self.finished}/{self.total}] {rate:.2f} img/s | ETA {eta} | "
+            f"cropped {self.counts['done']}, no plates {self.counts['no_plates']}, "
+            f"errors {self.counts['error']} (skipped {self.skipped} already done)"
+        )
+
+
+def main():
+    api_key = os.environ.get("RF_API_KEY")
+    engine = os.environ.get("DETECTOR_ENGINE", "roboflow")
+
+    workspace = os.environ.get("WORKSPACE", WORKSPACE)
+    project_name = os.environ.get("PROJECT", PROJECT)
+    model_version = int(os.environ.get("MODEL_VERSION", VERSION))
+
+    if engine == "roboflow" and (not api_key or not workspace or not project_name):
+        raise ValueError("Missing RF_API_KEY, WORKSPACE, or PROJECT env variables!")
+
+    PLATES_DIR.mkdir(exist_ok=True)
+    FAILED_DIR.mkdir(exist_ok=True)
+
+    detector = create_detector(
+        engine,
+        confidence=CONFIDENCE_THRESHOLD,
+        overlap=OVERLAP,
+        workspace=workspace,
+        project=project_name,
+        version=model_version,
+    )
+
+    # Images that errored last time are retried; changed files are redone.
+    manifest = load_manifest(MANIFEST_PATH)
+    image_files = sorted(DATA_DIR.glob("*.*"))
+    pending = [
+        path for path in image_files
+        if not (path.name in manifest
+                and manifest[path.name]["status"] != "error"
+                and all(manifest[path.name].get(k) == v for k, v in fingerprint(path).items()))
+    ]
+    print(f"{len(image_files)} images in {DATA_DIR}, {len(pending)} to process "
+          f"with {WORKERS} workers at <= {RATE_LIMIT or 'unlimited'} req/s")
+
+    limiter = RateLimiter(RATE_LIMIT)
+    progress = Progress(len(pending), len(image_files) - len(pending))
+    queue = iter(pending)
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool, open(MANIFEST_PATH, "a", encoding="utf-8") as out:
+        # Keep only a small window of images in flight instead of queueing them all.
+        in_flight = set()
+        try:
+            while True:
+                for image_path in queue:
+                    in_flight.add(pool.submit(process_image, detector, limiter, image_path))
+                    if len(in_flight) >= WORKERS * 2:
+                        break
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    entry = future.result()
+                    if entry["status"] == "error":
+                        print(f"  {entry['image']}: failed: {entry['error']}")
+                    out.write(json.dumps(entry) + "\n")
+                    out.flush()
+                    progress.update(entry["status"])
+        except KeyboardInterrupt:
+            print("Interrupted; finishing in-flight images. Re-run to resume.")
+            for future in in_flight:
+                future.cancel()
+            raise
+
+    print("Processing complete!")
+
+
+if __name__ == "__main__":
+    main()
@@ -45,25 +45,44 @@ def detect_plate(image):
             if vision:
                 if "error" in vision:
                     info += f"\n\nAI Validation Error: {vision['error']}"
+                elif vision.get("status") == "skipped":
+                    info += "\n\nAI Validation: not needed (confident read)"
+                elif vision.get("status") in ("pending", "shed"):
+                    info += f"\n\nAI Validation: {vision['status']}"
                 else:
                     info += f"\n\nAI Validation: {vision.get('message', 'No message')}"
                     if not vision.get("match"):
                          info += f"\n   (AI Raw: {vision.get('ai_raw', 'N/A')})"
-            
+
+            # The top-level fields describe the first plate that was read, which
+            # need not be plates[0] when an earlier plate failed.
+            plates = result.get("plates", [])
+            primary = next(
+                (i for i, p in enumerate(plates) if "error" not in p and p.get("plate_number") == plate), None
+            )
+            other_plates = [p for i, p in enumerate(plates) if i != primary]
+            if other_plates:
+                info += f"\n\nOther plates in this image ({len(other_plates)}):"
+                for other in other_plates:
+                    if "error" in other:
+                        info += f"\n- Unreadable plate: {other['error']}"
+                        continue
+                    other_driver = other.get("driver_info")
+                    info += f"\n- {other.get('plate_number', 'Unknown')}"
+                    info += f" ({other_driver.get('driver_name', 'N/A')})" if other_driver else " (not in database)"
+
             annotated_image = image.copy()
             predictions = result.get("predictions", [])
             if predictions:
                 draw = ImageDraw.Draw(annotated_image)
-                orig_w, orig_h = image.size
-                scale_x = orig_w / 640.0
-                scale_y = orig_h / 640.0
-                
+
+                # Boxes come back in the uploaded image's own pixel coordinates.
                 for p in predictions:
                     x, y, w, h = p["x"], p["y"], p["width"], p["height"]
-                    left = (x - w / 2) * scale_x
-                    top = (y - h / 2) * scale_y
-                    right = (x + w / 2) * scale_x
-                    bottom = (y + h / 2) * scale_y
+                    left = x - w / 2
+                    top = y - h / 2
+                    right = x + w / 2
+                    bottom = y + h / 2
                     
                     draw.rectangle([left, top, right, bottom], outline="red", width=5)
             
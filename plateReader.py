@@ -1,25 +1,25 @@
-from roboflow import Roboflow
+from backend.detectors import create_detector
 from dotenv import load_dotenv
+import cv2
 import os
 
 load_dotenv()
 
-WORKSPACE = "itgateinternship"
-PROJECT = "tunisian-license-plate-xe5yl-d8jgs"
-VERSION = 2
-
 TEST_IMAGE_PATH = "data/test_images/test.jpg"
 os.makedirs("predictions", exist_ok=True)
 
 if os.path.exists(TEST_IMAGE_PATH):
     print(f"Test image found at {TEST_IMAGE_PATH}")
 
-rf = Roboflow(api_key=os.getenv("RF_API_KEY"))
-project = rf.workspace(WORKSPACE).project(PROJECT)
-model = project.version(VERSION).model
+# DETECTOR_ENGINE selects hosted Roboflow (default) or a local ONNX model.
+detector = create_detector(confidence=40, overlap=30)
+
+result = detector.predict(TEST_IMAGE_PATH)
 
-prediction = model.predict(TEST_IMAGE_PATH, confidence=40, overlap=30)
-prediction.save("predictions/sample1_pred.jpg")
-result = prediction.json()
+annotated = cv2.imread(TEST_IMAGE_PATH)
+for p in result:
+    x, y, w, h = p["x"], p["y"], p["width"], p["height"]
+    cv2.rectangle(annotated, (int(x - w / 2), int(y - h / 2)), (int(x + w / 2), int(y + h / 2)), (0, 0, 255), 2)
+cv2.imwrite("predictions/sample1_pred.jpg", annotated)
 
-print(result)
+print({"predictions": result})
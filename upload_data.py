@@ -1,28 +1,155 @@
 from roboflow import Roboflow
 from dotenv import load_dotenv
-import os 
+import hashlib
+import json
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 load_dotenv()
 
 WORKSPACE = "itgateinternship"
 PROJECT = "tunisian-license-plate-xe5yl-d8jgs"
 VERSION = 2
 
-rf = Roboflow(api_key=os.getenv("RF_API_KEY"))
-project = rf.workspace(WORKSPACE).project(PROJECT)
+train_folder = os.getenv("UPLOAD_DIR", "data/images")
+# Content hashes of every image/annotation pair already uploaded, one JSON line each.
+LEDGER_PATH = os.getenv("UPLOAD_LEDGER", "upload_ledger.jsonl")
+REPORT_PATH = os.getenv("UPLOAD_REPORT", "upload_report.json")
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "8"))
+MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "4"))
+RETRY_DELAY = 2
 
-train_folder = "data/images"
 
-for filename in os.listdir(train_folder):
-    if filename.endswith(".jpg"):
-        image_path = os.path.join(train_folder, filename)
-        annotation_path = os.path.join(train_folder, filename.replace(".jpg", ".txt"))
-        
-        if os.path.exists(annotation_path):
+def content_hash(image_path, annotation_path):
+    """Hash of the image and its annotation, so relabelled images upload again."""
+    digest = hashlib.sha256()
+    for path in (image_path, annotation_path):
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def load_ledger(path):
+    uploaded = set()
+    if not os.path.exists(path):
+        return uploaded
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                uploaded.add(json.loads(line)["hash"])
+            except (json.JSONDecodeError, KeyError):
+                continue
+    return uploaded
+
+
+def upload_with_retries(project, image_path, annotation_path):
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
             project.upload(
                 image_path=image_path,
                 annotation_path=annotation_path,
                 annotation_format="yolov5"
             )
-            print(f"Uploaded: {filename}")
-        else:
+            return attempt
+        except Exception as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = random.uniform(0, RETRY_DELAY * 2 ** (attempt - 1))
+            print(f"Upload failed for {os.path.basename(image_path)}: {e} | retrying in {delay:.1f}s (attempt {attempt}/{MAX_RETRIES})")
+            time.sleep(delay)
+
+
+def main():
+    rf = Roboflow(api_key=os.getenv("RF_API_KEY"))
+    project = rf.workspace(WORKSPACE).project(PROJECT)
+
+    started = time.monotonic()
+    uploaded = load_ledger(LEDGER_PATH)
+    report = {"uploaded": [], "skipped": [], "missing_annotation": [], "failed": []}
+
+    pending = []
+    duplicates = {}  # digest -> other files with the same content, uploaded once
+    for filename in sorted(os.listdir(train_folder)):
+        if not filename.endswith(".jpg"):
+            continue
+        image_path = os.path.join(train_folder, filename)
+        annotation_path = os.path.join(train_folder, filename.replace(".jpg", ".txt"))
+
+        if not os.path.exists(annotation_path):
             print(f"No annotation for: {filename}")
+            report["missing_annotation"].append(filename)
+            continue
+
+        digest = content_hash(image_path, annotation_path)
+        if digest in uploaded:
+            report["skipped"].append(filename)
+            continue
+        if digest in duplicates:
+            duplicates[digest].append(filename)
+            continue
+        duplicates[digest] = []
+        pending.append((filename, image_path, annotation_path, digest))
+
+    print(f"{len(pending)} to upload, {len(report['skipped'])} already uploaded, "
+          f"{len(report['missing_annotation'])} without annotations")
+
+    with open(LEDGER_PATH, "a", encoding="utf-8") as ledger, \
+            ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        done = 0
+
+        def finish(future, filename, digest):
+            nonlocal done
+            done += 1
+            try:
+                attempts = future.result()
+            except Exception as e:
+                print(f"[{done}/{len(pending)}] Failed: {filename} ({e})")
+                report["failed"].append({"file": filename, "error": str(e)})
+                report["failed"].extend({"file": duplicate, "error": f"same content as {filename}, which failed"}
+                                        for duplicate in duplicates[digest])
+                return
+            # Record each success immediately so an interrupted run resumes cleanly.
+            ledger.write(json.dumps({"hash": digest, "file": filename, "uploaded_at": time.time()}) + "\n")
+            ledger.flush()
+            report["uploaded"].append(filename)
+            report["skipped"].extend(duplicates[digest])
+            print(f"[{done}/{len(pending)}] Uploaded: {filename}" + (f" after {attempts} attempts" if attempts > 1 else ""))
+
+        # Keep only a small window of uploads queued, so an interrupt has little to wait for.
+        queue = iter(pending)
+        in_flight = {}
+        try:
+            while True:
+                for filename, image_path, annotation_path, digest in queue:
+                    in_flight[pool.submit(upload_with_retries, project, image_path, annotation_path)] = (filename, digest)
+                    if len(in_flight) >= UPLOAD_WORKERS * 2:
+                        break
+                if not in_flight:
+                    break
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    finish(future, *in_flight.pop(future))
+        except KeyboardInterrupt:
+            print("Interrupted; recording uploads already running. Re-run to resume.")
+            pool.shutdown(wait=False, cancel_futures=True)
+            for future, (filename, digest) in in_flight.items():
+                if not future.cancelled():
+                    wait([future])
+                    finish(future, filename, digest)
+            raise
+
+    elapsed = time.monotonic() - started
+    summary = {name: len(files) for name, files in report.items()}
+    summary["elapsed_seconds"] = round(elapsed, 1)
+    with open(REPORT_PATH, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary, **report}, f, indent=2)
+
+    print(f"Done in {elapsed:.1f}s: {summary['uploaded']} uploaded, {summary['skipped']} skipped, "
+          f"{summary['failed']} failed, {summary['missing_annotation']} without annotations "
+          f"(report: {REPORT_PATH})")
+
+
+if __name__ == "__main__":
+    main()